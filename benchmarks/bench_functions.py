@@ -0,0 +1,55 @@
+"""
+Micro-benchmarks de las funciones puras del camino de las preguntas, sin credenciales:
+los módulos se importan con los clientes simulados de tests/fakes.py.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_functions.py --number 20000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "app"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
+
+from fakes import install_fakes  # noqa: E402
+
+install_fakes()
+
+from services import conversation_agent  # noqa: E402
+from utils import translate  # noqa: E402
+from utils.language_detection import detect_language_local  # noqa: E402
+
+QUESTION = "Hola, ¿cuándo son los exámenes de certificación de inglés en la escuela de Molina de Segura?"
+ANSWER = "Los exámenes de certificación son en junio y septiembre."
+
+CASES = [
+    ("detectar_aparicion_escuela", lambda: translate.detectar_aparicion_escuela(QUESTION)),
+    ("detectar_escuela", lambda: translate.detectar_escuela(QUESTION)),
+    ("get_response_info (OK)", lambda: conversation_agent.get_response_info(ANSWER)),
+    ("get_response_info (NOT FOUND)", lambda: conversation_agent.get_response_info("NOT FOUND")),
+    ("answer_cache_key", lambda: conversation_agent.answer_cache_key(QUESTION, "murcia", "junio")),
+    ("normalize_text", lambda: translate.normalize_text(QUESTION)),
+    ("detect_language_local", lambda: detect_language_local(QUESTION)),
+    ("unescape_html", lambda: translate.unescape_html("It&#39;s &quot;fine&quot; &amp; done")),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=20000, help="Llamadas por repetición")
+    parser.add_argument("--repeat", type=int, default=5, help="Repeticiones (se muestra la mejor)")
+    parser.add_argument("--filter", default="", help="Solo los casos cuyo nombre contenga este texto")
+    args = parser.parse_args()
+
+    print(f"{'función':<32} {'µs/llamada':>11}")
+    for name, func in CASES:
+        if args.filter not in name:
+            continue
+        best = min(timeit.repeat(func, number=args.number, repeat=args.repeat)) / args.number
+        print(f"{name:<32} {best * 1e6:>11.2f}")
+
+
+if __name__ == "__main__":
+    main()
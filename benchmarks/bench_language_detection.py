@@ -0,0 +1,87 @@
+"""
+Precisión y latencia del detector local de idiomas frente al de la API de Translate.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_language_detection.py            # solo detector local
+    python benchmarks/bench_language_detection.py --remote   # compara con la API (requiere credenciales)
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "app"))
+
+from utils.language_detection import detect_language_local  # noqa: E402
+
+# Frases distintas de las de entrenamiento (utils/language_samples.py)
+CORPUS = [
+    ("es", "¿A qué hora abre la biblioteca de la escuela los sábados?"),
+    ("es", "Me he equivocado al rellenar el formulario de inscripción, ¿qué hago?"),
+    ("es", "Quiero hablar con la profesora de alemán sobre mi nota final"),
+    ("es", "¿Hay descuento en la matrícula para familias numerosas?"),
+    ("es", "No me llega el correo con la contraseña del aula virtual"),
+    ("en", "What time does the school library open on Saturdays?"),
+    ("en", "I made a mistake when filling in the registration form, what should I do?"),
+    ("en", "I want to talk to the German teacher about my final mark"),
+    ("en", "Is there a discount on the fees for large families?"),
+    ("en", "I am not receiving the email with the password for the virtual classroom"),
+    ("fr", "À quelle heure ouvre la bibliothèque de l'école le samedi?"),
+    ("fr", "Je me suis trompé en remplissant le formulaire d'inscription, que dois-je faire?"),
+    ("fr", "Je veux parler avec la professeure d'allemand de ma note finale"),
+    ("fr", "Y a-t-il une réduction sur les frais pour les familles nombreuses?"),
+    ("fr", "Je ne reçois pas le courriel avec le mot de passe de la classe virtuelle"),
+    ("de", "Wann öffnet die Schulbibliothek am Samstag?"),
+    ("de", "Ich habe beim Ausfüllen des Anmeldeformulars einen Fehler gemacht, was soll ich tun?"),
+    ("de", "Ich möchte mit der Deutschlehrerin über meine Endnote sprechen"),
+    ("de", "Gibt es eine Ermäßigung der Gebühren für kinderreiche Familien?"),
+    ("de", "Ich bekomme die E-Mail mit dem Passwort für das virtuelle Klassenzimmer nicht"),
+    ("it", "A che ora apre la biblioteca della scuola il sabato?"),
+    ("it", "Ho sbagliato a compilare il modulo di iscrizione, cosa devo fare?"),
+    ("it", "Voglio parlare con la professoressa di tedesco del mio voto finale"),
+    ("it", "C'è uno sconto sulle tasse per le famiglie numerose?"),
+    ("it", "Non mi arriva l'email con la password dell'aula virtuale"),
+    ("zh", "学校图书馆星期六几点开门？"),
+    ("zh", "我想和德语老师谈谈我的期末成绩"),
+    ("ja", "学校の図書館は土曜日の何時に開きますか？"),
+    ("ja", "ドイツ語の先生と最終成績について話したいです"),
+    ("ar", "متى تفتح مكتبة المدرسة يوم السبت؟"),
+    ("ar", "أريد التحدث مع معلمة اللغة الألمانية عن درجتي النهائية"),
+]
+
+
+def run(detector, repeat: int):
+    correct = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for expected, text in CORPUS:
+            if detector(text) == expected:
+                correct += 1
+    elapsed = time.perf_counter() - start
+    calls = repeat * len(CORPUS)
+    return correct / calls, elapsed / calls * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--remote", action="store_true", help="Comparar con translate_client.detect_language")
+    parser.add_argument("--threshold", type=float, default=float(os.getenv("LOCAL_DETECTION_THRESHOLD", "0.9")))
+    parser.add_argument("--repeat", type=int, default=100)
+    args = parser.parse_args()
+
+    print(f"{'detector':<12} {'precisión':>10} {'ms/llamada':>11}")
+    accuracy, latency = run(lambda text: detect_language_local(text)[0], args.repeat)
+    print(f"{'local':<12} {accuracy:>10.1%} {latency:>11.4f}")
+
+    confident = sum(1 for _, text in CORPUS if detect_language_local(text)[1] >= args.threshold)
+    print(f"Resueltas localmente con umbral {args.threshold}: {confident}/{len(CORPUS)}")
+
+    if args.remote:
+        from google.cloud import translate_v2 as translate
+        client = translate.Client()
+        accuracy, latency = run(lambda text: client.detect_language(text)["language"][:2], 1)
+        print(f"{'remoto':<12} {accuracy:>10.1%} {latency:>11.4f}")
+
+
+if __name__ == "__main__":
+    main()
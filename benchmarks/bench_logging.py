@@ -0,0 +1,116 @@
+"""
+Coste en el camino de las peticiones de los logs de una pregunta: logging.basicConfig con
+f-strings (lo anterior) frente a utils.logs (cola, formateo perezoso y JSON en un hilo aparte).
+
+Mide los µs que pasa el hilo que registra en cada llamada, con uno y con varios hilos
+registrando a la vez (contención del lock del handler), y el tiempo hasta escribirlo todo.
+La salida va a un fichero temporal; --write-latency simula una salida lenta (en Cloud Run
+stdout es una tubería que lee el agente de logging y puede bloquear al escribir).
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_logging.py --records 20000 --threads 1,8 --write-latency 0,100
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "app"))
+
+from utils import logs  # noqa: E402
+
+QUESTION = "¿Cuándo son los exámenes de certificación de inglés en la escuela de Cartagena? " * 3
+ANSWER = "Los exámenes de certificación son en junio y septiembre. Consulta el calendario en la web de la escuela. " * 4
+
+
+def log_eager(i: int):
+    logging.info(f"Pregunta original (Página web texto): '{QUESTION}' | Idioma detectado: es | Idioma usado: es")
+    logging.info(f"Respuesta en español de Dialogflow: '{ANSWER}' y  raw='{ANSWER}' y además EL REST=OK")
+    logging.info(f"Session ID: session-{i} - Response ID: response-{i}")
+
+
+def log_lazy(i: int):
+    logging.info("Pregunta original (%s) | Idioma detectado: %s | Idioma usado: %s", "Página web texto", "es", "es",
+                 extra={"payload": {"question": QUESTION}})
+    logging.info("Respuesta de Dialogflow: %s", "OK", extra={"payload": {"answer": ANSWER, "raw_response": ANSWER}})
+    logging.info("Session ID: %s - Response ID: %s", f"session-{i}", f"response-{i}")
+
+
+class SlowStream:
+    """
+    Fichero cuya escritura tarda `latency` segundos más (sin retener el GIL, como una tubería llena).
+    """
+
+    def __init__(self, stream, latency: float):
+        self.stream = stream
+        self.latency = latency
+
+    def write(self, text: str):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def run(configure, log, records: int, threads: int, latency: float):
+    with tempfile.TemporaryFile("w") as output:
+        configure(SlowStream(output, latency), records * 3)
+        per_thread = records // threads
+        elapsed = []
+
+        def worker():
+            start = time.perf_counter()
+            for i in range(per_thread):
+                log(i)
+            elapsed.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        logs.stop_logging()
+        total = time.perf_counter() - start
+        for handler in logging.getLogger().handlers:
+            handler.flush()
+        written = output.tell()
+    calls = per_thread * threads * 3
+    return sum(elapsed) / calls * 1e6, total, written
+
+
+def configure_basic(output, _):
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    logging.basicConfig(level=logging.INFO, stream=output)
+
+
+def configure_queue(output, queue_size: int):
+    # Sin límites por nivel y con cola para todos los registros: se mide el mismo trabajo que con basicConfig
+    logs.setup_logging(stream=output, rate_limits="", queue_size=queue_size)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coste de los logs en el camino de las peticiones.")
+    parser.add_argument("--records", type=int, default=20000, help="Preguntas registradas (3 logs por pregunta)")
+    parser.add_argument("--threads", default="1,8", help="Hilos registrando a la vez, separados por comas")
+    parser.add_argument("--write-latency", default="0,100", help="µs que tarda cada escritura, separados por comas")
+    args = parser.parse_args()
+
+    print(f"{'configuración':<26}  {'escritura (µs)':>14}  {'hilos':>5}  {'µs/log':>7}  {'total (s)':>9}  {'MB':>5}")
+    for latency in map(float, args.write_latency.split(",")):
+        for threads in map(int, args.threads.split(",")):
+            for name, configure, log in (("basicConfig + f-strings", configure_basic, log_eager),
+                                         ("utils.logs (cola, JSON)", configure_queue, log_lazy)):
+                per_call, total, written = run(configure, log, args.records, threads, latency / 1e6)
+                print(f"{name:<26}  {latency:>14.0f}  {threads:>5}  {per_call:>7.1f}  {total:>9.2f}  {written / 2 ** 20:>5.1f}")
+
+
+if __name__ == "__main__":
+    main()
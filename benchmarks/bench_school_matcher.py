@@ -0,0 +1,85 @@
+"""
+Micro-benchmark del detector de escuelas: SchoolMatcher precompilado frente a la
+implementación anterior, que reconstruía los diccionarios en cada llamada.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_school_matcher.py --words 2000
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "app"))
+
+from utils.school_matcher import get_matcher  # noqa: E402
+
+
+def detectar_aparicion_escuela_anterior(texto: str):
+    texto = texto.lower()
+    mapa_topico_palabras = {
+        "caravaca de la cruz": ["caravaca"],
+        "cartagena": ["cartagena"],
+        "fuente álamo": ["álamo", "alamo"],
+        "mazarrón": ["mazarrón", "mazarron"],
+        "águilas": ["águilas", "aguilas"],
+        "totana": ["totana"],
+        "alhama": ["alhama"],
+        "puerto lumbreras": ["lumbreras"],
+        "archena": ["archena"],
+        "cieza": ["cieza"],
+        "yecla": ["yecla"],
+        "jumilla": ["jumilla"],
+        "murcia": ["murcia"],
+        "alcantarilla": ["alcantarilla"],
+        "infante": ["infante"],
+        "santomera": ["santomera"],
+        "san javier": ["javier"],
+        "lorca": ["lorca"],
+        "molina de segura": ["segura", "molina"],
+        "torre pacheco": ["pacheco"],
+    }
+    palabra_a_topicos = defaultdict(dict)
+    for topico, palabras in mapa_topico_palabras.items():
+        for palabra in palabras:
+            palabra_a_topicos[palabra.lower()][topico] = 1
+    tokens = re.findall(r'\b\w+\b', texto)
+    conteo_palabras = Counter()
+    conteo_topicos = Counter()
+    for token in tokens:
+        if token not in palabra_a_topicos:
+            continue
+        conteo_palabras[token] += 1
+        for topico, peso in palabra_a_topicos[token].items():
+            conteo_topicos[topico] += peso
+    if not conteo_topicos:
+        return {}, {}, []
+    max_score = max(conteo_topicos.values())
+    return dict(conteo_palabras), dict(conteo_topicos), [t for t, s in conteo_topicos.items() if s == max_score]
+
+
+BASE = ("Hola, quería saber si en la escuela de idiomas de Molina de Segura hay clases de alemán "
+        "por la tarde o si tengo que ir a Murcia o a Cartagena para el nivel avanzado ")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=2000, help="Longitud aproximada del texto largo")
+    parser.add_argument("--number", type=int, default=2000)
+    args = parser.parse_args()
+
+    matcher = get_matcher()
+    short = BASE
+    long_text = (BASE * (args.words // len(BASE.split()) + 1))
+    for label, text in (("corto", short), (f"{len(long_text.split())} palabras", long_text)):
+        number = args.number if label == "corto" else max(1, args.number // 100)
+        old = timeit.timeit(lambda: detectar_aparicion_escuela_anterior(text), number=number) / number
+        new = timeit.timeit(lambda: matcher.match(text), number=number) / number
+        print(f"{label:>16}: anterior {old * 1e6:9.1f} µs | trie {new * 1e6:9.1f} µs | x{old / new:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Memoria por sesión y coste de lookup() del mapa de sesiones de Dialogflow
+(services.dialogflow_sessions.SessionStore), con session_id uuid4 como los del frontend.
+
+La memoria se mide con tracemalloc e incluye los propios session_id, que la aplicación
+recibe en cada petición pero que el mapa mantiene vivos mientras recuerda la sesión.
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_sessions.py --sessions 100000,300000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "app"))
+
+from services.dialogflow_sessions import SessionStore  # noqa: E402
+
+SCHOOLS = ["murcia", "cartagena", "lorca", "yecla", "cieza", "molina de segura", "san javier", "águilas"]
+MONTHS = ["septiembre", "octubre", "noviembre"]
+
+
+def measure(count: int):
+    session_ids = [str(uuid.uuid4()) for _ in range(count)]
+    store = SessionStore(max_sessions=count, ttl=3600)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    for i, session_id in enumerate(session_ids):
+        store.lookup(session_id)
+        # Parámetros con el mismo contenido pero objetos distintos en cada petición, como en la aplicación
+        school, month = SCHOOLS[i % len(SCHOOLS)].encode().decode(), MONTHS[i % len(MONTHS)].encode().decode()
+        store.remember(session_id, (school, month))
+    insert_seconds = time.perf_counter() - start
+    # Los session_id ya estaban en memoria antes de medir; se suman aparte
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    keys = sum(sys.getsizeof(session_id) for session_id in session_ids)
+
+    start = time.perf_counter()
+    for session_id in session_ids:
+        store.lookup(session_id)
+    hit_seconds = time.perf_counter() - start
+
+    print(f"{count:>9}  {used / count:>10.0f}  {(used + keys) / count:>13.0f}  "
+          f"{(used + keys) / 2 ** 20:>9.1f}  {insert_seconds / count * 1e6:>11.2f}  {hit_seconds / count * 1e6:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memoria por sesión del mapa de sesiones de Dialogflow.")
+    parser.add_argument("--sessions", default="100000,300000", help="Números de sesiones separados por comas")
+    args = parser.parse_args()
+
+    print(f"{'sesiones':>9}  {'B/sesión':>10}  {'B/sesión+id':>13}  {'MB total':>9}  {'alta (µs)':>11}  {'hit (µs)':>9}")
+    for count in args.sessions.split(","):
+        measure(int(count))
+
+
+if __name__ == "__main__":
+    main()
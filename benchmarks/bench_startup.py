@@ -0,0 +1,68 @@
+"""
+Coste de arranque en frío: tiempo de importar la aplicación (main.py) con los clientes de
+Google perezosos frente a importarla y crear los cuatro clientes, que era lo que ocurría
+antes en cada arranque al construirse en la importación de los módulos.
+
+Cada medida se hace en un proceso nuevo. Sin --real los constructores se sustituyen por los
+de tests/fakes.py (se mide la importación de las librerías de Google pero no la creación
+de los canales gRPC, que necesita credenciales).
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_startup.py --runs 5 [--real]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "app")
+TESTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests")
+
+
+def measure(mode: str, real: bool):
+    sys.path.insert(0, APP_DIR)
+    os.chdir(APP_DIR)
+    start = time.perf_counter()
+    import main  # noqa: F401
+    imported = time.perf_counter() - start
+    if mode == "eager":
+        from utils import clients
+        if not real:
+            from google.cloud import bigquery, dialogflowcx_v3beta1, speech_v1p1beta1, translate_v2  # noqa: F401
+            sys.path.insert(0, TESTS_DIR)
+            from fakes import install_fakes
+            install_fakes()
+        clients.prewarm(clients.prewarm_names("all"))
+    total = time.perf_counter() - start
+    loaded = sorted(name for name in sys.modules if name.startswith("google.cloud."))
+    print(json.dumps({"import": imported, "total": total, "google_modules": len(loaded)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--real", action="store_true", help="Crear los clientes reales (requiere credenciales)")
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        measure(args.mode, args.real)
+        return
+
+    env = {**os.environ, "PREWARM_CLIENTS": ""}
+    print(f"{'modo':<8} {'mediana (s)':>12} {'mín (s)':>8} {'módulos google.cloud':>21}")
+    for mode in ("lazy", "eager"):
+        results = []
+        for _ in range(args.runs):
+            command = [sys.executable, __file__, "--mode", mode] + (["--real"] if args.real else [])
+            output = subprocess.run(command, check=True, capture_output=True, text=True, env=env).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+        totals = [result["total"] for result in results]
+        print(f"{mode:<8} {statistics.median(totals):>12.3f} {min(totals):>8.3f} {results[-1]['google_modules']:>21}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Throughput y memoria (RSS) de la conversión de audio: ficheros temporales + subprocess.run
+(implementación anterior) frente a la conversión por tuberías de services/transcoding.py.
+
+Cada modo se ejecuta en un proceso aparte para que el pico de RSS de uno no contamine al otro.
+Necesita ffmpeg en el PATH (y PyAV para el modo "pyav").
+
+Uso (desde la raíz del repositorio):
+    python benchmarks/bench_transcoding.py --clips 40 --concurrency 4 --seconds 20
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src", "app"))
+
+
+def legacy_transcode(data: bytes) -> bytes:
+    with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as temp_in, \
+         tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_out:
+        temp_in.write(data)
+        temp_in.flush()
+        subprocess.run([
+            'ffmpeg', '-y', '-i', temp_in.name,
+            '-ar', '16000', '-ac', '1', '-f', 'wav', temp_out.name
+        ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        temp_out.seek(0)
+        return temp_out.read()
+
+
+def pipe_transcode(data: bytes) -> bytes:
+    from services import transcoding
+    chunks = (data[i:i + transcoding.CHUNK_SIZE] for i in range(0, len(data), transcoding.CHUNK_SIZE))
+    return b"".join(transcoding.transcode_to_pcm(chunks))
+
+
+def make_sample(seconds: int) -> str:
+    path = os.path.join(tempfile.gettempdir(), f"bench-transcoding-{seconds}s.webm")
+    if not os.path.exists(path):
+        subprocess.run([
+            'ffmpeg', '-y', '-loglevel', 'error', '-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}',
+            '-ac', '2', '-ar', '48000', '-c:a', 'libopus', path
+        ], check=True)
+    return path
+
+
+def run_mode(mode: str, sample: str, clips: int, concurrency: int):
+    if mode == "pyav":
+        os.environ["TRANSCODER"] = "pyav"
+    elif mode == "pipe":
+        os.environ["TRANSCODER"] = "ffmpeg"
+    func = legacy_transcode if mode == "legacy" else pipe_transcode
+    with open(sample, "rb") as sample_file:
+        data = sample_file.read()
+
+    temp_before = len(glob.glob(os.path.join(tempfile.gettempdir(), "tmp*")))
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        sizes = list(pool.map(func, [data] * clips))
+    elapsed = time.perf_counter() - start
+    temp_after = len(glob.glob(os.path.join(tempfile.gettempdir(), "tmp*")))
+
+    print(json.dumps({
+        "mode": mode,
+        "clips_per_s": clips / elapsed,
+        "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children_rss_mb": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+        "leftover_tmp_files": temp_after - temp_before,
+        "pcm_bytes": sizes[0] if sizes else 0,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clips", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--seconds", type=int, default=20, help="Duración del clip de prueba")
+    parser.add_argument("--modes", default="legacy,pipe", help="legacy, pipe y/o pyav")
+    parser.add_argument("--mode", help=argparse.SUPPRESS)
+    parser.add_argument("--sample", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.sample, args.clips, args.concurrency)
+        return
+
+    sample = make_sample(args.seconds)
+    print(f"{'modo':<8} {'clips/s':>8} {'RSS MB':>8} {'RSS hijos MB':>13} {'tmp sin borrar':>15}")
+    for mode in args.modes.split(","):
+        output = subprocess.run(
+            [sys.executable, __file__, "--mode", mode, "--sample", sample,
+             "--clips", str(args.clips), "--concurrency", str(args.concurrency)],
+            check=True, capture_output=True, text=True
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:<8} {result['clips_per_s']:>8.2f} {result['rss_mb']:>8.1f} "
+              f"{result['children_rss_mb']:>13.1f} {result['leftover_tmp_files']:>15}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Compara el throughput de la aplicación servida por gunicorn con 1, 2 y 4 workers,
+cada configuración limitada a tantos núcleos como workers (sched_setaffinity), para medir
+cuánto escala con los núcleos del contenedor.
+
+La aplicación usa los clientes simulados (benchmarks/offline_app.py). La prueba se hace sobre
+el trabajo de CPU de la propia aplicación, así que conviene latencias simuladas bajas. Con
+--state-backend redis los workers comparten caché y contadores (hace falta un Redis en REDIS_URL).
+
+Uso:
+    python benchmarks/bench_workers.py --workers 1,2,4 --endpoint text --concurrency 32
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import APP_DIR, BACKENDS, make_wav, run_level  # noqa: E402
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workers: int, cores, args) -> (subprocess.Popen, str):
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), WORKERS=str(workers), STATE_BACKEND=args.state_backend)
+    for backend in BACKENDS:
+        env[f"OFFLINE_LATENCY_{backend.upper()}"] = getattr(args, f"{backend}_latency")
+    command = [sys.executable, "-m", "gunicorn", "offline_app:app", "-c", "gunicorn.conf.py",
+               "--pythonpath", BENCH_DIR, "--bind", f"127.0.0.1:{port}"]
+    process = subprocess.Popen(command, cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                               preexec_fn=(lambda: os.sched_setaffinity(0, cores)) if cores else None)
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError("gunicorn terminó al arrancar")
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("gunicorn no arrancó en 60 s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4")
+    parser.add_argument("--endpoint", default="text", help="text, stream, voice o rate")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--state-backend", default="memory", choices=("memory", "redis"))
+    parser.add_argument("--no-pin", action="store_true", help="No limitar los núcleos de cada configuración")
+    for backend in BACKENDS:
+        parser.add_argument(f"--{backend}-latency", default="0.005",
+                            help=f"Latencia simulada de {backend} (mediana[:sigma[:error_rate]])")
+    args = parser.parse_args()
+
+    available = sorted(os.sched_getaffinity(0))
+    audio = make_wav(1.0)
+    print(f"Núcleos disponibles: {len(available)}")
+    print(f"{'workers':>8} {'núcleos':>8} {'req/s':>9} {'p50 (s)':>8} {'p99 (s)':>8} {'errores':>8}")
+    for workers in [int(w) for w in args.workers.split(",")]:
+        cores = None if args.no_pin else set(available[:workers])
+        if cores and len(cores) < workers:
+            print(f"{workers:>8} {'-':>8}  (solo hay {len(available)} núcleos)")
+            continue
+        process, url = start_server(workers, cores, args)
+        try:
+            # Calentamiento: cada worker crea sus clientes y rellena sus cachés
+            run_level(url, args.endpoint, args.concurrency, args.concurrency * 2, args.timeout, audio)
+            result = run_level(url, args.endpoint, args.concurrency, args.requests, args.timeout, audio)
+        finally:
+            process.terminate()
+            process.wait()
+        print(f"{workers:>8} {len(cores) if cores else '-':>8} {result['rps']:>9.2f} {result['p50']:>8.3f} "
+              f"{result['p99']:>8.3f} {result['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main()
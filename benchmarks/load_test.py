@@ -0,0 +1,229 @@
+"""
+Prueba de carga para /ask/text, /ask/text/stream, /ask/voice y /rate.
+
+Lanza la misma batería de peticiones con distintos niveles de concurrencia y
+muestra, por endpoint y nivel, el throughput, los percentiles p50/p95/p99 de
+latencia y la mediana del tiempo hasta el primer trozo de respuesta (TTFB).
+Con el pipeline no bloqueante el throughput debe crecer con el número
+de usuarios concurrentes hasta alcanzar los límites configurados por backend
+(MAX_CONCURRENCY_*), en lugar de quedarse plano en lo que da una sola petición.
+
+Con --offline se arranca la aplicación en un proceso aparte con los clientes
+simulados de tests/fakes.py, sin credenciales de Google. La latencia y la tasa
+de errores de cada servicio se configuran como "mediana[:sigma[:error_rate]]".
+
+Uso:
+    python benchmarks/load_test.py --url http://localhost:8080 --concurrency 1,2,4,8,16
+    python benchmarks/load_test.py --offline --endpoints text,voice,rate \\
+        --dialogflow-latency 0.15:0.4 --translate-latency 0.05:0.3:0.01
+"""
+import argparse
+import io
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+import uuid
+import wave
+
+from concurrent.futures import ThreadPoolExecutor
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "app")
+TESTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests")
+
+QUESTIONS = [
+    "¿Cuándo son los exámenes de certificación?",
+    "¿Cómo me matriculo en la escuela de idiomas?",
+    "Quiero cambiar de grupo, ¿qué tengo que hacer?",
+    "When is the enrolment period for the English courses?",
+    "¿Qué horario tiene la secretaría de la EOI de Cartagena?",
+]
+
+BACKENDS = ("dialogflow", "translate", "speech", "bigquery")
+
+
+def make_wav(seconds: float = 1.0, sample_rate: int = 16000) -> bytes:
+    """
+    Genera un WAV PCM mono de silencio, que Speech acepta sin conversión.
+    """
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(b"\x00\x00" * int(seconds * sample_rate))
+    return buffer.getvalue()
+
+
+def encode_multipart(fields: dict, files: dict):
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content, content_type) in files.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                   f'Content-Type: {content_type}\r\n\r\n'.encode())
+        body.write(content)
+        body.write(b"\r\n")
+    body.write(f"--{boundary}--\r\n".encode())
+    return body.getvalue(), f"multipart/form-data; boundary={boundary}"
+
+
+def build_request(base_url: str, endpoint: str, i: int, audio: bytes) -> urllib.request.Request:
+    session_id = f"load-{i}"
+    if endpoint in ("text", "stream"):
+        data = urllib.parse.urlencode({"message": QUESTIONS[i % len(QUESTIONS)], "session_id": session_id}).encode()
+        return urllib.request.Request(f"{base_url}/ask/text{'/stream' if endpoint == 'stream' else ''}", data=data)
+    if endpoint == "voice":
+        data, content_type = encode_multipart({"session_id": session_id}, {"file": ("audio.wav", audio, "audio/wav")})
+        return urllib.request.Request(f"{base_url}/ask/voice", data=data, headers={"Content-Type": content_type})
+    if endpoint == "rate":
+        data = (f'{{"response_id": "{uuid.uuid4()}", "session_id": "{session_id}", '
+                f'"valoration": "{"like" if i % 3 else "dislike"}"}}').encode()
+        return urllib.request.Request(f"{base_url}/rate", data=data, headers={"Content-Type": "application/json"})
+    raise ValueError(f"Endpoint desconocido: '{endpoint}'")
+
+
+def send(request: urllib.request.Request, timeout: float):
+    """
+    Devuelve la latencia total y la del primer trozo de respuesta (primer evento "delta" en
+    streaming; en el resto de endpoints coincide con la total).
+    """
+    start = time.perf_counter()
+    first = None
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        for line in response:
+            if first is None and line.startswith(b"event: delta"):
+                first = time.perf_counter() - start
+    total = time.perf_counter() - start
+    return total, first if first is not None else total
+
+
+def percentile(values, fraction: float) -> float:
+    """
+    Percentil por el método del rango más cercano sobre una lista ya ordenada.
+    """
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def run_level(base_url: str, endpoint: str, concurrency: int, total: int, timeout: float, audio: bytes):
+    requests = [build_request(base_url, endpoint, i, audio) for i in range(total)]
+    errors = 0
+    latencies = []
+    first_bytes = []
+
+    def worker(request):
+        try:
+            return send(request, timeout)
+        except Exception:
+            return None
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for latency in pool.map(worker, requests):
+            if latency is None:
+                errors += 1
+            else:
+                latencies.append(latency[0])
+                first_bytes.append(latency[1])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    first_bytes.sort()
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "ttfb_p50": percentile(first_bytes, 0.50),
+        "errors": errors,
+    }
+
+
+def serve_offline(port: int, latencies: dict):
+    """
+    Arranca la aplicación con los clientes simulados. Se ejecuta en un proceso aparte para que
+    el cliente de carga no compita por el GIL con el servidor.
+    """
+    sys.path.insert(0, APP_DIR)
+    os.chdir(APP_DIR)
+    # Todas las peticiones llegan desde la misma IP: sin límite por IP salvo que se pida
+    os.environ.setdefault("RATE_LIMIT_IP_RATE", "0")
+    sys.path.insert(0, TESTS_DIR)
+    from fakes import Latency, install_fakes
+    install_fakes({backend: Latency.parse(spec) for backend, spec in latencies.items() if spec})
+
+    import uvicorn
+    from main import app
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def start_offline_server(args) -> subprocess.Popen:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    command = [sys.executable, os.path.abspath(__file__), "--serve-offline", str(port)]
+    for backend in BACKENDS:
+        command += [f"--{backend}-latency", getattr(args, f"{backend}_latency")]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                break
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError("El servidor simulado terminó al arrancar")
+            time.sleep(0.1)
+    else:
+        process.kill()
+        raise RuntimeError("El servidor simulado no arrancó en 30 s")
+    args.url = f"http://127.0.0.1:{port}"
+    return process
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--endpoints", default="text", help="text, stream (/ask/text/stream), voice y/o rate separados por comas")
+    parser.add_argument("--concurrency", default="1,2,4,8,16")
+    parser.add_argument("--requests", type=int, default=40, help="Peticiones por nivel de concurrencia")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--audio-seconds", type=float, default=2.0, help="Duración del audio de /ask/voice")
+    parser.add_argument("--offline", action="store_true", help="Arrancar la aplicación con servicios simulados")
+    for backend, default in zip(BACKENDS, ("0.15:0.4", "0.05:0.3", "0.4:0.3", "0.05:0.2")):
+        parser.add_argument(f"--{backend}-latency", default=default,
+                            help=f"Latencia simulada de {backend} (mediana[:sigma[:error_rate]]) con --offline")
+    parser.add_argument("--serve-offline", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_offline:
+        serve_offline(args.serve_offline, {backend: getattr(args, f"{backend}_latency") for backend in BACKENDS})
+        return
+
+    server = start_offline_server(args) if args.offline else None
+    audio = make_wav(args.audio_seconds)
+    base_url = args.url.rstrip("/")
+    try:
+        print(f"{'endpoint':<8} {'usuarios':>9} {'req/s':>9} {'p50 (s)':>8} {'p95 (s)':>8} {'p99 (s)':>8} "
+              f"{'TTFB p50':>9} {'errores':>8}")
+        for endpoint in args.endpoints.split(","):
+            for level in [int(c) for c in args.concurrency.split(",")]:
+                result = run_level(base_url, endpoint, level, args.requests, args.timeout, audio)
+                print(f"{endpoint:<8} {level:>9} {result['rps']:>9.2f} {result['p50']:>8.3f} {result['p95']:>8.3f} "
+                      f"{result['p99']:>8.3f} {result['ttfb_p50']:>9.3f} {result['errors']:>8}")
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+"""
+La aplicación con los clientes simulados de tests/fakes.py, para servirla con gunicorn
+(varios workers) sin credenciales de Google. La latencia de cada servicio se lee de
+OFFLINE_LATENCY_<SERVICIO> con el formato "mediana[:sigma[:error_rate]]".
+
+Uso (desde src/app):
+    OFFLINE_LATENCY_DIALOGFLOW=0.15:0.4 gunicorn offline_app:app -c gunicorn.conf.py \\
+        --pythonpath ../../benchmarks
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests"))
+
+# Todas las peticiones del benchmark llegan desde la misma IP
+os.environ.setdefault("RATE_LIMIT_IP_RATE", "0")
+
+from fakes import Latency, install_fakes  # noqa: E402
+
+BACKENDS = ("dialogflow", "translate", "speech", "bigquery")
+
+install_fakes({backend: Latency.parse(os.getenv(f"OFFLINE_LATENCY_{backend.upper()}", ""))
+               for backend in BACKENDS})
+
+from main import app  # noqa: E402,F401
@@ -1,9 +1,25 @@
-from fastapi import APIRouter, UploadFile, File, Form, Request, Depends
-from typing import Dict
+from fastapi import APIRouter, UploadFile, File, Form, Request, Response, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from typing import Dict, List, Optional
 from pydantic import BaseModel
-from services import speech_to_text, conversation_agent, big_query
-from utils.translate import detect_language, translate_text, unescape_html, detectar_escuela
-import requests
+from services import speech_to_text, conversation_agent, big_query, fallbacks, rollups
+from services.transcoding import AudioRejectedError, TranscoderUnavailableError
+from utils.translate import (detect_and_translate, detect_and_translate_many, detectar_escuela, normalize_text,
+                             translate_many, translate_text, unescape_html)
+from utils import admission
+from utils.cache import MISSING, TTLCache
+from utils.concurrency import run_blocking
+from utils.language_detection import detect_language_local, known_language
+from utils.metrics import FIRST_BYTE_SECONDS, REQUEST_SECONDS, REQUESTS, timed
+from utils.outbound import CircuitOpenError, breakers, get_http_client
+from utils.pipeline import StageGraph
+from utils.school_matcher import known_school
+import asyncio
+import json
+import os
+import re
+import time
+import uuid
 
 import logging
 
@@ -11,49 +27,63 @@ MAX_NUM_WORDS=4
 DEFAULT_LANGUAGE='es'
 DEFAULT_SCHOOL="murcia"
 
-router = APIRouter()
+# Preguntas por petición a /ask/batch y cuántas de ellas se envían a Dialogflow a la vez
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "500"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))
 
+# Segundos que se reutiliza una consulta de /stats?scope=global a la tabla de agregados
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", "60"))
 
-def get_client_info(request: Request) -> Dict[str, str]:
-    def get_real_ip():
-        forwarded_for = request.headers.get("X-Forwarded-For")
-        if forwarded_for:
-            return forwarded_for.split(",")[0].strip()
+stats_cache = TTLCache(64, STATS_CACHE_TTL, name="stats")
 
-        real_ip = request.headers.get("X-Real-IP")
-        if real_ip:
-            return real_ip
+# Fin de frase seguido de espacio: punto de corte de la respuesta en streaming
+_SEGMENT_RE = re.compile(r"(?<=[.!?…])\s+")
+
+router = APIRouter()
 
-        return request.client.host
 
+def get_client_info(request: Request) -> Dict[str, str]:
     return {
-        "ip": get_real_ip(),
+        "ip": admission.client_ip(request),
         "user_agent": request.headers.get("user-agent", "Desconocido"),
         "host": request.headers.get("host", "Desconocido"),
         "referer": request.headers.get("referer", "Directo")
     }
 
-@router.post('/ask/text')
-async def ask_text(message: str = Form(...), session_id: str = Form(None), language: str = Form(None), school: str = Form(None), client_info: Dict[str, str] = Depends(get_client_info) ):
 
+def limit_session(request: Request, session_id: str = Form(None)):
     """
-    Endpoint to send text messages to the agent.
+    Límite de peticiones por session_id, o por IP si la petición no trae session_id. El de IP,
+    el de voz y el descarte de carga se aplican antes de leer el cuerpo, en el middleware de main.py.
+    """
+    reason = admission.admit_session(request.url.path, session_id, admission.client_ip(request))
+    if reason:
+        detail = "Demasiadas peticiones en esta sesión" if reason == "session" else "Demasiadas peticiones"
+        raise HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(admission.retry_after(reason))})
 
-    Args:
-        message (str): Message from the user.
-        session_id (str, optional): Session ID for the conversation.
-        language (str, optional): Preferred language for the response.
 
-    Returns:
-        dict: "response" with the agent's reply in the user's language and "session_id".
+async def transcribe_upload(file: UploadFile, endpoint: str) -> str:
+    """
+    Transcribe el audio subido. Un audio vacío, no válido o demasiado largo se rechaza
+    antes de llegar a Speech con 413 (duración) o 422; si la instancia no tiene con qué
+    convertirlo (ni PyAV ni ffmpeg), con 503.
     """
+    try:
+        with timed("transcribe_and_translate"):
+            return await run_blocking("speech", speech_to_text.transcribe_and_translate, file)
+    except AudioRejectedError as e:
+        admission.REJECTED.inc(endpoint=endpoint, reason=e.reason)
+        raise HTTPException(status_code=413 if e.reason == "audio_duration" else 422, detail=str(e))
+    except TranscoderUnavailableError as e:
+        logging.error("No se puede convertir el audio: %s", e)
+        raise HTTPException(status_code=503, detail="Este formato de audio no se puede procesar ahora mismo")
 
-    ## Detectar idioma solo cuando haya mas X palabras
-    num_words = len(message.split())
-    detected_language = "und"
-    if num_words > MAX_NUM_WORDS:
-        detected_language = detect_language(message)
 
+def choose_language(num_words: int, language: str = None, detected_language: str = "und") -> str:
+    """
+    Idioma de la pregunta a partir del indicado por el usuario y del detectado (solo se detecta
+    con más de MAX_NUM_WORDS palabras).
+    """
     if not language or language == 'und':
         if num_words <= MAX_NUM_WORDS:
             input_language = DEFAULT_LANGUAGE
@@ -68,47 +98,155 @@ async def ask_text(message: str = Form(...), session_id: str = Form(None), langu
 
     if input_language == 'und':
         input_language = DEFAULT_LANGUAGE
+    return input_language
+
+
+# Flujo de una pregunta, común a /ask/text, /ask/voice y sus variantes en streaming. Entradas:
+# endpoint, source, message o file, session_id, language, school y client_info
+ask_graph = StageGraph("ask")
+
+
+@ask_graph.stage()
+async def question(run):
+    # Texto de la pregunta: el del formulario o la transcripción del audio
+    if run["file"] is not None:
+        return await transcribe_upload(run["file"], run["endpoint"])
+    return run["message"]
+
+
+@ask_graph.stage(after=["question"])
+async def detection(run):
+    ## Detectar idioma solo cuando haya mas X palabras. La detección y la traducción al español
+    ## se hacen a la vez (como mucho una llamada a Translate)
+    text = run["question"]
+    if len(text.split()) <= MAX_NUM_WORDS:
+        return None, "und"
+    try:
+        with timed("detect_and_translate"):
+            return await run_blocking("translate", detect_and_translate, text, DEFAULT_LANGUAGE)
+    except CircuitOpenError:
+        # Con Translate caído se sigue con el idioma del detector local y sin traducir
+        logging.warning("Circuito de Translate abierto: se usa el detector local")
+        return None, detect_language_local(text)[0]
 
-    logging.info(f"Pregunta original: '{message}' | Idioma detectado: {detected_language} | Idioma usado: {input_language}")
-    message_es = translate_text(message, DEFAULT_LANGUAGE) if input_language != DEFAULT_LANGUAGE else message
 
-    ## Detectar escuela
+@ask_graph.stage(after=["question"])
+async def school_in_question(run):
+    # La escuela se busca en el texto original mientras se traduce: los nombres de las
+    # escuelas se escriben igual en casi todos los idiomas
+    with timed("detectar_escuela"):
+        return detectar_escuela(run["question"])
+
+
+@ask_graph.stage(after=["question", "detection"])
+async def question_es(run):
+    """
+    Idioma de la pregunta y su texto en español.
+    """
+    text = run["question"]
+    text_es, detected_language = run["detection"]
+    input_language = choose_language(len(text.split()), run["language"], detected_language)
+
+    logging.info("Pregunta original (%s) | Idioma detectado: %s | Idioma usado: %s", run["source"], detected_language, input_language,
+                 extra={"payload": {"question": text}})
+    if input_language == DEFAULT_LANGUAGE:
+        text_es = text
+    elif text_es is None:
+        try:
+            with timed("translate_in"):
+                text_es = await run_blocking("translate", translate_text, text, DEFAULT_LANGUAGE)
+        except CircuitOpenError:
+            logging.warning("Circuito de Translate abierto: la pregunta se envía sin traducir")
+            text_es = text
+    return {"text_es": text_es, "input_language": input_language, "detected_language": detected_language}
+
+
+@ask_graph.stage(after=["question", "question_es", "school_in_question"])
+async def usage_school(run):
+    school = run["school"]
+    text_es = run["question_es"]["text_es"]
+    detected_school = run["school_in_question"]
+    if not detected_school and text_es != run["question"]:
+        with timed("detectar_escuela"):
+            detected_school = detectar_escuela(text_es)
+
     usage_school = school if school else DEFAULT_SCHOOL
-    detected_school = detectar_escuela(message_es)
-    if detected_school and detected_school != "" and detected_school != usage_school:
+    if detected_school and detected_school != usage_school:
         usage_school = detected_school
 
-    logging.info(f"Escuela recibida: '{school}' | Escuela detectada: {detected_school} | Se usará: {usage_school}")
+    logging.info("Escuela recibida: '%s' | Escuela detectada: %s | Se usará: %s", school, detected_school, usage_school)
+    return usage_school
 
-    logging.info(f"Pregunta en español enviada para Dialogflow: '{message_es}'")
-    response_data = conversation_agent.send_message(message_es, session_id, usage_school )
-    response_es = response_data["message"]
-    session_id = response_data["session_id"]
-    response_id = response_data["response_id"]
-    dialogflow_code = response_data["code_result"]
-    raw_resp = response_data["raw_response"]
-
-    logging.info(f"Respuesta en español de Dialogflow: '{response_es}' y  raw='{raw_resp}' y además EL REST={dialogflow_code}")
-
-    final_response = translate_text(response_es, input_language)
-    final_response = unescape_html(final_response)
-    logging.info(f"Session ID: {session_id} - Response ID: {response_id}")
-
-    await big_query.insert_interaction(
-        session_id=session_id,
-        interaction_id=response_id,
-        source="Página web texto",
-        user_input=message,
-        language=input_language,
-        dialog_response=final_response,
-        code=dialogflow_code,
-        info_cli=client_info,
-        school=usage_school
-    )
-    return {"response": final_response, "session_id": session_id, "response_id": response_id, "language": input_language, "school": usage_school }
 
-@router.post('/ask/voice')
-async def ask_voice(file: UploadFile = File(...), session_id: str = Form(None), language: str = Form(None), school: str = Form(None), client_info: Dict[str, str] = Depends(get_client_info) ):
+@ask_graph.stage(after=["question_es", "usage_school"])
+async def answer(run):
+    text_es = run["question_es"]["text_es"]
+    with timed("send_message"):
+        response_data = await run_blocking("dialogflow", conversation_agent.send_message, text_es, run["session_id"], run["usage_school"])
+    logging.info("Respuesta de Dialogflow: %s", response_data["code_result"],
+                 extra={"payload": {"question_es": text_es, "answer": response_data["message"], "raw_response": response_data["raw_response"]}})
+    return response_data
+
+
+@ask_graph.stage(after=["answer", "question_es"])
+async def final_response(run):
+    response_data = run["answer"]
+    final_response = await translate_answer(response_data, run["question_es"]["input_language"])
+    logging.info("Session ID: %s - Response ID: %s", response_data["session_id"], response_data["response_id"])
+    return final_response
+
+
+@ask_graph.stage(after=["final_response", "usage_school"], background=True)
+async def interaction(run):
+    # Se registra después de responder: la respuesta no espera a encolar la fila
+    await record_interaction(run, run["final_response"])
+
+
+async def record_interaction(run, final_response: str):
+    response_data = run["answer"]
+    input_language = run["question_es"]["input_language"]
+    with timed("insert_interaction"):
+        await big_query.insert_interaction(
+            session_id=response_data["session_id"],
+            interaction_id=response_data["response_id"],
+            source=run["source"],
+            user_input=run["question"],
+            language=input_language,
+            dialog_response=final_response,
+            code=response_data["code_result"],
+            info_cli=run["client_info"],
+            school=run["usage_school"]
+        )
+    REQUESTS.inc(endpoint=run["endpoint"], code=response_data["code_result"], language=known_language(input_language),
+                 school=known_school(run["usage_school"]))
+
+
+def answer_payload(run) -> Dict[str, str]:
+    response_data = run["answer"]
+    return {"response": run["final_response"], "session_id": response_data["session_id"], "response_id": response_data["response_id"], "language": run["question_es"]["input_language"], "school": run["usage_school"]}
+
+
+@router.post('/ask/text', dependencies=[Depends(limit_session)])
+async def ask_text(response: Response, message: str = Form(...), session_id: str = Form(None), language: str = Form(None), school: str = Form(None), client_info: Dict[str, str] = Depends(get_client_info) ):
+
+    """
+    Endpoint to send text messages to the agent.
+
+    Args:
+        message (str): Message from the user.
+        session_id (str, optional): Session ID for the conversation.
+        language (str, optional): Preferred language for the response.
+
+    Returns:
+        dict: "response" with the agent's reply in the user's language and "session_id".
+    """
+    run = await ask_graph.run(endpoint="/ask/text", source="Página web texto", message=message, file=None,
+                              session_id=session_id, language=language, school=school, client_info=client_info)
+    response.headers["Server-Timing"] = run.server_timing()
+    return answer_payload(run)
+
+@router.post('/ask/voice', dependencies=[Depends(limit_session)])
+async def ask_voice(response: Response, file: UploadFile = File(...), session_id: str = Form(None), language: str = Form(None), school: str = Form(None), client_info: Dict[str, str] = Depends(get_client_info) ):
     """
     Endpoint to send voice messages to the agent.
 
@@ -120,65 +258,283 @@ async def ask_voice(file: UploadFile = File(...), session_id: str = Form(None),
     Returns:
         dict: "response" with the agent's reply in the user's language and "session_id".
     """
-    text = speech_to_text.transcribe_and_translate(file)
+    run = await ask_graph.run(endpoint="/ask/voice", source="Página web audio", message=None, file=file,
+                              session_id=session_id, language=language, school=school, client_info=client_info)
+    response.headers["Server-Timing"] = run.server_timing()
+    return answer_payload(run)
 
-    ## Detectar idioma solo cuando haya mas X palabras
-    num_words = len(text.split())
-    detected_language = "und"
-    if num_words > MAX_NUM_WORDS:
-        detected_language = detect_language(text)
+async def translate_answer(response_data: Dict[str, str], language: str) -> str:
+    """
+    Traduce la respuesta de Dialogflow al idioma del usuario. Las respuestas de reserva
+    (NOT_FOUND y errores) salen del catálogo ya traducido, sin llamar a Translate.
+    """
+    if response_data.get("fallback") is not None:
+        localized = fallbacks.catalog.get(response_data["fallback"], language)
+        if localized is not None:
+            return localized
+    return await timed_translate_out(response_data["message"], language)
 
-    if not language or language == 'und':
-        if num_words <= MAX_NUM_WORDS:
-            input_language = DEFAULT_LANGUAGE
-        else:
-            input_language = detected_language
-    elif detected_language == 'und':
-        input_language = language
-    elif language != detected_language and num_words > MAX_NUM_WORDS:
-        input_language = detected_language
-    else:
-        input_language = language
 
-    if input_language == 'und':
-        input_language = DEFAULT_LANGUAGE
+async def timed_translate_out(text: str, language: str) -> str:
+    """
+    translate_out medido en la etapa "translate_out": solo la llamada, sin el tiempo que el
+    cliente tarda en leer los trozos ya enviados.
+    """
+    with timed("translate_out"):
+        return await translate_out(text, language)
 
-    logging.info(f"Pregunta original (voz): '{text}' | Idioma detectado: {detected_language} | Idioma usado: {input_language}")
 
-    text_es = translate_text(text, DEFAULT_LANGUAGE) if input_language != DEFAULT_LANGUAGE else text
-    logging.info(f"Pregunta en español enviada a Dialogflow: '{text_es}'")
+async def translate_out(text: str, language: str) -> str:
+    """
+    Traduce un texto de la respuesta al idioma del usuario. Con el circuito de Translate
+    abierto se devuelve en español en lugar de fallar la petición.
+    """
+    try:
+        translated = await run_blocking("translate", translate_text, text, language, DEFAULT_LANGUAGE)
+    except CircuitOpenError:
+        logging.warning("Circuito de Translate abierto: la respuesta se envía en español")
+        return text
+    return unescape_html(translated)
+
 
-    ## Detectar escuela
-    usage_school = school if school else DEFAULT_SCHOOL
-    detected_school = detectar_escuela(text_es)
-    if detected_school and detected_school != "" and detected_school != usage_school:
-        usage_school = detected_school
+def sse_event(event: str, data: Dict[str, str]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
-    logging.info(f"Escuela recibida: '{school}' | Escuela detectada: {detected_school} | Se usará: {usage_school}")
 
-    response_data = conversation_agent.send_message(text_es, session_id, usage_school)
+def split_first_segment(text: str):
+    """
+    Separa la primera frase del resto para traducirla y enviarla antes.
+    """
+    parts = _SEGMENT_RE.split(text, maxsplit=1)
+    return parts[0], parts[1] if len(parts) > 1 else ""
+
+
+async def stream_answer(run, start: float):
+    """
+    Genera los eventos SSE de una pregunta ya respondida por Dialogflow (run del grafo hasta
+    "answer"): "meta" (ids, idioma y escuela), "delta" con cada trozo de la respuesta ya traducido
+    y "done" con la respuesta completa, igual que la del endpoint JSON. La interacción se registra
+    en BigQuery después de "done".
+    """
+    endpoint = run["endpoint"]
+    input_language = run["question_es"]["input_language"]
+    usage_school = run["usage_school"]
+    response_data = run["answer"]
     response_es = response_data["message"]
     session_id = response_data["session_id"]
     response_id = response_data["response_id"]
-    dialogflow_code = response_data["code_result"]
-    logging.info(f"Respuesta en español de Dialogflow: '{response_es}'")
-
-    final_response = translate_text(response_es, input_language)
-    final_response = unescape_html(final_response)
-    logging.info(f"Session ID: {session_id} - Response ID: {response_id}")
-
-    await big_query.insert_interaction(
-        session_id=session_id,
-        interaction_id=response_id,
-        source="Página web audio",
-        user_input=text,
-        language=input_language,
-        dialog_response=final_response,
-        code=dialogflow_code,
-        info_cli=client_info,
-        school=usage_school
-    )
-    return {"response": final_response, "session_id": session_id, "response_id": response_id, "language": input_language, "school": usage_school }
+
+    yield sse_event("meta", {"session_id": session_id, "response_id": response_id, "language": input_language, "school": usage_school})
+
+    parts = []
+    localized = None
+    if response_data.get("fallback") is not None:
+        localized = fallbacks.catalog.get(response_data["fallback"], input_language)
+    if localized is not None:
+        # Respuesta de reserva ya traducida: se envía entera sin llamar a Translate
+        FIRST_BYTE_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+        parts.append(localized)
+        yield sse_event("delta", {"text": localized})
+    else:
+        # La primera frase se traduce sola para enviarla cuanto antes; el resto, en otra llamada a la vez
+        first, rest = split_first_segment(response_es)
+        segments = [first, rest] if rest else [first]
+        tasks = [
+            asyncio.ensure_future(timed_translate_out(segment, input_language))
+            for segment in segments
+        ]
+        try:
+            for task in tasks:
+                part = await task
+                if not parts:
+                    FIRST_BYTE_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+                parts.append(part)
+                yield sse_event("delta", {"text": part if len(parts) == 1 else " " + part})
+        finally:
+            for task in tasks:
+                task.cancel()
+    final_response = " ".join(parts)
+
+    yield sse_event("done", {"response": final_response, "session_id": session_id, "response_id": response_id, "language": input_language, "school": usage_school})
+    REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+
+    await record_interaction(run, final_response)
+
+
+def stream_response(run, start: float) -> StreamingResponse:
+    # Server-Timing solo puede llevar las etapas anteriores al primer evento
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Server-Timing": run.server_timing()}
+    return StreamingResponse(stream_answer(run, start), media_type="text/event-stream", headers=headers)
+
+
+@router.post('/ask/text/stream', dependencies=[Depends(limit_session)])
+async def ask_text_stream(message: str = Form(...), session_id: str = Form(None), language: str = Form(None), school: str = Form(None), client_info: Dict[str, str] = Depends(get_client_info) ):
+    """
+    Variante de /ask/text que devuelve la respuesta como Server-Sent Events (text/event-stream).
+
+    Returns:
+        StreamingResponse: eventos "meta", "delta" (trozos de la respuesta) y "done" (mismo contenido que /ask/text).
+    """
+    start = time.perf_counter()
+    run = await ask_graph.run(targets=["answer"], endpoint="/ask/text/stream", source="Página web texto", message=message,
+                              file=None, session_id=session_id, language=language, school=school, client_info=client_info)
+    return stream_response(run, start)
+
+
+@router.post('/ask/voice/stream', dependencies=[Depends(limit_session)])
+async def ask_voice_stream(file: UploadFile = File(...), session_id: str = Form(None), language: str = Form(None), school: str = Form(None), client_info: Dict[str, str] = Depends(get_client_info) ):
+    """
+    Variante de /ask/voice que devuelve la respuesta como Server-Sent Events (text/event-stream).
+    El audio se transcribe antes de empezar a responder.
+    """
+    start = time.perf_counter()
+    run = await ask_graph.run(targets=["answer"], endpoint="/ask/voice/stream", source="Página web audio", message=None,
+                              file=file, session_id=session_id, language=language, school=school, client_info=client_info)
+    return stream_response(run, start)
+
+class BatchQuestion(BaseModel):
+    message: str
+    language: Optional[str] = None
+    school: Optional[str] = None
+
+
+class BatchRequest(BaseModel):
+    questions: List[BatchQuestion]
+    # "bulk": una fila por pregunta distinta, encoladas juntas al final para el escritor de BigQuery; "none": no se registran
+    record: str = "bulk"
+
+
+def prepare_batch(questions: List[BatchQuestion]) -> List[Dict[str, str]]:
+    """
+    Texto en español, idioma y escuela de cada pregunta, como en ask_graph pero para todas a la
+    vez: las detecciones y traducciones se hacen en lotes (utils.translate.detect_and_translate_many
+    y translate_many) en lugar de una llamada por pregunta.
+    """
+    long_questions = [i for i, question in enumerate(questions) if len(question.message.split()) > MAX_NUM_WORDS]
+    try:
+        detections = dict(zip(long_questions, detect_and_translate_many([questions[i].message for i in long_questions], DEFAULT_LANGUAGE)))
+    except CircuitOpenError:
+        # Como en ask_graph: con Translate caído, idioma del detector local y preguntas sin traducir
+        logging.warning("Circuito de Translate abierto: se usa el detector local en /ask/batch")
+        detections = {i: (None, detect_language_local(questions[i].message)[0]) for i in long_questions}
+
+    prepared = []
+    for i, question in enumerate(questions):
+        text_es, detected_language = detections.get(i, (None, "und"))
+        input_language = choose_language(len(question.message.split()), question.language, detected_language)
+        if input_language == DEFAULT_LANGUAGE:
+            text_es = question.message
+        prepared.append({"text_es": text_es, "input_language": input_language})
+
+    pending = [i for i, item in enumerate(prepared) if item["text_es"] is None]
+    try:
+        translated = translate_many([questions[i].message for i in pending], DEFAULT_LANGUAGE)
+    except CircuitOpenError:
+        logging.warning("Circuito de Translate abierto: las preguntas de /ask/batch se envían sin traducir")
+        translated = [questions[i].message for i in pending]
+    for i, text_es in zip(pending, translated):
+        prepared[i]["text_es"] = text_es
+
+    for question, item in zip(questions, prepared):
+        detected_school = detectar_escuela(question.message)
+        if not detected_school and item["text_es"] != question.message:
+            detected_school = detectar_escuela(item["text_es"])
+        item["school"] = detected_school or question.school or DEFAULT_SCHOOL
+    return prepared
+
+
+async def answer_batch_question(n: int, item: Dict[str, str], session_id: str, semaphore: asyncio.Semaphore):
+    """
+    Respuesta de la pregunta distinta n: (n, respuesta de Dialogflow, respuesta traducida), o
+    (n, None, error) si falla, para que un fallo no corte el resto del lote.
+    """
+    try:
+        async with semaphore:
+            with timed("send_message"):
+                response_data = await run_blocking("dialogflow", conversation_agent.send_message, item["text_es"], session_id, item["school"])
+            return n, response_data, await translate_answer(response_data, item["input_language"])
+    except Exception as e:
+        logging.error("Error respondiendo una pregunta de /ask/batch: %s", e)
+        return n, None, str(e)
+
+
+async def stream_batch(batch: BatchRequest, groups: Dict[tuple, List[int]], prepared: List[Dict[str, str]], client_info: Dict[str, str]):
+    """
+    Una línea JSON por pregunta (con su posición en la petición) en el orden en que terminan. Las
+    preguntas repetidas se responden una vez y salen juntas. La última línea resume el lote.
+    """
+    batch_id = str(uuid.uuid4())
+    unique = list(groups.values())
+    yield json.dumps({"batch_id": batch_id, "questions": len(batch.questions), "unique": len(unique)}) + "\n"
+
+    # Cada pregunta distinta en su propia sesión de Dialogflow, para que no se contaminen entre sí
+    semaphore = asyncio.Semaphore(max(1, BATCH_CONCURRENCY))
+    tasks = [
+        asyncio.ensure_future(answer_batch_question(n, prepared[n], f"{batch_id}-{n}", semaphore))
+        for n in range(len(unique))
+    ]
+    records = []
+    errors = 0
+    try:
+        for done in asyncio.as_completed(tasks):
+            n, response_data, final_response = await done
+            indices = unique[n]
+            question, item = batch.questions[indices[0]], prepared[n]
+            if response_data is None:
+                errors += 1
+                for index in indices:
+                    yield json.dumps({"index": index, "error": final_response}, ensure_ascii=False) + "\n"
+                continue
+            for index in indices:
+                yield json.dumps({"index": index, "response": final_response, "code": response_data["code_result"],
+                                  "response_id": response_data["response_id"], "language": item["input_language"],
+                                  "school": item["school"]}, ensure_ascii=False) + "\n"
+            REQUESTS.inc(len(indices), endpoint="/ask/batch", code=response_data["code_result"],
+                         language=known_language(item["input_language"]), school=known_school(item["school"]))
+            if batch.record == "bulk":
+                records.append(big_query.interaction_record(
+                    response_data["session_id"], response_data["response_id"], "Lote", question.message, item["input_language"],
+                    final_response, response_data["code_result"], client_info, item["school"]
+                ))
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    recorded = 0
+    if records:
+        with timed("insert_interaction"):
+            recorded = await big_query.insert_interactions(records)
+    yield json.dumps({"done": True, "answered": len(unique) - errors, "errors": errors, "recorded": recorded}) + "\n"
+
+
+@router.post('/ask/batch')
+async def ask_batch(batch: BatchRequest, client_info: Dict[str, str] = Depends(get_client_info)):
+    """
+    Responde una lista de preguntas (con idioma y escuela opcionales) en una sola petición, p. ej.
+    para probar el chatbot con las preguntas frecuentes de cada escuela.
+
+    Returns:
+        StreamingResponse: NDJSON (application/x-ndjson) con una línea inicial ("batch_id",
+        "questions", "unique"), una por pregunta ("index", "response", "code", "response_id",
+        "language", "school") según terminan y una final ("done", "answered", "errors", "recorded").
+    """
+    if len(batch.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=413, detail=f"Como mucho {BATCH_MAX_QUESTIONS} preguntas por petición")
+    if batch.record not in ("bulk", "none"):
+        raise HTTPException(status_code=422, detail="record debe ser 'bulk' o 'none'")
+
+    # Preguntas idénticas (mismo texto normalizado, idioma y escuela) se responden una sola vez
+    groups: Dict[tuple, List[int]] = {}
+    for index, question in enumerate(batch.questions):
+        groups.setdefault((normalize_text(question.message), question.language, question.school), []).append(index)
+    unique_questions = [batch.questions[indices[0]] for indices in groups.values()]
+
+    # Se prepara antes de empezar a responder: si Translate falla (sin llegar a abrir el circuito),
+    # la petición falla entera con su código de error
+    prepared = await run_blocking("translate", prepare_batch, unique_questions)
+    return StreamingResponse(stream_batch(batch, groups, prepared, client_info), media_type="application/x-ndjson",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 
 class RateRequest(BaseModel):
     response_id: str
@@ -197,9 +553,8 @@ async def rate_response(rate_request: RateRequest):
     if rate_request.valoration and rate_request.valoration not in ['like', 'dislike']:
         return {"error": "La valoración debe ser 'like' o 'dislike' si se proporciona"}
     
-    logging.info(f"Feedback recibido - Response ID: {rate_request.response_id}, Valoración: {rate_request.valoration}")
-    if rate_request.description:
-        logging.info(f"Descripción adicional: {rate_request.description}")
+    logging.info("Feedback recibido - Response ID: %s, Valoración: %s", rate_request.response_id, rate_request.valoration,
+                 extra={"payload": {"description": rate_request.description}} if rate_request.description else None)
     
     await big_query.add_rating(
         session_id=rate_request.session_id,
@@ -214,6 +569,43 @@ async def rate_response(rate_request: RateRequest):
         "description": rate_request.description
     }
 
+@router.get('/stats')
+async def get_stats(hours: int = 24, by: str = "school", scope: str = "worker"):
+    """
+    Interacciones por código de resultado, tasa de NOT_FOUND y proporción de likes de las
+    últimas `hours` horas, agrupadas por las dimensiones de `by` (hour, school, language, code,
+    separadas por comas).
+
+    Con scope=worker (por defecto) salen de los agregados en memoria del worker que atiende
+    la petición, sin consultar BigQuery: con varios workers, solo cuentan lo que ha atendido
+    ese proceso. unmatched_ratings cuenta las valoraciones recibidas desde su arranque cuya
+    interacción no conocía. Con scope=global, de la tabla de agregados, que suma los volcados
+    de todos los workers e instancias. scope=instance se acepta como el antiguo nombre de worker.
+    """
+    dimensions = [dimension.strip() for dimension in by.split(",") if dimension.strip()]
+    unknown = set(dimensions) - set(rollups.DIMENSIONS)
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Dimensiones desconocidas: {', '.join(sorted(unknown))}")
+    if scope == "instance":
+        scope = "worker"
+    if scope not in ("worker", "global"):
+        raise HTTPException(status_code=422, detail="scope debe ser 'worker' o 'global'")
+    if scope == "worker" and not 1 <= hours <= rollups.rollup.retention_hours:
+        raise HTTPException(status_code=422, detail=f"hours debe estar entre 1 y {rollups.rollup.retention_hours}")
+
+    if scope == "global":
+        key = (hours, tuple(dimensions))
+        rows = stats_cache.get(key)
+        if rows is MISSING:
+            rows = await run_blocking("bigquery", big_query.query_stats, max(1, hours), dimensions)
+            stats_cache.set(key, rows)
+    else:
+        rows = rollups.rollup.rows(hours)
+    return {"scope": scope, "hours": hours, "by": dimensions, "groups": rollups.summarize(rows, dimensions),
+            "total": rollups.summarize(rows, [])[0] if rows else None,
+            "unmatched_ratings": rollups.rollup.unmatched_ratings if scope == "worker" else None}
+
+
 @router.post('/cambio-grupo')
 async def cambio_grupo(nre: int = Form(...)):
     url = "http://chatbot-eoi.murciaeduca.es/peticiones/index.php"
@@ -223,12 +615,13 @@ async def cambio_grupo(nre: int = Form(...)):
     }
     data = {"accion": "cambio-de-grupo", "NRE": int(nre)}
     try:
-        response = requests.post(url, json=data, headers=headers, timeout=30)
-        logging.info(f"Respuesta recibida: status_code={response.status_code}, contenido={response.text}")
+        with breakers["http"]:
+            response = await get_http_client().post(url, json=data, headers=headers)
+        logging.info("Respuesta recibida: status_code=%s", response.status_code, extra={"payload": {"content": response.text}})
         if response.status_code == 200:
             return {"result": "ok"}
         else:
             return {"result": "error"}
     except Exception as e:
-        logging.error(f"Excepción al hacer la petición: {e}")
+        logging.error("Excepción al hacer la petición: %s", e)
         return {"result": "error"}
@@ -0,0 +1,18 @@
+"""
+Configuración de gunicorn para servir la aplicación con varios workers de uvicorn.
+
+Cada worker es un proceso con su propio bucle de eventos y sus propios clientes, así que
+la aplicación aprovecha varios núcleos. Para que los workers compartan cachés, contadores
+y el buffer de BigQuery, usar STATE_BACKEND=redis (ver utils/shared_state.py).
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8080')}"
+# Un worker por núcleo asignado al contenedor; con 1 el comportamiento es el de uvicorn solo
+workers = int(os.getenv("WORKERS", os.getenv("WEB_CONCURRENCY", "1")))
+worker_class = "uvicorn_worker.UvicornWorker"
+# Por encima del mayor plazo de los backends (Speech, 30 s)
+timeout = int(os.getenv("WORKER_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("WORKER_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+accesslog = None
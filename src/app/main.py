@@ -1,24 +1,159 @@
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
+import asyncio
 import logging
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+# Antes de importar los servicios, que leen su configuración del entorno al importarse
+load_dotenv()
+
+from utils.logs import setup_logging  # noqa: E402
+
+setup_logging()
+
+from endpoints import ask_endpoint  # noqa: E402
+from services import big_query, fallbacks  # noqa: E402
+from utils import admission, cache, clients  # noqa: E402
+from utils.concurrency import shutdown_executors  # noqa: E402
+from utils.outbound import close_http_client  # noqa: E402
+from utils.uploads import UploadLimitMiddleware  # noqa: E402
+from utils import metrics  # noqa: E402
 
-from endpoints import ask_endpoint
+# Asigna un id de traza a cada petición (X-Request-ID) y lo devuelve en la respuesta
+TRACE_REQUESTS = os.getenv("TRACE_REQUESTS", "false").lower() in ("1", "true", "yes")
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Los clientes de Google se crean en la primera petición que los usa; PREWARM_CLIENTS
+    # adelanta algunos en segundo plano sin retrasar el arranque
+    prewarm_task = None
+    if clients.prewarm_names():
+        prewarm_task = asyncio.create_task(asyncio.to_thread(clients.prewarm))
+    # Traduce en segundo plano los idiomas que falten en el catálogo de respuestas de reserva
+    fallbacks_task = None
+    if fallbacks.FALLBACKS_BUILD_ON_STARTUP:
+        fallbacks_task = asyncio.create_task(asyncio.to_thread(fallbacks.catalog.build))
+    else:
+        missing = fallbacks.catalog.missing_languages()
+        if missing:
+            logging.warning("El catálogo de respuestas de reserva (%s) no tiene %s: esas respuestas se traducirán con Translate",
+                            fallbacks.catalog.path, ", ".join(missing))
+    compaction_task = None
+    if big_query.RATINGS_COMPACTION_INTERVAL > 0:
+        compaction_task = asyncio.create_task(big_query.run_ratings_compaction())
+    stats_task = None
+    if big_query.STATS_FLUSH_INTERVAL > 0:
+        stats_task = asyncio.create_task(big_query.run_stats_flush())
+    purge_task = None
+    if cache.CACHE_PURGE_INTERVAL > 0 and cache.disk_caches():
+        purge_task = asyncio.create_task(cache.run_cache_purge())
+    yield
+    if purge_task:
+        purge_task.cancel()
+    if compaction_task:
+        compaction_task.cancel()
+    if stats_task:
+        # Último volcado de los agregados, que se escribe al cerrar los escritores
+        stats_task.cancel()
+        big_query.flush_stats()
+    if prewarm_task:
+        await prewarm_task
+    if fallbacks_task:
+        await fallbacks_task
+    # Vaciar las escrituras pendientes de BigQuery antes de salir
+    big_query.close_writers()
+    await close_http_client()
+    shutdown_executors()
+
+
+app = FastAPI(lifespan=lifespan)
+
+TIMED_PATHS = {"/ask/text", "/ask/voice", "/rate", "/cambio-grupo"}
 
 app.include_router(ask_endpoint.router)
 
+# Los middlewares se ejecutan del último añadido (el más externo) al primero
+
+# Corta las subidas de audio demasiado grandes mientras llegan
+app.add_middleware(UploadLimitMiddleware, paths=admission.VOICE_ENDPOINTS)
+
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    # Se decide antes de leer el cuerpo, para rechazar un audio sin recibirlo entero
+    endpoint = request.url.path
+    reason = await admission.admit(endpoint, admission.client_ip(request))
+    if reason:
+        return JSONResponse({"error": "Servicio saturado, inténtalo de nuevo en unos segundos"}, status_code=429,
+                            headers={"Retry-After": str(admission.retry_after(reason))})
+    try:
+        response = await call_next(request)
+    except BaseException:
+        admission.release(endpoint)
+        raise
+    # call_next devuelve la respuesta antes de generar el cuerpo: la petición sigue en curso
+    # hasta enviar el último trozo (en /ask/*/stream y /ask/batch, hasta terminar de responder)
+    response.body_iterator = _release_after(response.body_iterator, endpoint)
+    return response
+
+
+async def _release_after(body, endpoint: str):
+    try:
+        async for chunk in body:
+            yield chunk
+    finally:
+        admission.release(endpoint)
+
+
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    token = None
+    if TRACE_REQUESTS:
+        # Cloud Run envía X-Cloud-Trace-Context con el formato "TRACE_ID/SPAN_ID;o=1"
+        incoming = request.headers.get("X-Request-ID") or request.headers.get("X-Cloud-Trace-Context", "").split("/")[0]
+        token = metrics.trace_id.set(incoming or uuid.uuid4().hex)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        if request.url.path in TIMED_PATHS:
+            metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=request.url.path)
+    if token is not None:
+        response.headers["X-Request-ID"] = metrics.trace_id.get()
+        metrics.trace_id.reset(token)
+    return response
+
+
+# CORS el último, para que envuelva al resto: los 429 y 413 de los middlewares anteriores también
+# llevan las cabeceras Access-Control-* y el navegador deja ver el código y Retry-After
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],       
+    allow_origins=["*"],
     allow_credentials=True,
-    allow_methods=["GET", "POST", "OPTIONS"],       
-    allow_headers=["*"],       
+    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_headers=["*"],
+    expose_headers=["Retry-After", "Server-Timing", "X-Request-ID"],
 )
 
-logging.basicConfig(level=logging.INFO)
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Métricas en formato de texto de Prometheus.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 
 # Entry point
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("src.app.main:app", host="0.0.0.0", port=8000, reload=True)
+    # En desarrollo: RELOAD=true recarga al cambiar el código (solo con un worker)
+    reload = os.getenv("RELOAD", "false").lower() in ("1", "true", "yes")
+    uvicorn.run("main:app", host="0.0.0.0", port=int(os.getenv("PORT", "8000")), reload=reload,
+                workers=None if reload else int(os.getenv("WORKERS", "1")))
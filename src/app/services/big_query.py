@@ -1,80 +1,338 @@
+import asyncio
 import logging
 import os
 
+from typing import Dict, List
 from datetime import datetime, timezone
-from dotenv import load_dotenv
-from typing import Dict
-from google.cloud import bigquery
+from services.bq_writer import BatchWriter, InteractionRecord, RatingEvent, SharedBatchWriter
+from services.rollups import DIMENSIONS, rollup
+from utils.clients import lazy_client
+from utils.concurrency import run_blocking
+from utils.metrics import REGISTRY
+from utils.outbound import DEADLINES
+from utils.shared_state import get_backend
 
-client = bigquery.Client()
+
+def _create_client():
+    from google.cloud import bigquery
+    return bigquery.Client()
+
+
+client = lazy_client("bigquery", _create_client)
 
 TABLE_ID = os.getenv("TABLE")
+RATINGS_TABLE_ID = os.getenv("RATINGS_TABLE", f"{TABLE_ID}_ratings")
+RATINGS_VIEW_ID = os.getenv("RATINGS_VIEW", f"{TABLE_ID}_with_ratings")
+RATINGS_COMPACTION_INTERVAL = float(os.getenv("RATINGS_COMPACTION_INTERVAL", "0"))
+RATINGS_COMPACTION_MIN_AGE = int(os.getenv("RATINGS_COMPACTION_MIN_AGE", "180"))
+# Tabla de agregados (services/rollups.py) y cada cuántos segundos se vuelcan (0 = no se vuelcan)
+STATS_TABLE_ID = os.getenv("STATS_TABLE", f"{TABLE_ID}_stats")
+STATS_FLUSH_INTERVAL = float(os.getenv("STATS_FLUSH_INTERVAL", "0"))
+
+# Última valoración y último feedback de cada interacción (los eventos posteriores prevalecen)
+_LATEST_RATINGS_SQL = """
+    SELECT
+        session_id,
+        interaction_id,
+        ARRAY_AGG(rating IGNORE NULLS ORDER BY timestamp DESC LIMIT 1)[SAFE_OFFSET(0)] AS rating,
+        ARRAY_AGG(feedback IGNORE NULLS ORDER BY timestamp DESC LIMIT 1)[SAFE_OFFSET(0)] AS feedback
+    FROM `{ratings}`
+    {where}
+    GROUP BY session_id, interaction_id
+"""
+
+RATINGS_VIEW_SQL = """
+    CREATE OR REPLACE VIEW `{view}` AS
+    SELECT
+        i.* EXCEPT (rating, feedback),
+        COALESCE(r.rating, i.rating) AS rating,
+        COALESCE(r.feedback, i.feedback) AS feedback
+    FROM `{table}` AS i
+    LEFT JOIN (""" + _LATEST_RATINGS_SQL.format(ratings="{ratings}", where="") + """) AS r
+    USING (session_id, interaction_id)
+"""
+
+RATINGS_COMPACTION_SQL = """
+    DECLARE cutoff TIMESTAMP DEFAULT TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @min_age MINUTE);
+
+    MERGE `{table}` AS i
+    USING (""" + _LATEST_RATINGS_SQL.format(ratings="{ratings}", where="WHERE timestamp < cutoff") + """) AS r
+    ON i.session_id = r.session_id AND i.interaction_id = r.interaction_id
+    WHEN MATCHED THEN UPDATE SET
+        rating = COALESCE(r.rating, i.rating),
+        feedback = COALESCE(r.feedback, i.feedback);
+
+    DELETE FROM `{ratings}` WHERE timestamp < cutoff;
+"""
+
+
+def _run_query(query: str, job_config):
+    query_job = client.get().query(query, job_config=job_config)
+    return query_job.result()
+
+
+_interaction_writer = None
+_rating_writer = None
+_stats_writer = None
+
+
+def _create_writer(table_id: str, name: str) -> BatchWriter:
+    # Con estado compartido (STATE_BACKEND=redis) el buffer de filas es común a todos los workers
+    backend = get_backend()
+    if backend.shared:
+        return SharedBatchWriter(client.get(), table_id, name=name, backend=backend, timeout=DEADLINES["bigquery"])
+    return BatchWriter(client.get(), table_id, name=name, timeout=DEADLINES["bigquery"])
+
+
+def get_interaction_writer() -> BatchWriter:
+    global _interaction_writer
+    if _interaction_writer is None:
+        _interaction_writer = _create_writer(TABLE_ID, "interactions")
+    return _interaction_writer
+
+
+def get_rating_writer() -> BatchWriter:
+    global _rating_writer
+    if _rating_writer is None:
+        _rating_writer = _create_writer(RATINGS_TABLE_ID, "ratings")
+    return _rating_writer
+
+
+def get_stats_writer() -> BatchWriter:
+    global _stats_writer
+    if _stats_writer is None:
+        _stats_writer = _create_writer(STATS_TABLE_ID, "stats")
+    return _stats_writer
+
+
+def _writer_metrics():
+    descriptions = {
+        "submitted": "Filas encoladas",
+        "written": "Filas escritas en BigQuery",
+        "retried": "Filas reintentadas",
+        "spilled": "Filas volcadas a disco",
+        "dropped": "Filas descartadas por no cumplir el esquema",
+    }
+    writers = [writer for writer in (_interaction_writer, _rating_writer, _stats_writer) if writer is not None]
+    return [
+        (f"chatbot_bigquery_rows_{key}_total", "counter", description,
+         [(f"chatbot_bigquery_rows_{key}_total", {"writer": writer.name}, writer.stats[key]) for writer in writers])
+        for key, description in descriptions.items()
+    ]
+
+
+REGISTRY.register_collector(_writer_metrics)
+
+
+def close_writers():
+    """
+    Vacía los escritores en segundo plano. Se llama al apagar la aplicación.
+    """
+    for writer in (_interaction_writer, _rating_writer, _stats_writer):
+        if writer is not None:
+            writer.close()
+
+
+def interaction_record(session_id: str, interaction_id: str, source: str, user_input: str, language: str, dialog_response: str, code: str, info_cli: Dict[str, str] = None, school: str="") -> InteractionRecord:
+    info_cli = info_cli or {}
+    return InteractionRecord(
+        session_id=session_id,
+        interaction_id=interaction_id,
+        source=source,
+        user_input=user_input,
+        language=language,
+        dialog_response=dialog_response,
+        dialogflow_code=code,
+        client_ip=info_cli.get('ip'),
+        client_user_agent=info_cli.get('user_agent'),
+        client_referer=info_cli.get('referer'),
+        context_school=school
+    )
+
 
 async def insert_interaction(session_id: str, interaction_id: str, source: str, user_input: str, language: str, dialog_response: str, code: str, info_cli: Dict[str, str] = None, school: str=""):
 
     """
-    Inserta una nueva interacción en la tabla de BigQuery.
+    Encola una nueva interacción para insertarla en la tabla de BigQuery.
+    La escritura se hace por lotes en segundo plano, por lo que la respuesta HTTP no espera a BigQuery.
     """
-    timestamp = datetime.now(timezone.utc)
-    query = f"""
-        INSERT INTO `{TABLE_ID}` (session_id, interaction_id, source, user_input, language, dialog_response, timestamp, dialogflow_code, client_ip, client_user_agent, client_referer, context_school )
-        VALUES (@session_id, @interaction_id, @source, @user_input, @language, @dialog_response, @timestamp, @dialogflow_code, @cli_ip, @cli_ua, @cli_rf, @ctx_school)
+    record = interaction_record(session_id, interaction_id, source, user_input, language, dialog_response, code, info_cli, school)
+    row = record.to_row()
+    get_interaction_writer().submit(row)
+    rollup.add_interaction(row)
+    logging.info("Interacción encolada para BigQuery: session_id=%s, interaction_id=%s", session_id, interaction_id)
+
+async def insert_interactions(records: List[InteractionRecord]) -> int:
     """
-    job_config = bigquery.QueryJobConfig(
-        query_parameters=[
-            bigquery.ScalarQueryParameter("session_id", "STRING", session_id),
-            bigquery.ScalarQueryParameter("interaction_id", "STRING", interaction_id),
-            bigquery.ScalarQueryParameter("source", "STRING", source),
-            bigquery.ScalarQueryParameter("user_input", "STRING", user_input),
-            bigquery.ScalarQueryParameter("language", "STRING", language),
-            bigquery.ScalarQueryParameter("dialog_response", "STRING", dialog_response),
-            bigquery.ScalarQueryParameter("timestamp", "TIMESTAMP", timestamp),
-            bigquery.ScalarQueryParameter("dialogflow_code", "STRING", code),
-            bigquery.ScalarQueryParameter("cli_ip", "STRING", info_cli['ip']),
-            bigquery.ScalarQueryParameter("cli_ua", "STRING", info_cli['user_agent']),
-            bigquery.ScalarQueryParameter("cli_rf", "STRING", info_cli['referer'] ),
-            bigquery.ScalarQueryParameter("ctx_school", "STRING",  school ),
-        ]
-    )
-    try:
-        query_job = client.query(query, job_config=job_config)
-        query_job.result()
-        logging.info(f"Interacción insertada en BigQuery: session_id={session_id}, interaction_id={interaction_id}")
-    except Exception as e:
-        logging.error(f"Error insertando interacción en BigQuery: {e}")
-        raise
+    Encola varias interacciones a la vez (p. ej. las de /ask/batch) en el escritor en segundo
+    plano, que las agrupa en sus lotes: la respuesta no espera a BigQuery ni a sus reintentos.
+
+    Returns:
+        int: Filas encoladas; las que no caben en la cola se vuelcan a disco como en el escritor.
+    """
+    writer = get_interaction_writer()
+    queued = 0
+    for record in records:
+        row = record.to_row()
+        queued += writer.submit(row)
+        rollup.add_interaction(row)
+    if records:
+        logging.info("%s interacciones encoladas para BigQuery en bloque", queued)
+    return queued
 
 async def add_rating(session_id: str, interaction_id: str, rating: str = None, feedback: str = None):
     """
-    Actualiza la valoración o el feedback de una interacción en la tabla de BigQuery.
+    Registra la valoración o el feedback de una interacción como un evento en la tabla de valoraciones.
     Al menos uno de los dos parámetros (rating o feedback) debe estar presente.
+
+    Los eventos se escriben por lotes en segundo plano (solo inserciones, sin UPDATE).
+    La vista RATINGS_VIEW devuelve las interacciones con su última valoración y
+    compact_ratings() los incorpora periódicamente a la tabla de interacciones.
     """
     if not rating and not feedback:
         raise ValueError("Se debe proporcionar al menos rating o feedback.")
 
-    set_clauses = []
-    params = [
-        bigquery.ScalarQueryParameter("session_id", "STRING", session_id),
-        bigquery.ScalarQueryParameter("interaction_id", "STRING", interaction_id),
+    event = RatingEvent(
+        session_id=session_id,
+        interaction_id=interaction_id,
+        rating=rating,
+        feedback=feedback
+    )
+    row = event.to_row()
+    get_rating_writer().submit(row)
+    rollup.add_rating(row)
+    logging.info("Valoración/feedback encolado para BigQuery: session_id=%s, interaction_id=%s", session_id, interaction_id)
+
+
+def create_ratings_objects():
+    """
+    Crea (si no existen) la tabla de eventos de valoración y la vista que la une con las interacciones.
+    """
+    from google.cloud import bigquery
+
+    schema = [
+        bigquery.SchemaField("session_id", "STRING", mode="REQUIRED"),
+        bigquery.SchemaField("interaction_id", "STRING", mode="REQUIRED"),
+        bigquery.SchemaField("rating", "STRING"),
+        bigquery.SchemaField("feedback", "STRING"),
+        bigquery.SchemaField("timestamp", "TIMESTAMP", mode="REQUIRED"),
+    ]
+    table = bigquery.Table(RATINGS_TABLE_ID, schema=schema)
+    table.time_partitioning = bigquery.TimePartitioning(field="timestamp")
+    client.get().create_table(table, exists_ok=True)
+    _run_query(RATINGS_VIEW_SQL.format(view=RATINGS_VIEW_ID, table=TABLE_ID, ratings=RATINGS_TABLE_ID), None)
+    logging.info(f"Tabla {RATINGS_TABLE_ID} y vista {RATINGS_VIEW_ID} preparadas")
+
+
+def compact_ratings(min_age_minutes: int = RATINGS_COMPACTION_MIN_AGE):
+    """
+    Incorpora a la tabla de interacciones los eventos de valoración con más de min_age_minutes
+    y los borra de la tabla de eventos. Solo se tocan eventos antiguos para no chocar con
+    filas que aún estén en el buffer de streaming.
+    """
+    from google.cloud import bigquery
+
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ScalarQueryParameter("min_age", "INT64", min_age_minutes)]
+    )
+    query = RATINGS_COMPACTION_SQL.format(table=TABLE_ID, ratings=RATINGS_TABLE_ID)
+    _run_query(query, job_config)
+    logging.info(f"Valoraciones compactadas en {TABLE_ID}")
+
+
+async def run_ratings_compaction(interval: float = RATINGS_COMPACTION_INTERVAL):
+    """
+    Tarea periódica de compactación de valoraciones. Se lanza desde el arranque de la aplicación
+    si RATINGS_COMPACTION_INTERVAL es mayor que cero.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_blocking("bigquery", compact_ratings)
+        except Exception as e:
+            logging.error(f"Error compactando valoraciones en BigQuery: {e}")
+
+
+def create_stats_table():
+    """
+    Crea (si no existe) la tabla de agregados de las interacciones.
+    """
+    from google.cloud import bigquery
+
+    schema = [
+        bigquery.SchemaField("hour", "TIMESTAMP", mode="REQUIRED"),
+        bigquery.SchemaField("school", "STRING"),
+        bigquery.SchemaField("language", "STRING"),
+        bigquery.SchemaField("code", "STRING"),
+        bigquery.SchemaField("interactions", "INT64"),
+        bigquery.SchemaField("likes", "INT64"),
+        bigquery.SchemaField("dislikes", "INT64"),
+        bigquery.SchemaField("flushed_at", "TIMESTAMP"),
     ]
-    if rating:
-        set_clauses.append("rating = @rating")
-        params.append(bigquery.ScalarQueryParameter("rating", "STRING", rating))
-    if feedback:
-        set_clauses.append("feedback = @feedback")
-        params.append(bigquery.ScalarQueryParameter("feedback", "STRING", feedback))
-
-    set_clause = ", ".join(set_clauses)
-    query = f"""
-        UPDATE `{TABLE_ID}`
-        SET {set_clause}
-        WHERE session_id = @session_id AND interaction_id = @interaction_id
-    """
-    job_config = bigquery.QueryJobConfig(query_parameters=params)
-    try:
-        query_job = client.query(query, job_config=job_config)
-        query_job.result()
-        logging.info(f"Valoración/feedback actualizado en BigQuery: session_id={session_id}, interaction_id={interaction_id}")
-    except Exception as e:
-        logging.error(f"Error actualizando valoración/feedback en BigQuery: {e}")
-        raise
+    table = bigquery.Table(STATS_TABLE_ID, schema=schema)
+    table.time_partitioning = bigquery.TimePartitioning(field="hour")
+    client.get().create_table(table, exists_ok=True)
+    logging.info(f"Tabla {STATS_TABLE_ID} preparada")
+
+
+def flush_stats() -> int:
+    """
+    Encola en la tabla de agregados los incrementos de services.rollups desde el último volcado:
+    una fila por hora, escuela, idioma y código con actividad.
+
+    Returns:
+        int: Filas encoladas.
+    """
+    rows = rollup.drain()
+    flushed_at = datetime.now(timezone.utc).isoformat()
+    writer = get_stats_writer()
+    for row in rows:
+        writer.submit(dict(row, flushed_at=flushed_at))
+    return len(rows)
+
+
+# Los totales son sumas de los incrementos volcados por todas las instancias
+STATS_SQL = """
+    SELECT {columns}, SUM(interactions) AS interactions, SUM(likes) AS likes, SUM(dislikes) AS dislikes
+    FROM `{table}`
+    WHERE hour >= TIMESTAMP_SUB(TIMESTAMP_TRUNC(CURRENT_TIMESTAMP(), HOUR), INTERVAL @hours - 1 HOUR)
+    GROUP BY {columns}
+"""
+
+
+def query_stats(hours: int, by) -> list:
+    """
+    Filas de la tabla de agregados de las últimas `hours` horas, agrupadas por `by` y el código
+    de resultado (para services.rollups.summarize).
+    """
+    from google.cloud import bigquery
+
+    columns = [dimension for dimension in DIMENSIONS if dimension in set(by) | {"code"}]
+    job_config = bigquery.QueryJobConfig(query_parameters=[bigquery.ScalarQueryParameter("hours", "INT64", hours)])
+    return [dict(row) for row in _run_query(STATS_SQL.format(columns=", ".join(columns), table=STATS_TABLE_ID), job_config)]
+
+
+async def run_stats_flush(interval: float = STATS_FLUSH_INTERVAL):
+    """
+    Tarea periódica de volcado de los agregados. Se lanza desde el arranque de la aplicación
+    si STATS_FLUSH_INTERVAL es mayor que cero.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            flush_stats()
+        except Exception as e:
+            logging.error(f"Error volcando los agregados a BigQuery: {e}")
+
+
+if __name__ == "__main__":
+    import sys
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) > 1 and sys.argv[1] == "compact":
+        compact_ratings()
+    else:
+        create_ratings_objects()
+        create_stats_table()
@@ -0,0 +1,524 @@
+import glob
+import json
+import logging
+import os
+import queue
+import random
+import re
+import socket
+import tempfile
+import threading
+import time
+import uuid
+
+from dataclasses import dataclass, asdict, field
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from utils.cache import MISSING
+
+BATCH_SIZE = int(os.getenv("BQ_BATCH_SIZE", "200"))
+FLUSH_INTERVAL = float(os.getenv("BQ_FLUSH_INTERVAL", "2.0"))
+QUEUE_SIZE = int(os.getenv("BQ_QUEUE_SIZE", "10000"))
+MAX_RETRIES = int(os.getenv("BQ_MAX_RETRIES", "5"))
+BACKOFF_BASE = float(os.getenv("BQ_BACKOFF_BASE", "0.5"))
+SPILL_DIR = os.getenv("BQ_SPILL_DIR", tempfile.gettempdir())
+# Segundos sin vaciar el buffer compartido tras los que se da por muerto un worker y sus filas
+# en proceso se devuelven al buffer. Ha de ser mayor que lo que puede tardar un lote con sus reintentos
+LEASE_TTL = float(os.getenv("BQ_LEASE_TTL", "300"))
+
+_STOP = object()
+
+
+@dataclass
+class InteractionRecord:
+    session_id: str
+    interaction_id: str
+    source: str
+    user_input: str
+    language: str
+    dialog_response: str
+    dialogflow_code: str
+    client_ip: Optional[str] = None
+    client_user_agent: Optional[str] = None
+    client_referer: Optional[str] = None
+    context_school: str = ""
+    timestamp: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+    def to_row(self) -> Dict[str, object]:
+        row = asdict(self)
+        row["timestamp"] = self.timestamp.isoformat()
+        return row
+
+
+@dataclass
+class RatingEvent:
+    session_id: str
+    interaction_id: str
+    rating: Optional[str] = None
+    feedback: Optional[str] = None
+    timestamp: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+
+    def to_row(self) -> Dict[str, object]:
+        row = asdict(self)
+        row["timestamp"] = self.timestamp.isoformat()
+        return row
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _is_invalid(error: Dict[str, object]) -> bool:
+    # BigQuery marca con "invalid" las filas que no cumplen el esquema; las demás del mismo
+    # lote vuelven con "stopped" y sí se pueden reintentar
+    return any(detail.get("reason") == "invalid" for detail in error.get("errors", []))
+
+
+class BatchWriter:
+    """
+    Escritor en segundo plano que agrupa filas y las envía a BigQuery con la API de streaming
+    (insert_rows_json), por tamaño de lote o por tiempo.
+
+    Las filas que no caben en la cola o que agotan los reintentos se vuelcan a un fichero
+    JSONL local (spill) que el hilo del escritor reenvía la próxima vez que arranca. Cada
+    proceso usa su propio fichero ("chatbot-eoi-{name}-{pid}.jsonl"), así que los workers de
+    gunicorn no se mezclan; al arrancar se reenvían también los de procesos que ya no existen,
+    incluidos los ".replay" que dejó a medias un proceso caído. Las líneas ilegibles se omiten
+    y el fichero que las contenía se aparta con el sufijo ".bad" para revisarlo.
+
+    Las filas que BigQuery rechaza por no cumplir el esquema no se reintentan: se descartan
+    con un error en el log y se cuentan en stats["dropped"].
+
+    Los contadores de `stats` se actualizan desde el hilo del escritor y desde los que encolan,
+    siempre con _count().
+    """
+
+    def __init__(self, client, table_id: str, name: str, batch_size: int = BATCH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL, queue_size: int = QUEUE_SIZE,
+                 max_retries: int = MAX_RETRIES, backoff_base: float = BACKOFF_BASE,
+                 spill_path: str = None, timeout: float = None):
+        self.client = client
+        self.table_id = table_id
+        self.name = name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.timeout = timeout
+        self._spill_root, self._spill_ext = os.path.splitext(spill_path or os.path.join(SPILL_DIR, f"chatbot-eoi-{name}.jsonl"))
+        self.spill_path = f"{self._spill_root}-{os.getpid()}{self._spill_ext}"
+
+        self.stats = {"submitted": 0, "written": 0, "retried": 0, "spilled": 0, "dropped": 0, "batches": 0}
+        self._stats_lock = threading.Lock()
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._spill_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name=f"bq-writer-{self.name}", daemon=True)
+            self._thread.start()
+
+    def _count(self, **amounts: int):
+        with self._stats_lock:
+            for key, amount in amounts.items():
+                self.stats[key] += amount
+
+    def submit(self, row: Dict[str, object], row_id: str = None) -> bool:
+        """
+        Encola una fila sin bloquear. Devuelve False si la cola estaba llena y la fila se volcó a disco.
+        """
+        if self._thread is None:
+            self.start()
+        item = (row_id or str(uuid.uuid4()), row)
+        self._count(submitted=1)
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            logging.warning(f"Cola de BigQuery '{self.name}' llena, volcando fila a {self.spill_path}")
+            self._spill([item])
+            return False
+
+    def write_now(self, rows: List[Dict[str, object]]) -> int:
+        """
+        Escribe las filas en el hilo que llama, como un único lote (con los reintentos y el volcado
+        a disco de siempre), sin pasar por la cola.
+
+        Returns:
+            int: Filas escritas.
+        """
+        self._count(submitted=len(rows))
+        return self._write([(str(uuid.uuid4()), row) for row in rows])
+
+    def flush(self, timeout: float = 30.0) -> bool:
+        """
+        Espera a que se escriba todo lo encolado hasta este momento. Devuelve False si no
+        terminó en `timeout` segundos (también si la cola siguió llena todo ese tiempo).
+        """
+        if self._thread is None:
+            return True
+        deadline = time.monotonic() + timeout
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(max(0.0, deadline - time.monotonic()))
+
+    def close(self, timeout: float = 30.0):
+        """
+        Vacía la cola y detiene el hilo. Se llama al apagar la aplicación.
+        """
+        if self._thread is None:
+            return
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(max(0.0, deadline - time.monotonic()))
+        if self._thread.is_alive():
+            logging.error(f"El escritor de BigQuery '{self.name}' no terminó en {timeout}s")
+        self._thread = None
+
+    def _run(self):
+        self._replay_pending()
+        batch: List[Tuple[str, Dict[str, object]]] = []
+        deadline = None
+        while True:
+            timeout = self.flush_interval if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                self._write(batch)
+                return
+            if isinstance(item, threading.Event):
+                self._write(batch)
+                batch, deadline = [], None
+                item.set()
+                continue
+            if item is not None:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if batch and (len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._write(batch)
+                batch, deadline = [], None
+
+    def _write(self, batch: List[Tuple[str, Dict[str, object]]]) -> int:
+        if not batch:
+            return 0
+        self._count(batches=1)
+        pending = batch
+        written = 0
+        for attempt in range(self.max_retries + 1):
+            try:
+                errors = self.client.insert_rows_json(
+                    self.table_id,
+                    [row for _, row in pending],
+                    row_ids=[row_id for row_id, _ in pending],
+                    timeout=self.timeout
+                )
+            except Exception as e:
+                logging.warning(f"Error escribiendo lote en BigQuery '{self.name}' (intento {attempt + 1}): {e}")
+            else:
+                errors = errors or []
+                failed = sorted({error["index"] for error in errors})
+                invalid = {error["index"] for error in errors if _is_invalid(error)}
+                self._count(written=len(pending) - len(failed))
+                written += len(pending) - len(failed)
+                if invalid:
+                    logging.error(f"BigQuery '{self.name}' rechazó {len(invalid)} filas inválidas, se descartan: "
+                                  f"{[error for error in errors if error['index'] in invalid]}")
+                    self._count(dropped=len(invalid))
+                pending = [pending[i] for i in failed if i not in invalid]
+                if not pending:
+                    return written
+                logging.warning(f"BigQuery '{self.name}' no escribió {len(pending)} filas (intento {attempt + 1}): {errors}")
+
+            if attempt < self.max_retries:
+                self._count(retried=len(pending))
+                time.sleep(self.backoff_base * (2 ** attempt) * (1 + random.random()))
+
+        logging.error(f"Agotados los reintentos para {len(pending)} filas de '{self.name}', volcando a {self.spill_path}")
+        self._spill(pending)
+        return written
+
+    def _spill(self, items: List[Tuple[str, Dict[str, object]]]):
+        with self._spill_lock:
+            try:
+                with open(self.spill_path, "a", encoding="utf-8") as spill_file:
+                    for row_id, row in items:
+                        spill_file.write(json.dumps({"row_id": row_id, "row": row}, ensure_ascii=False) + "\n")
+                self._count(spilled=len(items))
+            except OSError as e:
+                logging.error(f"No se pudieron volcar {len(items)} filas de '{self.name}' a disco: {e}")
+
+    def _replay_pending(self):
+        # Un fichero de volcado defectuoso no puede parar el hilo: sin él, lo encolado se perdería
+        try:
+            self._replay_spill()
+        except Exception:
+            logging.exception(f"Error reenviando las filas pendientes de '{self.name}' desde disco")
+
+    def _replay_spill(self):
+        # Desde el hilo del escritor: escribe los ficheros por lotes sin pasar por la cola, así que
+        # no bloquea a quien encola ni compite con las filas nuevas por su espacio
+        for replay_path in self._claim_spills():
+            try:
+                replayed, bad = self._replay_file(replay_path)
+            except Exception as e:
+                logging.error(f"No se pudo reenviar {replay_path}, se aparta como .bad: {e}")
+                self._set_aside(replay_path)
+                continue
+            if bad:
+                logging.error(f"{bad} líneas ilegibles en {replay_path}, se omitieron; el fichero se aparta como .bad")
+                self._set_aside(replay_path)
+            else:
+                os.remove(replay_path)
+            if replayed:
+                logging.info(f"Reenviadas {replayed} filas pendientes de '{self.name}' desde disco")
+
+    def _spill_files(self) -> List[str]:
+        """
+        Ficheros de volcado de este proceso y de los que ya no existen, con los ".replay" a medias.
+        """
+        pattern = re.compile(re.escape(os.path.basename(self._spill_root)) + r"(?:-(\d+))?"
+                             + re.escape(self._spill_ext) + r"(?:(?:\.[0-9a-f]+)?\.replay)?$")
+        own_pid = os.getpid()
+        paths = []
+        for path in sorted(glob.glob(glob.escape(self._spill_root) + "*")):
+            match = pattern.match(os.path.basename(path))
+            if match is None:
+                continue
+            owner = int(match.group(1)) if match.group(1) else None
+            if owner is None or owner == own_pid or not _pid_alive(owner):
+                paths.append(path)
+        return paths
+
+    def _claim_spills(self) -> List[str]:
+        # El rename es atómico: si varios workers arrancan a la vez, cada fichero lo reenvía uno solo
+        claimed = []
+        for path in self._spill_files():
+            replay_path = f"{self.spill_path}.{uuid.uuid4().hex[:8]}.replay"
+            try:
+                with self._spill_lock:
+                    os.replace(path, replay_path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logging.error(f"No se pudo reclamar el fichero de volcado {path}: {e}")
+                continue
+            claimed.append(replay_path)
+        return claimed
+
+    def _read_spill(self, path: str, skipped: List[int]) -> Iterator[Tuple[str, Dict[str, object]]]:
+        with open(path, encoding="utf-8", errors="replace") as spill_file:
+            for number, line in enumerate(spill_file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    item = (entry["row_id"], entry["row"])
+                except (ValueError, KeyError, TypeError) as e:
+                    logging.warning(f"Línea {number} ilegible en {path}, se omite: {e}")
+                    skipped.append(number)
+                    continue
+                yield item
+
+    def _replay_file(self, path: str) -> Tuple[int, int]:
+        replayed = 0
+        skipped: List[int] = []
+        batch: List[Tuple[str, Dict[str, object]]] = []
+        for item in self._read_spill(path, skipped):
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._resend(batch)
+                replayed += len(batch)
+                batch = []
+        self._resend(batch)
+        replayed += len(batch)
+        return replayed, len(skipped)
+
+    def _resend(self, batch: List[Tuple[str, Dict[str, object]]]):
+        # Lo que vuelva a fallar acaba en el fichero de volcado de este proceso
+        self._write(batch)
+
+    def _set_aside(self, path: str):
+        try:
+            os.replace(path, f"{path}.bad")
+        except OSError as e:
+            logging.error(f"No se pudo apartar {path}: {e}")
+
+
+class SharedBatchWriter(BatchWriter):
+    """
+    Variante de BatchWriter cuyo buffer es una lista en el estado compartido (utils.shared_state)
+    en lugar de una cola del proceso. Todos los workers encolan en la misma lista y cada uno
+    la vacía por lotes cada flush_interval, así que los lotes se llenan antes.
+
+    submit no espera al estado compartido: deja la fila en la cola del proceso y el hilo del
+    escritor la pasa al buffer por lotes, así que una petición nunca se bloquea en Redis. Si
+    la cola está llena o el buffer no responde, las filas se vuelcan a disco como en BatchWriter.
+
+    Cada lote pasa del buffer a una lista en proceso propia del worker (move_batch, atómico) y
+    se borra de ella después de escribirlo o volcarlo a disco. Antes de cada lote el worker
+    renueva su concesión (lease_ttl); los demás devuelven al buffer las filas en proceso de
+    los workers cuya concesión ha caducado, así que un worker que muere a mitad de un lote no
+    las pierde. Si un lote tarda más que la concesión puede escribirse dos veces; los row_id
+    permiten a BigQuery descartar los duplicados. Con el buffer vacío (length) no se mueve nada.
+
+    Args:
+        backend: Backend de estado compartido con push, move_batch, length, members y remove.
+        lease_ttl (float): Segundos sin renovar la concesión tras los que se recuperan las filas en proceso.
+    """
+
+    def __init__(self, client, table_id: str, name: str, backend, lease_ttl: float = LEASE_TTL, **kwargs):
+        super().__init__(client, table_id, name, **kwargs)
+        self.backend = backend
+        self.lease_ttl = lease_ttl
+        self.buffer_key = f"bq-buffer:{name}"
+        self.workers_key = f"bq-processing:{name}"
+        self.processing_key = f"{self.workers_key}:{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._registered = False
+        self._drain_lock = threading.Lock()
+        self._push_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name=f"bq-writer-{self.name}", daemon=True)
+            self._thread.start()
+
+    def flush(self, timeout: float = None) -> bool:
+        self._push_local()
+        self._drain()
+        return True
+
+    def close(self, timeout: float = 30.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        try:
+            # Despierta al hilo si está esperando filas en la cola
+            self._queue.put_nowait(_STOP)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.error(f"El escritor de BigQuery '{self.name}' no terminó en {timeout}s")
+        self._thread = None
+        self._push_local()
+        self._drain()
+        try:
+            self.backend.remove(self.workers_key, self.processing_key)
+            self.backend.delete(self._lease_key(self.processing_key))
+            self._registered = False
+        except Exception as e:
+            logging.warning(f"No se pudo dar de baja el escritor '{self.name}' en el estado compartido: {e}")
+
+    def _run(self):
+        self._replay_pending()
+        deadline = time.monotonic() + self.flush_interval
+        while not self._stop.is_set():
+            self._push_local(max(0.0, deadline - time.monotonic()))
+            if time.monotonic() >= deadline:
+                self._drain()
+                deadline = time.monotonic() + self.flush_interval
+
+    def _push_local(self, timeout: float = 0.0):
+        """
+        Pasa al buffer compartido, en una sola llamada, hasta batch_size filas de la cola del
+        proceso. Espera hasta `timeout` segundos a que llegue la primera.
+        """
+        with self._push_lock:
+            items = []
+            try:
+                items.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+                while len(items) < self.batch_size:
+                    items.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            self._resend([item for item in items if item is not _STOP])
+
+    @staticmethod
+    def _lease_key(processing_key: str) -> str:
+        return f"{processing_key}:lease"
+
+    def _renew_lease(self):
+        self.backend.set(self._lease_key(self.processing_key), 1, self.lease_ttl)
+
+    def _drain(self):
+        # Un solo vaciado a la vez por proceso: comparten la lista en proceso
+        with self._drain_lock:
+            try:
+                self._renew_lease()
+                if not self._registered:
+                    self.backend.push(self.workers_key, [self.processing_key])
+                    self._registered = True
+                self._recover()
+            except Exception as e:
+                logging.warning(f"Error en el estado compartido del escritor '{self.name}': {e}")
+                return
+            while True:
+                try:
+                    if not self.backend.length(self.buffer_key):
+                        return
+                    # Cada lote puede tardar hasta el plazo de inserción con sus reintentos
+                    self._renew_lease()
+                    items = self.backend.move_batch(self.buffer_key, self.processing_key, self.batch_size)
+                except Exception as e:
+                    logging.warning(f"Error leyendo el buffer compartido '{self.name}': {e}")
+                    return
+                if not items:
+                    return
+                self._write([tuple(json.loads(item)) for item in items])
+                # Escritas o volcadas a disco: se confirman quitándolas de la lista en proceso
+                try:
+                    self.backend.delete(self.processing_key)
+                except Exception as e:
+                    logging.warning(f"No se pudo confirmar un lote de '{self.name}'; se reescribirá: {e}")
+                    return
+
+    def _recover(self):
+        for processing_key in self.backend.members(self.workers_key):
+            if processing_key == self.processing_key or self.backend.get(self._lease_key(processing_key)) is not MISSING:
+                continue
+            recovered = 0
+            while True:
+                moved = self.backend.move_batch(processing_key, self.buffer_key, self.batch_size)
+                if not moved:
+                    break
+                recovered += len(moved)
+            self.backend.remove(self.workers_key, processing_key)
+            if recovered:
+                logging.warning(f"Devueltas al buffer {recovered} filas en proceso de un worker caído ({processing_key})")
+
+    def _resend(self, batch: List[Tuple[str, Dict[str, object]]]):
+        if not batch:
+            return
+        try:
+            self.backend.push(self.buffer_key, [json.dumps(item, ensure_ascii=False) for item in batch])
+        except Exception as e:
+            # Vuelven al fichero de volcado para el próximo arranque
+            logging.warning(f"No se pudieron reenviar {len(batch)} filas pendientes de '{self.name}': {e}")
+            self._spill(batch)
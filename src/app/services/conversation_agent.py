@@ -1,16 +1,19 @@
 import os
+import re
 import uuid
-import time
 import random
 import logging
-from dotenv import load_dotenv
 from typing import Dict
 from datetime import datetime
-from google.cloud import dialogflowcx_v3beta1 as dialogflowcx
+from services.dialogflow_sessions import sessions
+from utils.batching import SingleFlight, singleflight_collector
+from utils.cache import build_cache, MISSING
+from utils.clients import lazy_client
+from utils.outbound import DEADLINES, breakers, google_retry, keepalive_channel
+from utils.metrics import REGISTRY, cache_collector
+from utils.school_matcher import normalize
 
 
-load_dotenv()
-
 # Config of the agent
 PROJECT_ID = os.getenv('DIALOGFLOW_PROJECT_ID')
 LOCATION = os.getenv('DIALOGFLOW_LOCATION')
@@ -27,7 +30,51 @@ NOT_FOUND = ["Lo siento, pero no tengo información suficiente para poder respon
              "Lo siento, no dispongo de esa información",
              "Ahora mismo no tengo datos para responder, pero me actualizan constantemente, pregúntame algo más a ver como sale 😅"]
 
-session_client = dialogflowcx.SessionsClient()
+_WORD_RE = re.compile(r"\w+")
+
+
+
+def _create_session_client():
+    from google.cloud import dialogflowcx_v3beta1 as dialogflowcx
+    from google.cloud.dialogflowcx_v3beta1.services.sessions.transports import SessionsGrpcTransport
+    return dialogflowcx.SessionsClient(transport=SessionsGrpcTransport(channel=keepalive_channel(SessionsGrpcTransport)))
+
+
+session_client = lazy_client("dialogflow", _create_session_client)
+
+# Caché opcional de respuestas de Dialogflow para las preguntas frecuentes
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "2000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+# Intents (display name) cuya respuesta depende de algo más que la pregunta y nunca se cachean
+ANSWER_CACHE_BYPASS_INTENTS = {
+    intent.strip() for intent in os.getenv("ANSWER_CACHE_BYPASS_INTENTS", "").split(",") if intent.strip()
+}
+
+answer_cache = build_cache("answer", ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL)
+REGISTRY.register_collector(cache_collector(answer_cache))
+
+# Preguntas idénticas (misma pregunta normalizada, escuela y mes) que llegan a la vez desde sesiones
+# nuevas comparten una sola llamada a Dialogflow, p. ej. cuando un profesor comparte el enlace con
+# toda la clase. En una sesión con turnos previos la clave incluye la sesión de Dialogflow
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() in ("1", "true", "yes")
+
+dialogflow_flight = SingleFlight("dialogflow", enabled=SINGLE_FLIGHT_ENABLED)
+REGISTRY.register_collector(singleflight_collector(dialogflow_flight))
+
+
+def answer_cache_key(text: str, school: str, month: str) -> str:
+    """
+    Clave de la caché de respuestas: pregunta normalizada (minúsculas, sin tildes ni signos), escuela y mes.
+    """
+    words = " ".join(_WORD_RE.findall(normalize(text)))
+    return f"{school}|{month}|{words}"
+
+
+def is_cacheable(response) -> bool:
+    intent = response.query_result.match.intent.display_name
+    return intent not in ANSWER_CACHE_BYPASS_INTENTS
+
 
 def get_current_month():
     MESES_ES = [
@@ -38,26 +85,28 @@ def get_current_month():
 
 
 def get_response_info(message: str) -> Dict[str, str]:
-    def get_result_code():
-        if "NOT FOUND" in message:
-            return "NOT_FOUND"
-        if not message:
-            return "NOT_FOUND"
-        return "OK"
-
-    def get_response():
-        if "NOT FOUND" in message:
-            return random.choice(NOT_FOUND)
-        if not message:
-            return random.choice(NOT_FOUND)
-        return message
+    """
+    Código de resultado y texto a devolver. Si Dialogflow no encontró respuesta se usa un texto
+    de NOT_FOUND; "fallback" es su índice, para buscarlo ya traducido en services.fallbacks.
+    """
+    not_found = not message or "NOT FOUND" in message
+    fallback = random.randrange(len(NOT_FOUND)) if not_found else None
 
     return {
         "raw": message,
-        "result": get_result_code(),
-        "response": get_response()
+        "result": "NOT_FOUND" if not_found else "OK",
+        "response": NOT_FOUND[fallback] if not_found else message,
+        "fallback": fallback
     }
 
+def _detect_intent(request):
+    # Con Dialogflow caído el circuito se abre y se responde NOT_FOUND sin esperar al plazo
+    with breakers["dialogflow"]:
+        return session_client.get().detect_intent(
+            request=request, retry=google_retry("dialogflow"), timeout=DEADLINES["dialogflow"]
+        )
+
+
 def send_message(text: str, session_id: str = None, school: str = "murcia" ):
     """
     Send the message to the agent
@@ -67,28 +116,48 @@ def send_message(text: str, session_id: str = None, school: str = "murcia" ):
         session_id (str, optional): Session ID for the conversation. If None, creates a new one.
 
     Returns:
-        dict: Dictionary containing "message" and "session_id"
+        dict: Dictionary containing "message" and "session_id". "fallback" is the index of the
+        NOT_FOUND text used when there is no answer (None otherwise)
     """
     if session_id is None:
         session_id = str(uuid.uuid4())
 
-    session_dlgflow = f"{session_id}-{int(time.time())}"
-    session_path = session_client.session_path(PROJECT_ID, LOCATION, AGENT_ID, session_dlgflow)
-
-    text_input = dialogflowcx.TextInput(text=text)
-    query_input = dialogflowcx.QueryInput(text=text_input, language_code="es")
+    from google.cloud import dialogflowcx_v3beta1 as dialogflowcx
 
     # Inyectar variables de contexto
     context_params = {
         "escuela": school,
         "mes_actual": get_current_month()
     }
-    query_params = dialogflowcx.QueryParameters(
-        parameters=context_params,
-        time_zone="Europe/Paris"
-    )
 
-    response_id = "NULL_ID"
+    # La conversación sigue en la misma sesión de Dialogflow; los parámetros de contexto solo
+    # se envían si la sesión todavía no los tiene
+    session_dlgflow, session_params = sessions.lookup(session_id)
+    session_path = session_client.get().session_path(PROJECT_ID, LOCATION, AGENT_ID, session_dlgflow)
+    params = (school, context_params["mes_actual"])
+    # Una sesión con turnos previos responde según el contexto de la conversación: ni se sirve
+    # de la caché ni comparte la llamada con otros clientes, solo con sus propios reintentos
+    has_history = session_params is not None
+
+    # Respuesta cacheada para preguntas repetidas (misma pregunta, escuela y mes) en sesiones nuevas
+    question_key = answer_cache_key(text, school, context_params["mes_actual"])
+    flight_key = f"{session_dlgflow}|{question_key}" if has_history else question_key
+    cache_key = None
+    if ANSWER_CACHE_ENABLED and not has_history:
+        cache_key = question_key
+        cached = answer_cache.get(cache_key)
+        if cached is not MISSING:
+            response_info = get_response_info(cached)
+            return {"message": response_info['response'], "session_id": session_id, "response_id": str(uuid.uuid4()), "code_result": response_info['result'], "raw_response": response_info['raw'], "fallback": response_info['fallback']}
+
+    text_input = dialogflowcx.TextInput(text=text)
+    query_input = dialogflowcx.QueryInput(text=text_input, language_code="es")
+    query_params = dialogflowcx.QueryParameters(time_zone="Europe/Paris")
+    if params != session_params:
+        query_params.parameters = context_params
+
+    # Si Dialogflow falla la interacción se registra igual: necesita un id propio para sus valoraciones
+    response_id = str(uuid.uuid4())
     try:
         request = dialogflowcx.DetectIntentRequest(
             session=session_path,
@@ -96,20 +165,28 @@ def send_message(text: str, session_id: str = None, school: str = "murcia" ):
             query_params=query_params
         )
 
-        response = session_client.detect_intent(request=request)
+        response, shared = dialogflow_flight.do(flight_key, _detect_intent, request)
+        # Una respuesta compartida se pidió en la sesión de otro cliente: la suya no ha recibido los parámetros
+        if not shared:
+            sessions.remember(session_id, params)
         message = response.query_result.response_messages[0].text.text[0] if response.query_result.response_messages else ""
-        response_id = response.response_id
+        # Una respuesta compartida recibe un response_id propio para que las valoraciones sigan siendo únicas
+        response_id = str(uuid.uuid4()) if shared else response.response_id
 
         response_info = get_response_info(message)
+        if cache_key and is_cacheable(response):
+            answer_cache.set(cache_key, message)
 
         response_message =  response_info['response']
         response_result = response_info['result']
         response_raw = response_info['raw']
+        fallback = response_info['fallback']
 
     except Exception as e:
-        response_message = random.choice(NOT_FOUND)
+        fallback = random.randrange(len(NOT_FOUND))
+        response_message = NOT_FOUND[fallback]
         response_result = "ERROR"
         response_raw = f"Error en llamada a Dialogflow: {str(e)}"
 
-    return {"message": response_message, "session_id": session_id, "response_id": response_id, "code_result": response_result, "raw_response": response_raw}
+    return {"message": response_message, "session_id": session_id, "response_id": response_id, "code_result": response_result, "raw_response": response_raw, "fallback": fallback}
 
@@ -0,0 +1,148 @@
+"""
+Sesiones de Dialogflow CX reutilizadas entre turnos de la misma conversación.
+
+Cada session_id del cliente se asocia a una sesión estable de Dialogflow y a los últimos
+parámetros de contexto enviados (escuela, mes_actual), de modo que los turnos siguientes
+conservan el contexto de la conversación y solo reenvían los parámetros si han cambiado.
+"""
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from utils.cache import MISSING
+from utils.metrics import REGISTRY, Counter, cache_collector
+
+# Sesiones recordadas como máximo en la instancia
+DIALOGFLOW_SESSION_MAX = int(os.getenv("DIALOGFLOW_SESSION_MAX", "200000"))
+# Segundos de inactividad tras los que se olvida una sesión. Ha de ser menor que los 30 minutos
+# tras los que Dialogflow CX borra la sesión y sus parámetros
+DIALOGFLOW_SESSION_TTL = float(os.getenv("DIALOGFLOW_SESSION_TTL", "1500"))
+
+EVICTIONS = REGISTRY.register(Counter(
+    "chatbot_dialogflow_session_evictions_total", "Sesiones de Dialogflow olvidadas por motivo", ["reason"]
+))
+
+Params = Tuple[str, str]
+
+
+class SessionStore:
+    """
+    Mapa acotado session_id -> sesión de Dialogflow, con caducidad por inactividad.
+
+    Por sesión solo se guarda una tupla (caducidad, creación, parámetros): la sesión de
+    Dialogflow se reconstruye como "{session_id}-{creación}" y las tuplas de parámetros,
+    que se repiten entre sesiones, se comparten. Las sesiones se mantienen ordenadas de la
+    menos a la más reciente, así que las caducadas y las que sobran están siempre al principio.
+
+    Con un backend de estado compartido (STATE_BACKEND=redis) las sesiones se guardan en él,
+    con su TTL, y todos los workers usan la misma sesión de Dialogflow para cada cliente.
+
+    Args:
+        max_sessions (int): Sesiones recordadas como máximo en memoria.
+        ttl (float): Segundos de inactividad tras los que se olvida una sesión.
+        backend: Backend de utils.shared_state; si no es compartido se usa la memoria del proceso.
+    """
+
+    def __init__(self, max_sessions: int = DIALOGFLOW_SESSION_MAX, ttl: float = DIALOGFLOW_SESSION_TTL, backend=None):
+        self.name = "dialogflow_sessions"
+        self.max_sessions = max(1, max_sessions)
+        self.ttl = ttl
+        self.backend = backend if backend is not None and backend.shared else None
+        self.hits = 0
+        self.misses = 0
+        # OrderedDict y no dict: con pop + reinsertar en cada turno, un dict acumula huecos al
+        # principio y recorrerlo desde ahí para caducar sesiones deja de ser O(1)
+        self._sessions: "OrderedDict[str, Tuple[float, int, Optional[Params]]]" = OrderedDict()
+        self._params: Dict[Params, Params] = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, session_id: str) -> Tuple[str, Optional[Params]]:
+        """
+        Sesión de Dialogflow del cliente (la crea si no hay una viva) y últimos parámetros
+        enviados en ella, o None si todavía no se ha enviado ninguno.
+        """
+        if self.backend is not None:
+            return self._lookup_shared(session_id)
+
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                self.misses += 1
+                created, params = int(time.time()), None
+                if len(self._sessions) >= self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    EVICTIONS.inc(reason="capacity")
+            else:
+                self.hits += 1
+                _, created, params = entry
+                self._sessions.move_to_end(session_id)
+            self._sessions[session_id] = (now + self.ttl, created, params)
+        return f"{session_id}-{created}", params
+
+    def remember(self, session_id: str, params: Params):
+        """
+        Anota los parámetros que ya tiene la sesión de Dialogflow tras una llamada propia.
+        """
+        if self.backend is not None:
+            self._remember_shared(session_id, params)
+            return
+
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                params = self._params.setdefault(params, params)
+                self._sessions[session_id] = (entry[0], entry[1], params)
+
+    def _expire(self, now: float):
+        expired = 0
+        while self._sessions and next(iter(self._sessions.values()))[0] <= now:
+            self._sessions.popitem(last=False)
+            expired += 1
+        if expired:
+            EVICTIONS.inc(expired, reason="ttl")
+
+    def _lookup_shared(self, session_id: str) -> Tuple[str, Optional[Params]]:
+        key = f"dfsession:{session_id}"
+        entry = self.backend.get(key)
+        if entry is MISSING:
+            self.misses += 1
+            entry = [int(time.time()), None]
+        else:
+            self.hits += 1
+        # Se reescribe en cada turno para renovar el TTL
+        self.backend.set(key, entry, self.ttl)
+        created, params = entry
+        return f"{session_id}-{created}", tuple(params) if params else None
+
+    def _remember_shared(self, session_id: str, params: Params):
+        key = f"dfsession:{session_id}"
+        entry = self.backend.get(key)
+        if entry is not MISSING:
+            self.backend.set(key, [entry[0], list(params)], self.ttl)
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": None if self.backend is not None else len(self._sessions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+def _shared_backend():
+    from utils.shared_state import get_backend
+    return get_backend()
+
+
+sessions = SessionStore(backend=_shared_backend())
+REGISTRY.register_collector(cache_collector(sessions))
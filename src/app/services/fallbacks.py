@@ -0,0 +1,210 @@
+"""
+Catálogo de respuestas de reserva (NOT_FOUND y errores de Dialogflow) ya traducidas a los
+idiomas soportados, para responderlas sin llamar a Translate.
+
+El catálogo es un JSON {"source": [textos en español], "translations": {idioma: [textos]}}
+alineado con conversation_agent.NOT_FOUND. Se genera antes de construir la imagen con
+
+    python -m services.fallbacks --output services/fallbacks.json
+
+(que termina con error si falta algún idioma) y la aplicación lo recarga si el fichero
+cambia, sin redesplegar.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from services.conversation_agent import NOT_FOUND
+from utils.metrics import REGISTRY, cache_collector
+
+FALLBACKS_PATH = os.getenv("FALLBACKS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fallbacks.json"))
+# Idiomas a los que se traduce el catálogo (los de la detección de voz)
+FALLBACK_LANGUAGES = [
+    language.strip() for language in os.getenv("FALLBACK_LANGUAGES", "en,fr,de,it,zh,ar,ja").split(",") if language.strip()
+]
+# Cada cuántos segundos se mira si el fichero ha cambiado (negativo: no se recarga)
+FALLBACKS_REFRESH_INTERVAL = float(os.getenv("FALLBACKS_REFRESH_INTERVAL", "60"))
+# Traducir al arrancar los idiomas que falten en el fichero
+FALLBACKS_BUILD_ON_STARTUP = os.getenv("FALLBACKS_BUILD_ON_STARTUP", "false").lower() in ("1", "true", "yes")
+
+SOURCE_LANGUAGE = "es"
+
+
+def _language(language: str) -> str:
+    # Translate detecta "zh-CN" y Speech devuelve "zh"; el catálogo usa el código corto
+    return (language or "").split("-")[0].lower()
+
+
+def _translate_all(texts: List[str], language: str) -> List[str]:
+    from utils.outbound import breakers
+    from utils.translate import translate_client, unescape_html
+
+    with breakers["translate"]:
+        results = translate_client.get().translate(texts, target_language=language, source_language=SOURCE_LANGUAGE)
+    return [unescape_html(result["translatedText"]) for result in results]
+
+
+class FallbackCatalog:
+    """
+    Textos de reserva por idioma, en una tupla por idioma con el mismo orden que `source`.
+    Es seguro entre hilos.
+
+    Args:
+        source: Textos en español.
+        path (str, optional): Fichero JSON del catálogo, recargado cuando cambia.
+        refresh_interval (float): Segundos entre comprobaciones del fichero.
+    """
+
+    def __init__(self, source: Sequence[str], path: str = None, refresh_interval: float = FALLBACKS_REFRESH_INTERVAL):
+        self.source = tuple(source)
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.hits = 0
+        self.misses = 0
+        self._table: Dict[str, Tuple[str, ...]] = {}
+        self._mtime = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def get(self, index: int, language: str) -> Optional[str]:
+        """
+        Texto de reserva `index` en el idioma indicado, o None si el catálogo no tiene ese idioma.
+        """
+        language = _language(language)
+        if not language or language in ("und", SOURCE_LANGUAGE):
+            return self.source[index]
+        self._maybe_reload()
+        texts = self._table.get(language)
+        if texts is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return texts[index]
+
+    def languages(self) -> List[str]:
+        return sorted(self._table)
+
+    def missing_languages(self, languages: Iterable[str] = None) -> List[str]:
+        """
+        Idiomas de FALLBACK_LANGUAGES (o los indicados) que no están en el catálogo.
+        """
+        self._maybe_reload()
+        return [language for language in (FALLBACK_LANGUAGES if languages is None else languages)
+                if _language(language) not in self._table]
+
+    def set_language(self, language: str, texts: Sequence[str]):
+        if len(texts) != len(self.source):
+            raise ValueError(f"El catálogo de '{language}' tiene {len(texts)} textos y se esperaban {len(self.source)}")
+        with self._lock:
+            self._table[_language(language)] = tuple(texts)
+
+    def load(self, path: str = None) -> bool:
+        """
+        Carga (o recarga) las traducciones del fichero. Se ignora si se generó a partir de otros textos.
+        """
+        path = path or self.path
+        try:
+            with open(path, encoding="utf-8") as catalog_file:
+                data = json.load(catalog_file)
+        except (OSError, ValueError) as e:
+            logging.warning(f"No se pudo leer el catálogo de respuestas de reserva {path}: {e}")
+            return False
+        if data.get("source") != list(self.source):
+            logging.warning(f"El catálogo {path} se generó con otros textos de NOT_FOUND; hay que regenerarlo")
+            return False
+        table = {_language(language): tuple(texts) for language, texts in data.get("translations", {}).items()
+                 if len(texts) == len(self.source)}
+        with self._lock:
+            self._table.update(table)
+        logging.info(f"Catálogo de respuestas de reserva cargado: {', '.join(sorted(table))}")
+        return True
+
+    def _maybe_reload(self):
+        if not self.path or self.refresh_interval < 0:
+            return
+        now = time.monotonic()
+        if self._checked is not None and now - self._checked < self.refresh_interval:
+            return
+        self._checked = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self._mtime = mtime
+            self.load()
+
+    def build(self, languages: Iterable[str] = None, translate=_translate_all, force: bool = False) -> List[str]:
+        """
+        Traduce el catálogo a los idiomas que falten, con una llamada a Translate por idioma.
+        Los errores se registran y no interrumpen el resto de idiomas.
+
+        Returns:
+            list: Idiomas traducidos.
+        """
+        self._maybe_reload()
+        built = []
+        for language in FALLBACK_LANGUAGES if languages is None else languages:
+            if not force and _language(language) in self._table:
+                continue
+            try:
+                self.set_language(language, translate(list(self.source), language))
+                built.append(language)
+            except Exception as e:
+                logging.error(f"No se pudo traducir el catálogo de respuestas de reserva a '{language}': {e}")
+        return built
+
+    def save(self, path: str = None):
+        path = path or self.path
+        with self._lock:
+            translations = {language: list(texts) for language, texts in sorted(self._table.items())}
+        with open(path, "w", encoding="utf-8") as catalog_file:
+            json.dump({"source": list(self.source), "translations": translations}, catalog_file, ensure_ascii=False, indent=1)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "name": "fallbacks",
+            "size": len(self._table),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+catalog = FallbackCatalog(NOT_FOUND, FALLBACKS_PATH)
+REGISTRY.register_collector(cache_collector(catalog))
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Genera el catálogo de respuestas de reserva traducidas.")
+    parser.add_argument("--output", default=FALLBACKS_PATH)
+    parser.add_argument("--languages", default=",".join(FALLBACK_LANGUAGES))
+    parser.add_argument("--force", action="store_true", help="Volver a traducir los idiomas que ya estén en el fichero")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    output = FallbackCatalog(NOT_FOUND, args.output)
+    if os.path.exists(args.output):
+        output.load()
+    languages = args.languages.split(",")
+    built = output.build(languages, force=args.force)
+    output.save()
+    print(f"{args.output}: {', '.join(output.languages())} ({len(built)} traducidos ahora)")
+    missing = output.missing_languages(languages)
+    if missing:
+        # Cloud Build no debe construir una imagen con el catálogo incompleto
+        sys.exit(f"Faltan idiomas en el catálogo de respuestas de reserva: {', '.join(missing)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Estadísticas de las interacciones agregadas en memoria a medida que se registran: interacciones
+por hora, escuela, idioma y código de resultado, y likes/dislikes de sus valoraciones.
+
+Los agregados son de cada proceso: con varios workers de gunicorn cada uno cuenta solo las
+interacciones y valoraciones que ha atendido él.
+
+Los incrementos se vuelcan periódicamente a una tabla de agregados de BigQuery (una fila por
+combinación y volcado, en lugar de una por interacción), y /stats los sirve sin consultar la
+tabla de interacciones.
+"""
+import os
+import threading
+
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Tuple
+
+from utils.cache import MISSING, TTLCache
+from utils.language_detection import known_language
+from utils.school_matcher import known_school
+
+# Horas que se guardan en memoria para /stats
+STATS_RETENTION_HOURS = int(os.getenv("STATS_RETENTION_HOURS", "48"))
+# Interacciones recientes recordadas para asignar cada valoración a su escuela, idioma y código
+STATS_RATED_CACHE_SIZE = int(os.getenv("STATS_RATED_CACHE_SIZE", "50000"))
+STATS_RATED_CACHE_TTL = float(os.getenv("STATS_RATED_CACHE_TTL", "86400"))
+
+DIMENSIONS = ("hour", "school", "language", "code")
+
+# (hora, escuela, idioma, código) -> [interacciones, likes, dislikes]
+Key = Tuple[str, str, str, str]
+
+_INTERACTIONS, _LIKES, _DISLIKES = range(3)
+
+
+def hour_bucket(timestamp: datetime) -> str:
+    return timestamp.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0).isoformat()
+
+
+class InteractionRollup:
+    """
+    Contadores por (hora, escuela, idioma, código). Es segura entre hilos.
+
+    Guarda dos copias: los totales de las últimas `retention_hours` horas, para rows(), y los
+    incrementos desde el último volcado, que drain() devuelve y pone a cero.
+
+    Las valoraciones solo traen el id de la interacción, así que se recuerdan las interacciones
+    recientes para contarlas en su escuela, idioma y código. Si un usuario cambia su valoración
+    se descuenta la anterior en la hora del cambio. Las valoraciones de interacciones que ya no
+    se recuerdan (o de otro worker o instancia) no entran en ningún grupo: se cuentan en unmatched_ratings.
+
+    La escuela y el idioma llegan del cliente: se acotan con known_school y known_language,
+    como en las etiquetas de métricas, para que no creen grupos sin límite.
+
+    Args:
+        retention_hours (int): Horas guardadas para rows().
+        rated_cache_size (int): Interacciones recordadas para sus valoraciones.
+        rated_cache_ttl (float): Segundos que se recuerda cada interacción.
+    """
+
+    def __init__(self, retention_hours: int = STATS_RETENTION_HOURS, rated_cache_size: int = STATS_RATED_CACHE_SIZE,
+                 rated_cache_ttl: float = STATS_RATED_CACHE_TTL):
+        self.retention_hours = retention_hours
+        self.started = datetime.now(timezone.utc)
+        self._totals: Dict[Key, List[int]] = {}
+        self._pending: Dict[Key, List[int]] = {}
+        # interaction_id -> [clave sin hora, última valoración]
+        self._interactions = TTLCache(rated_cache_size, rated_cache_ttl, name="stats_interactions")
+        self._oldest_hour = None
+        self.unmatched_ratings = 0
+        self._lock = threading.Lock()
+
+    def _add(self, key: Key, column: int, amount: int = 1):
+        for counters in (self._totals, self._pending):
+            values = counters.get(key)
+            if values is None:
+                values = counters[key] = [0, 0, 0]
+            values[column] += amount
+
+    def add_interaction(self, row: Dict[str, object]):
+        """
+        Cuenta una fila de interacción (InteractionRecord.to_row()).
+        """
+        timestamp = datetime.fromisoformat(row["timestamp"])
+        dimensions = (known_school(row.get("context_school")), known_language(row.get("language")),
+                      row.get("dialogflow_code") or "")
+        with self._lock:
+            self._add((hour_bucket(timestamp),) + dimensions, _INTERACTIONS)
+            self._prune(timestamp)
+        self._interactions.set(row["interaction_id"], [dimensions, None])
+
+    def add_rating(self, row: Dict[str, object]):
+        """
+        Cuenta una fila de valoración (RatingEvent.to_row()); las que solo traen feedback no cuentan.
+        """
+        rating = row.get("rating")
+        if rating not in ("like", "dislike"):
+            return
+        interaction = self._interactions.get(row["interaction_id"])
+        if interaction is MISSING:
+            with self._lock:
+                self.unmatched_ratings += 1
+            return
+        dimensions, previous = interaction
+        if previous == rating:
+            return
+        key = (hour_bucket(datetime.fromisoformat(row["timestamp"])),) + dimensions
+        with self._lock:
+            if previous is not None:
+                self._add(key, _LIKES if previous == "like" else _DISLIKES, -1)
+            self._add(key, _LIKES if rating == "like" else _DISLIKES)
+        self._interactions.set(row["interaction_id"], [dimensions, rating])
+
+    def _prune(self, now: datetime):
+        # Como mucho una vez por hora: descarta de los totales las horas fuera de la retención
+        cutoff = hour_bucket(now - timedelta(hours=self.retention_hours))
+        if self._oldest_hour is not None and self._oldest_hour >= cutoff:
+            return
+        for key in [key for key in self._totals if key[0] < cutoff]:
+            del self._totals[key]
+        self._oldest_hour = min((key[0] for key in self._totals), default=cutoff)
+
+    def drain(self) -> List[Dict[str, object]]:
+        """
+        Incrementos desde la última llamada, como filas de la tabla de agregados.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return [
+            dict(zip(DIMENSIONS, key), interactions=values[_INTERACTIONS], likes=values[_LIKES], dislikes=values[_DISLIKES])
+            for key, values in pending.items()
+        ]
+
+    def rows(self, hours: int) -> List[Dict[str, object]]:
+        """
+        Totales de las últimas `hours` horas (incluida la actual) como filas de la tabla de agregados.
+        """
+        cutoff = hour_bucket(datetime.now(timezone.utc) - timedelta(hours=hours - 1))
+        with self._lock:
+            return [
+                dict(zip(DIMENSIONS, key), interactions=values[_INTERACTIONS], likes=values[_LIKES], dislikes=values[_DISLIKES])
+                for key, values in self._totals.items() if key[0] >= cutoff
+            ]
+
+
+def summarize(rows: Iterable[Dict[str, object]], by: Iterable[str]) -> List[Dict[str, object]]:
+    """
+    Agrupa filas de agregados por las dimensiones `by` (de DIMENSIONS) y calcula para cada grupo
+    las interacciones por código, la tasa de NOT_FOUND y la proporción de likes.
+    """
+    by = tuple(by)
+    groups: Dict[tuple, Dict[str, object]] = {}
+    for row in rows:
+        key = tuple(row[dimension] for dimension in by)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = dict(zip(by, key), interactions=0, codes={}, likes=0, dislikes=0)
+        group["interactions"] += row["interactions"]
+        if row["interactions"]:
+            group["codes"][row["code"]] = group["codes"].get(row["code"], 0) + row["interactions"]
+        group["likes"] += row["likes"]
+        group["dislikes"] += row["dislikes"]
+
+    for group in groups.values():
+        ratings = group["likes"] + group["dislikes"]
+        group["not_found_rate"] = group["codes"].get("NOT_FOUND", 0) / group["interactions"] if group["interactions"] else None
+        group["like_ratio"] = group["likes"] / ratings if ratings else None
+    return sorted(groups.values(), key=lambda group: tuple(str(group[dimension]) for dimension in by))
+
+
+rollup = InteractionRollup()
@@ -1,39 +1,40 @@
-import subprocess
-import tempfile
+import itertools
+import logging
+import os
+import threading
 
-from google.cloud import speech_v1p1beta1 as speech
+from services.transcoding import (
+    MAX_AUDIO_SECONDS, MAX_STREAMING_AUDIO_SECONDS, SAMPLE_RATE, AudioRejectedError, detect_format, limit_duration,
+    TranscoderUnavailableError, probe_audio, probe_wav, read_chunks, transcode_to_pcm,
+)
+from utils.clients import lazy_client
+from utils.outbound import DEADLINES, CircuitOpenError, breakers, google_retry, keepalive_channel
 from utils.translate import translate_text
 
 
-speech_client = speech.SpeechClient()
+def _speech():
+    from google.cloud import speech_v1p1beta1 as speech
+    return speech
 
-def transcribe_and_translate(file):
-    """
-    Transcribes an audio file and translates it into Spanish if it is in another language.
-    Supports: Spanish, English, French, German, Italian, Chinese, Arabic, Japanese
 
-    Args:
-        file : Audio of the user
+def _create_speech_client():
+    from google.cloud.speech_v1p1beta1.services.speech.transports import SpeechGrpcTransport
+    return _speech().SpeechClient(transport=SpeechGrpcTransport(channel=keepalive_channel(SpeechGrpcTransport)))
 
-    Returns:
-        str: Audio transcribed in spanish
-    """
-    input_filename = getattr(file, 'filename', None)
-    if input_filename and input_filename.lower().endswith('.webm'):
-        with tempfile.NamedTemporaryFile(suffix='.webm', delete=False) as temp_in, \
-             tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as temp_out:
-            temp_in.write(file.file.read())
-            temp_in.flush()
-            subprocess.run([
-                'ffmpeg', '-y', '-i', temp_in.name,
-                '-ar', '16000', '-ac', '1', '-f', 'wav', temp_out.name
-            ], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            temp_out.seek(0)
-            audio_content = temp_out.read()
-    else:
-        audio_content = file.file.read()
 
-    audio = speech.RecognitionAudio(content=audio_content)
+speech_client = lazy_client("speech", _create_speech_client)
+
+# Reconocimiento en streaming: el audio se envía a Speech por trozos (SPEECH_CHUNK_SIZE) a medida
+# que se lee y se convierte, sin cargar el clip entero en memoria ni el límite de ~60 s / 10 MB
+# de recognize síncrono
+SPEECH_STREAMING = os.getenv("SPEECH_STREAMING", "false").lower() in ("1", "true", "yes")
+
+# Bytes del principio del audio que se leen para identificarlo y comprobar su cabecera
+PROBE_SIZE = 64 * 1024
+
+
+def _recognition_config(sample_rate_hertz: int = None):
+    speech = _speech()
     config = speech.RecognitionConfig(
         encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
         language_code="es-ES",
@@ -50,17 +51,142 @@ def transcribe_and_translate(file):
             "ja-JP"   # Japanese
         ]
     )
-    
-    response = speech_client.recognize(config=config, audio=audio)
-    transcript = ""
-    detected_language = "es"
-    
-    for result in response.results:
+    if sample_rate_hertz:
+        config.sample_rate_hertz = sample_rate_hertz
+    return config
+
+
+def _collect_results(results, transcript: str, detected_language: str):
+    for result in results:
+        if not getattr(result, "is_final", True) or not result.alternatives:
+            continue
         transcript += result.alternatives[0].transcript
         if result.language_code:
             detected_language = result.language_code[:2]
-    
+    return transcript, detected_language
+
+
+def _audio_chunks(file, max_seconds: float):
+    """
+    Comprueba el audio antes de enviar nada a Speech y lo devuelve en trozos, convertido a PCM
+    si hace falta. Los WAV PCM de 16 bits mono se envían tal cual; el resto (otros formatos,
+    WAV estéreo o con otra profundidad) se convierte a PCM 16 bits mono a 16 kHz. De los WAV se
+    lee la cabecera y el resto se comprueba con probe_audio antes de convertirlo.
+
+    Returns:
+        tuple: Frecuencia de muestreo a indicar a Speech (None si la lee de la cabecera WAV)
+        y generador de trozos que corta el audio al superar max_seconds.
+
+    Raises:
+        AudioRejectedError: Si el audio está vacío, la cabecera WAV no es válida o dura demasiado.
+    """
+    start = file.file.tell()
+    header = file.file.read(PROBE_SIZE)
+    if not header:
+        raise AudioRejectedError("El audio está vacío")
+
+    if detect_format(header[:12]) == "wav":
+        info = probe_wav(header)
+        if max_seconds > 0 and info["duration"] and info["duration"] > max_seconds:
+            raise AudioRejectedError(f"El audio dura {info['duration']:.0f} s (máximo {max_seconds:g} s)",
+                                     reason="audio_duration")
+        chunks = itertools.chain([header], read_chunks(file.file))
+        if info["audio_format"] == 1 and info["bits"] == 16 and info["channels"] == 1:
+            return None, limit_duration(chunks, info["byte_rate"], max_seconds)
+    else:
+        file.file.seek(start)
+        probe_audio(file.file, max_seconds)
+        chunks = read_chunks(file.file)
+
+    return SAMPLE_RATE, limit_duration(transcode_to_pcm(chunks), SAMPLE_RATE * 2, max_seconds)
+
+
+def _transcribe_streaming(file):
+    sample_rate, chunks = _audio_chunks(file, MAX_STREAMING_AUDIO_SECONDS)
+
+    speech = _speech()
+    streaming_config = speech.StreamingRecognitionConfig(
+        config=_recognition_config(sample_rate),
+        interim_results=False
+    )
+    rejected = []
+    # gRPC consume audio_requests desde su propio hilo: el generador de trozos solo se avanza
+    # y se cierra con el lock, y al terminar `stop` le indica que no pida más
+    stop = threading.Event()
+    lock = threading.Lock()
+
+    def audio_requests():
+        while True:
+            with lock:
+                if stop.is_set():
+                    return
+                try:
+                    chunk = next(chunks, None)
+                except (AudioRejectedError, TranscoderUnavailableError) as e:
+                    # Se deja de enviar audio y el error se lanza al terminar, sin contarlo como fallo de Speech
+                    rejected.append(e)
+                    return
+            if chunk is None:
+                return
+            yield speech.StreamingRecognizeRequest(audio_content=chunk)
+
+    transcript = ""
+    detected_language = "es"
+    try:
+        with breakers["speech"]:
+            responses = speech_client.get().streaming_recognize(
+                config=streaming_config, requests=audio_requests(), timeout=DEADLINES["speech"]
+            )
+            for response in responses:
+                transcript, detected_language = _collect_results(response.results, transcript, detected_language)
+    finally:
+        # Libera el hueco de conversión y termina ffmpeg si Speech falló a mitad
+        stop.set()
+        with lock:
+            chunks.close()
+    if rejected:
+        raise rejected[0]
+    return transcript, detected_language
+
+
+def _transcribe_sync(file):
+    sample_rate, chunks = _audio_chunks(file, MAX_AUDIO_SECONDS)
+    audio_content = b"".join(chunks)
+
+    audio = _speech().RecognitionAudio(content=audio_content)
+    with breakers["speech"]:
+        response = speech_client.get().recognize(
+            config=_recognition_config(sample_rate), audio=audio, retry=google_retry("speech"), timeout=DEADLINES["speech"]
+        )
+    return _collect_results(response.results, "", "es")
+
+
+def transcribe_and_translate(file, streaming: bool = SPEECH_STREAMING):
+    """
+    Transcribes an audio file and translates it into Spanish if it is in another language.
+    Supports: Spanish, English, French, German, Italian, Chinese, Arabic, Japanese
+
+    Args:
+        file : Audio of the user
+        streaming (bool, optional): Use streaming recognition instead of a single synchronous request.
+
+    Returns:
+        str: Audio transcribed in spanish
+
+    Raises:
+        AudioRejectedError: If the audio is empty, invalid or longer than MAX_AUDIO_SECONDS
+            (MAX_STREAMING_AUDIO_SECONDS when streaming).
+    """
+    if streaming:
+        transcript, detected_language = _transcribe_streaming(file)
+    else:
+        transcript, detected_language = _transcribe_sync(file)
+
     if detected_language != "es":
-        transcript = translate_text(transcript, "es")
-    
-    return transcript
\ No newline at end of file
+        try:
+            transcript = translate_text(transcript, "es", detected_language)
+        except CircuitOpenError:
+            # Translate caído: la transcripción sigue sin traducir en lugar de fallar la petición
+            logging.warning("Circuito de Translate abierto: la transcripción se envía sin traducir")
+
+    return transcript
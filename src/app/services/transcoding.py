@@ -0,0 +1,317 @@
+import io
+import json
+import logging
+import os
+import struct
+import subprocess
+import threading
+
+try:
+    import av
+except ImportError:  # PyAV es opcional; sin él se usa el binario de ffmpeg
+    av = None
+
+SAMPLE_RATE = 16000
+CHUNK_SIZE = int(os.getenv("SPEECH_CHUNK_SIZE", "16000"))
+# Número máximo de conversiones simultáneas (cada una es un proceso ffmpeg o un decodificador PyAV)
+MAX_TRANSCODES = int(os.getenv("MAX_TRANSCODES", str(os.cpu_count() or 2)))
+# "auto" usa PyAV si está instalado y ffmpeg si no; también admite "ffmpeg" o "pyav"
+TRANSCODER = os.getenv("TRANSCODER", "auto").lower()
+
+# Duración máxima del audio de una pregunta (0 sin límite). recognize síncrono admite ~60 s
+MAX_AUDIO_SECONDS = float(os.getenv("MAX_AUDIO_SECONDS", "60"))
+# Duración máxima con reconocimiento en streaming (0 sin límite). Speech corta cada stream a los ~5 min
+MAX_STREAMING_AUDIO_SECONDS = float(os.getenv("MAX_STREAMING_AUDIO_SECONDS", "300"))
+
+FFMPEG_PCM_ARGS = ['-ar', str(SAMPLE_RATE), '-ac', '1', '-f', 's16le']
+
+_slots = threading.BoundedSemaphore(MAX_TRANSCODES)
+
+
+def detect_format(header: bytes) -> str:
+    """
+    Identifica el formato del audio por sus primeros bytes (números mágicos), sin fiarse del nombre del fichero.
+
+    Returns:
+        str: "wav", "webm", "ogg", "flac", "mp3", "mp4" o "unknown".
+    """
+    if header[:4] == b"RIFF" and header[8:12] == b"WAVE":
+        return "wav"
+    if header[:4] == b"\x1a\x45\xdf\xa3":
+        return "webm"
+    if header[:4] == b"OggS":
+        return "ogg"
+    if header[:4] == b"fLaC":
+        return "flac"
+    if header[:3] == b"ID3" or (len(header) > 1 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0):
+        return "mp3"
+    if header[4:8] == b"ftyp":
+        return "mp4"
+    return "unknown"
+
+
+class AudioRejectedError(ValueError):
+    """
+    El audio no se envía a Speech: es demasiado largo o no es un audio válido.
+
+    Args:
+        reason (str): "audio_duration" o "audio_invalid".
+    """
+
+    def __init__(self, message: str, reason: str = "audio_invalid"):
+        super().__init__(message)
+        self.reason = reason
+
+
+class TranscoderUnavailableError(RuntimeError):
+    """
+    No se puede comprobar ni convertir el audio: no está PyAV ni el binario de ffmpeg/ffprobe.
+    """
+
+
+def probe_wav(header: bytes):
+    """
+    Lee la cabecera de un WAV (los primeros 64 KB bastan) sin decodificar el audio.
+
+    Returns:
+        dict: "audio_format" (1 = PCM), "channels", "sample_rate", "bits", "byte_rate" y
+        "duration" (None si la cabecera no indica el tamaño de los datos, p. ej. al grabar en streaming).
+
+    Raises:
+        AudioRejectedError: Si la cabecera no es válida.
+    """
+    position = 12
+    info = None
+    while position + 8 <= len(header):
+        chunk_id, size = struct.unpack_from("<4sI", header, position)
+        position += 8
+        if chunk_id == b"fmt " and size >= 16:
+            audio_format, channels, sample_rate, byte_rate, _, bits = struct.unpack_from("<HHIIHH", header, position)
+            info = {"audio_format": audio_format, "channels": channels, "sample_rate": sample_rate,
+                    "bits": bits, "byte_rate": byte_rate, "duration": None}
+        elif chunk_id == b"data":
+            if info is None:
+                break
+            if info["byte_rate"] and size not in (0, 0xFFFFFFFF):
+                info["duration"] = size / info["byte_rate"]
+            break
+        position += size + (size & 1)
+    if info is None or not info["channels"] or not info["sample_rate"] or not info["byte_rate"]:
+        raise AudioRejectedError("Cabecera WAV no válida")
+    return info
+
+
+def _ffprobe_duration(stream, timeout: float):
+    # Desde una tubería ffprobe no puede ir al final del fichero, así que en algunos contenedores
+    # (WebM de MediaRecorder, Ogg) no conoce la duración y devuelve "N/A". Los bytes se pasan con
+    # input= y no con el descriptor: pedir fileno() a un SpooledTemporaryFile lo vuelca a disco
+    try:
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-select_streams', 'a:0', '-show_entries', 'format=duration:stream=codec_type',
+             '-of', 'json', '-i', 'pipe:0'],
+            input=stream.read(), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=timeout
+        )
+    except FileNotFoundError:
+        raise TranscoderUnavailableError("ffprobe no está instalado")
+    except subprocess.TimeoutExpired:
+        raise AudioRejectedError("No se pudo leer el audio a tiempo")
+    info = json.loads(result.stdout or b"{}") if result.returncode == 0 else {}
+    if not info.get("streams"):
+        raise AudioRejectedError("El fichero no contiene audio válido")
+    duration = info.get("format", {}).get("duration")
+    try:
+        return float(duration)
+    except (TypeError, ValueError):
+        return None
+
+
+def _pyav_duration(stream, max_seconds: float):
+    try:
+        with av.open(stream, mode="r") as container:
+            if not container.streams.audio:
+                raise AudioRejectedError("El fichero no contiene audio válido")
+            if container.duration:
+                return container.duration / av.time_base
+            # Sin duración en la cabecera se suman las duraciones de los paquetes, sin decodificarlos
+            total = 0.0
+            for packet in container.demux(container.streams.audio[0]):
+                if packet.duration and packet.time_base:
+                    total += float(packet.duration * packet.time_base)
+                    if max_seconds > 0 and total > max_seconds:
+                        break
+            return total or None
+    except av.error.FFmpegError:
+        raise AudioRejectedError("El fichero no contiene audio válido")
+
+
+def probe_audio(stream, max_seconds: float = MAX_AUDIO_SECONDS, timeout: float = 10.0):
+    """
+    Comprueba un audio que no es WAV (WebM, Ogg, MP3...) con PyAV o ffprobe antes de convertirlo,
+    leyendo solo el contenedor, y devuelve el fichero al principio.
+
+    Comparte los huecos de MAX_TRANSCODES con las conversiones.
+
+    Returns:
+        float: Duración en segundos, o None si el contenedor no la indica (entonces se cuenta
+        sobre el PCM convertido con limit_duration).
+
+    Raises:
+        AudioRejectedError: Si no es un audio válido o dura más de max_seconds.
+        TranscoderUnavailableError: Si no hay PyAV ni ffprobe.
+    """
+    start = stream.tell()
+    with _slots:
+        try:
+            if av is not None and TRANSCODER in ("auto", "pyav"):
+                duration = _pyav_duration(stream, max_seconds)
+            else:
+                duration = _ffprobe_duration(stream, timeout)
+        finally:
+            stream.seek(start)
+    if max_seconds > 0 and duration and duration > max_seconds:
+        raise AudioRejectedError(f"El audio dura {duration:.0f} s (máximo {max_seconds:g} s)", reason="audio_duration")
+    return duration
+
+
+def limit_duration(chunks, bytes_per_second: float, max_seconds: float = MAX_AUDIO_SECONDS):
+    """
+    Deja pasar los trozos de audio mientras no superen max_seconds de duración.
+
+    Raises:
+        AudioRejectedError: En cuanto el audio supera la duración máxima, antes de entregar ese trozo.
+    """
+    limit = max_seconds * bytes_per_second
+    total = 0
+    try:
+        for chunk in chunks:
+            total += len(chunk)
+            if max_seconds > 0 and total > limit:
+                raise AudioRejectedError(f"El audio dura más de {max_seconds:g} s", reason="audio_duration")
+            yield chunk
+    finally:
+        # Cierra la conversión (y libera su hueco) si se corta a mitad
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def read_chunks(stream, chunk_size: int = CHUNK_SIZE):
+    """
+    Lee un fichero abierto en trozos de como mucho chunk_size bytes.
+    """
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def rechunk(chunks, chunk_size: int = CHUNK_SIZE):
+    """
+    Reagrupa trozos de tamaño variable en trozos de chunk_size bytes (el último puede ser menor).
+    """
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer.extend(chunk)
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    if buffer:
+        yield bytes(buffer)
+
+
+def _ffmpeg_pcm(chunks, chunk_size: int):
+    try:
+        process = subprocess.Popen(
+            ['ffmpeg', '-loglevel', 'error', '-i', 'pipe:0'] + FFMPEG_PCM_ARGS + ['pipe:1'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+    except FileNotFoundError:
+        raise TranscoderUnavailableError("ffmpeg no está instalado")
+
+    def feed():
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+        except (BrokenPipeError, ValueError):
+            # ffmpeg terminó antes de leer toda la entrada (audio inválido o conversión cancelada)
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    feeder = threading.Thread(target=feed, name="ffmpeg-feed", daemon=True)
+    feeder.start()
+    try:
+        yield from read_chunks(process.stdout, chunk_size)
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, 'ffmpeg')
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        process.stdout.close()
+        feeder.join(timeout=1)
+
+
+class _ChunkReader(io.RawIOBase):
+    """
+    Adapta un iterador de trozos de bytes a un fichero de solo lectura para PyAV.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            try:
+                self._pending = next(self._chunks)
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def _pyav_pcm(chunks, chunk_size: int):
+    def frames():
+        with av.open(_ChunkReader(chunks), mode="r") as container:
+            resampler = av.AudioResampler(format="s16", layout="mono", rate=SAMPLE_RATE)
+            for frame in container.decode(audio=0):
+                for resampled in resampler.resample(frame):
+                    yield bytes(resampled.planes[0])[:resampled.samples * 2]
+            for resampled in resampler.resample(None):
+                yield bytes(resampled.planes[0])[:resampled.samples * 2]
+
+    yield from rechunk(frames(), chunk_size)
+
+
+def transcode_to_pcm(chunks, chunk_size: int = CHUNK_SIZE):
+    """
+    Convierte audio de cualquier formato a PCM 16 bits mono a 16 kHz, en streaming y sin tocar disco.
+
+    Como mucho MAX_TRANSCODES conversiones se ejecutan a la vez; el resto espera turno.
+    El hueco se libera (y ffmpeg se termina) al agotar o cerrar el generador.
+
+    Args:
+        chunks: Iterable de trozos de bytes del audio original.
+        chunk_size (int): Tamaño de los trozos PCM devueltos.
+
+    Yields:
+        bytes: Trozos de audio PCM s16le.
+    """
+    use_pyav = av is not None and TRANSCODER in ("auto", "pyav")
+    if TRANSCODER == "pyav" and av is None:
+        logging.warning("TRANSCODER=pyav pero PyAV no está instalado, se usa ffmpeg")
+
+    with _slots:
+        if use_pyav:
+            yield from _pyav_pcm(chunks, chunk_size)
+        else:
+            yield from _ffmpeg_pcm(chunks, chunk_size)
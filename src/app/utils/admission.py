@@ -0,0 +1,258 @@
+"""
+Control de admisión de los endpoints de preguntas: límites de peticiones por IP y por
+session_id (token bucket), tope de transcripciones de voz simultáneas y descarte de carga
+(respuesta 429 inmediata) cuando las colas de los backends superan la latencia objetivo.
+"""
+import logging
+import os
+import threading
+import time
+
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from utils import concurrency
+from utils.metrics import REGISTRY, Counter
+
+# Peticiones por segundo sostenidas y ráfaga máxima por IP y por session_id (0 desactiva el límite).
+# El de IP está desactivado por defecto: los alumnos de un aula salen todos por la misma IP del centro
+RATE_LIMIT_IP_RATE = float(os.getenv("RATE_LIMIT_IP_RATE", "0"))
+RATE_LIMIT_IP_BURST = int(os.getenv("RATE_LIMIT_IP_BURST", "200"))
+RATE_LIMIT_SESSION_RATE = float(os.getenv("RATE_LIMIT_SESSION_RATE", "1"))
+RATE_LIMIT_SESSION_BURST = int(os.getenv("RATE_LIMIT_SESSION_BURST", "10"))
+# Peticiones sin session_id, limitadas por IP. La ráfaga cubre la primera pregunta de toda un aula
+RATE_LIMIT_ANONYMOUS_RATE = float(os.getenv("RATE_LIMIT_ANONYMOUS_RATE", "1"))
+RATE_LIMIT_ANONYMOUS_BURST = int(os.getenv("RATE_LIMIT_ANONYMOUS_BURST", "60"))
+# Claves (IPs o sesiones) distintas que recuerda cada limitador en memoria
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+# Proxies de confianza delante de la aplicación que añaden una entrada a X-Forwarded-For
+# (1: el front end de Cloud Run). 0 no se fía de la cabecera y usa la IP de la conexión
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+# Peticiones de voz en curso a la vez en la instancia (0 sin límite)
+MAX_VOICE_INFLIGHT = int(os.getenv("MAX_VOICE_INFLIGHT", "8"))
+# Espera media en cola de un backend a partir de la cual se rechazan peticiones nuevas (0 desactiva)
+SHED_TARGET_LATENCY = float(os.getenv("SHED_TARGET_LATENCY", "2"))
+
+# Endpoints controlados y backends de los que depende cada uno
+ENDPOINT_BACKENDS = {
+    "/ask/text": ("dialogflow", "translate"),
+    "/ask/text/stream": ("dialogflow", "translate"),
+    "/ask/voice": ("speech", "dialogflow"),
+    "/ask/voice/stream": ("speech", "dialogflow"),
+    "/ask/batch": ("dialogflow", "translate"),
+}
+VOICE_ENDPOINTS = {"/ask/voice", "/ask/voice/stream"}
+
+REJECTED = REGISTRY.register(Counter(
+    "chatbot_admission_rejected_total", "Peticiones rechazadas con 429 por endpoint y motivo", ["endpoint", "reason"]
+))
+STATE_ERRORS = REGISTRY.register(Counter(
+    "chatbot_ratelimit_state_errors_total", "Peticiones admitidas sin límite porque falló el estado compartido", ["limiter"]
+))
+
+
+class RateLimiter:
+    """
+    Token bucket por clave: cada clave admite una ráfaga de `burst` peticiones y recupera
+    `rate` por segundo. Por clave solo se guarda una tupla (tokens, instante), en orden de
+    uso; al llegar a max_keys se descartan las menos recientes.
+
+    Con un backend de estado compartido (STATE_BACKEND=redis) el límite se aplica entre
+    todos los workers como una ventana fija de `burst` peticiones cada burst/rate segundos.
+    Si el backend falla, la petición se admite (y se cuenta en chatbot_ratelimit_state_errors_total).
+    Desde el event loop hay que usar allow_async, que hace la llamada en el pool "state".
+
+    Args:
+        name (str): Nombre del limitador ("ip", "session"), usado en métricas y claves.
+        rate (float): Peticiones por segundo sostenidas. 0 desactiva el límite.
+        burst (int): Tamaño del cubo.
+        max_keys (int): Claves recordadas como máximo en memoria.
+        backend: Backend de utils.shared_state; si no es compartido se usa la memoria del proceso.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, max_keys: int = RATE_LIMIT_MAX_KEYS, backend=None):
+        self.name = name
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_keys = max(1, max_keys)
+        self.backend = backend if backend is not None and backend.shared else None
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def allow(self, key: str) -> bool:
+        if not self.enabled or not key:
+            return True
+        if self.backend is not None:
+            return self._allow_shared(key)
+
+        now = time.monotonic()
+        with self._lock:
+            # pop + reinsertar deja las claves ordenadas de la menos a la más reciente
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            while len(self._buckets) >= self.max_keys:
+                self._buckets.popitem(last=False)
+            self._buckets[key] = (tokens, now)
+            return allowed
+
+    async def allow_async(self, key: str) -> bool:
+        if self.backend is None or not self.enabled or not key:
+            return self.allow(key)
+        return await concurrency.run_blocking("state", self._allow_shared, key)
+
+    def _allow_shared(self, key: str) -> bool:
+        window = self.burst / self.rate
+        slot = int(time.time() / window)
+        try:
+            return self.backend.incr(f"ratelimit:{self.name}:{key}:{slot}", ttl=window) <= self.burst
+        except Exception as e:
+            STATE_ERRORS.inc(limiter=self.name)
+            logging.warning("Límite '%s' sin estado compartido, se admite la petición: %s", self.name, e)
+            return True
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class InflightLimiter:
+    """
+    Cuenta las peticiones en curso y rechaza las nuevas al llegar a `limit` (0 sin límite).
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.inflight = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        with self._lock:
+            if self.limit > 0 and self.inflight >= self.limit:
+                return False
+            self.inflight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.inflight -= 1
+
+
+def _shared_backend():
+    from utils.shared_state import get_backend
+    return get_backend()
+
+
+ip_limiter = RateLimiter("ip", RATE_LIMIT_IP_RATE, RATE_LIMIT_IP_BURST, backend=_shared_backend())
+session_limiter = RateLimiter("session", RATE_LIMIT_SESSION_RATE, RATE_LIMIT_SESSION_BURST, backend=_shared_backend())
+anonymous_limiter = RateLimiter("anonymous", RATE_LIMIT_ANONYMOUS_RATE, RATE_LIMIT_ANONYMOUS_BURST,
+                                backend=_shared_backend())
+voice_limiter = InflightLimiter(MAX_VOICE_INFLIGHT)
+
+
+def client_ip(request, trusted_hops: int = TRUSTED_PROXY_HOPS) -> str:
+    """
+    IP real del cliente: la entrada de X-Forwarded-For que añadió el proxy de confianza más
+    externo (la trusted_hops-ésima empezando por el final), o la de la conexión.
+
+    Las entradas anteriores las pone el propio cliente y no sirven como clave de los límites.
+    """
+    forwarded_for = request.headers.get("X-Forwarded-For")
+    if forwarded_for and trusted_hops > 0:
+        entries = [entry.strip() for entry in forwarded_for.split(",") if entry.strip()]
+        if len(entries) >= trusted_hops:
+            return entries[-trusted_hops]
+
+    return request.client.host if request.client else ""
+
+
+def overloaded(endpoint: str) -> Optional[str]:
+    """
+    Devuelve el backend cuya cola supera SHED_TARGET_LATENCY, o None si se puede admitir la petición.
+    """
+    if SHED_TARGET_LATENCY <= 0:
+        return None
+    for backend in ENDPOINT_BACKENDS.get(endpoint, ()):
+        if concurrency.queue_wait(backend) > SHED_TARGET_LATENCY:
+            return backend
+    return None
+
+
+async def admit(endpoint: str, ip: str) -> Optional[str]:
+    """
+    Decide si se admite una petición antes de leer su cuerpo.
+
+    Returns:
+        str: Motivo del rechazo ("shed", "ip", "voice_concurrency") o None si se admite.
+        Si se admite una petición de voz, hay que llamar a release(endpoint) al terminar.
+    """
+    if endpoint not in ENDPOINT_BACKENDS:
+        return None
+    reason = None
+    if overloaded(endpoint):
+        reason = "shed"
+    elif not await ip_limiter.allow_async(ip):
+        reason = "ip"
+    elif endpoint in VOICE_ENDPOINTS and not voice_limiter.acquire():
+        reason = "voice_concurrency"
+    if reason:
+        REJECTED.inc(endpoint=endpoint, reason=reason)
+    return reason
+
+
+def release(endpoint: str):
+    if endpoint in VOICE_ENDPOINTS:
+        voice_limiter.release()
+
+
+def admit_session(endpoint: str, session_id: str, ip: str) -> Optional[str]:
+    """
+    Límite por session_id o, si la petición no lo trae, por IP con el limitador de anónimas.
+    Se llama desde una dependencia síncrona, fuera del event loop.
+
+    Returns:
+        str: Motivo del rechazo ("session", "anonymous") o None si se admite.
+    """
+    if session_id:
+        reason = None if session_limiter.allow(session_id) else "session"
+    else:
+        reason = None if anonymous_limiter.allow(ip) else "anonymous"
+    if reason:
+        REJECTED.inc(endpoint=endpoint, reason=reason)
+    return reason
+
+
+def retry_after(reason: str) -> int:
+    """
+    Segundos sugeridos en la cabecera Retry-After para cada motivo de rechazo.
+    """
+    if reason == "ip" and ip_limiter.enabled:
+        return max(1, round(1 / ip_limiter.rate))
+    if reason == "session" and session_limiter.enabled:
+        return max(1, round(1 / session_limiter.rate))
+    if reason == "anonymous" and anonymous_limiter.enabled:
+        return max(1, round(1 / anonymous_limiter.rate))
+    return 1
+
+
+def _admission_metrics():
+    return [
+        ("chatbot_voice_inflight", "gauge", "Peticiones de voz en curso",
+         [("chatbot_voice_inflight", {}, voice_limiter.inflight)]),
+        ("chatbot_ratelimit_keys", "gauge", "Claves recordadas por cada limitador en memoria",
+         [("chatbot_ratelimit_keys", {"limiter": limiter.name}, len(limiter)) for limiter in (ip_limiter, session_limiter, anonymous_limiter)]),
+        ("chatbot_backend_queue_wait_seconds", "gauge", "Espera de la llamada más antigua en la cola del pool de cada backend",
+         [("chatbot_backend_queue_wait_seconds", {"backend": backend}, concurrency.queue_wait(backend))
+          for backend in concurrency.BACKEND_LIMITS]),
+        ("chatbot_backend_backlog", "gauge", "Llamadas esperando un hilo libre en el pool de cada backend",
+         [("chatbot_backend_backlog", {"backend": backend}, concurrency.backlog(backend))
+          for backend in concurrency.BACKEND_LIMITS]),
+    ]
+
+
+REGISTRY.register_collector(_admission_metrics)
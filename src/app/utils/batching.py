@@ -0,0 +1,138 @@
+import threading
+import time
+
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable, List
+
+
+class MicroBatcher:
+    """
+    Agrupa llamadas concurrentes de distintos hilos en una sola llamada por lotes.
+
+    La primera llamada de cada grupo espera `window` segundos a que lleguen más; después
+    se ejecuta batch_func con todos los elementos acumulados y cada llamada recibe su
+    resultado. Si el lote llega a max_size se envía en el acto. No usa hilos propios:
+    el lote lo ejecuta el hilo que lo abrió (o el que lo llenó).
+
+    Args:
+        batch_func: Función (grupo, elementos) -> lista de resultados en el mismo orden.
+        window (float): Segundos que se espera a completar un lote.
+        max_size (int): Número máximo de elementos por lote.
+        name (str): Nombre del agrupador, usado en métricas y logs.
+    """
+
+    def __init__(self, batch_func: Callable[[Hashable, List[object]], List[object]], window: float,
+                 max_size: int, name: str = "batcher"):
+        self.batch_func = batch_func
+        self.window = window
+        self.max_size = max(1, max_size)
+        self.name = name
+        self.stats = {"items": 0, "batches": 0}
+        self._pending: Dict[Hashable, List[tuple]] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, group: Hashable, item):
+        """
+        Añade un elemento al lote abierto de su grupo y espera su resultado.
+        Las excepciones de batch_func se propagan a todas las llamadas del lote.
+        """
+        future = Future()
+        with self._lock:
+            batch = self._pending.setdefault(group, [])
+            batch.append((item, future))
+            leader = len(batch) == 1
+            full = len(batch) >= self.max_size
+            if full:
+                del self._pending[group]
+
+        if full:
+            self._run(group, batch)
+        elif leader:
+            time.sleep(self.window)
+            with self._lock:
+                # Si el lote ya se llenó y lo envió otro hilo, aquí hay otro lote (o ninguno)
+                mine = self._pending.get(group) is batch
+                if mine:
+                    del self._pending[group]
+            if mine:
+                self._run(group, batch)
+        return future.result()
+
+    def _run(self, group: Hashable, batch: List[tuple]):
+        with self._lock:
+            self.stats["items"] += len(batch)
+            self.stats["batches"] += 1
+        try:
+            results = self.batch_func(group, [item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+class SingleFlight:
+    """
+    Comparte una sola llamada entre peticiones concurrentes idénticas: mientras la primera
+    llamada con una clave está en curso, las demás con la misma clave esperan su resultado
+    (o su excepción) en lugar de repetirla. Es seguro entre hilos.
+
+    Args:
+        name (str): Nombre, usado en métricas y logs.
+        enabled (bool): Si es False, cada llamada se ejecuta por separado.
+    """
+
+    def __init__(self, name: str = "singleflight", enabled: bool = True):
+        self.name = name
+        self.enabled = enabled
+        self.stats = {"calls": 0, "shared": 0}
+        self._inflight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, func: Callable, *args, **kwargs):
+        """
+        Ejecuta func(*args, **kwargs) o espera la llamada en curso con la misma clave.
+
+        Returns:
+            tuple: (resultado, True si se reutilizó la llamada de otra petición).
+        """
+        if not self.enabled:
+            return func(*args, **kwargs), False
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+                self.stats["calls"] += 1
+            else:
+                self.stats["shared"] += 1
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+
+def singleflight_collector(*flights):
+    """
+    Collector con las llamadas hechas y las ahorradas por cada SingleFlight.
+    """
+    def collect():
+        return [
+            ("chatbot_singleflight_calls_total", "counter", "Llamadas ejecutadas por el coalescedor",
+             [("chatbot_singleflight_calls_total", {"flight": f.name}, f.stats["calls"]) for f in flights]),
+            ("chatbot_singleflight_shared_total", "counter", "Llamadas ahorradas al compartir una en curso",
+             [("chatbot_singleflight_shared_total", {"flight": f.name}, f.stats["shared"]) for f in flights]),
+        ]
+    return collect
@@ -0,0 +1,262 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import weakref
+
+from collections import OrderedDict
+
+MISSING = object()
+
+# Segundos entre purgas de las entradas caducadas de las cachés en SQLite (0 desactiva la purga)
+CACHE_PURGE_INTERVAL = float(os.getenv("CACHE_PURGE_INTERVAL", "600"))
+
+# Cachés en SQLite abiertas, para purgarlas periódicamente
+_disk_caches = weakref.WeakSet()
+
+
+class TTLCache:
+    """
+    Caché LRU en memoria con tamaño máximo y caducidad por entrada. Es segura entre hilos.
+
+    Args:
+        max_size (int): Número máximo de entradas; al superarlo se descarta la menos usada.
+        ttl (float): Segundos de vida de cada entrada (0 = sin caducidad).
+        name (str): Nombre de la caché, usado en métricas y logs.
+    """
+
+    def __init__(self, max_size: int, ttl: float, name: str = "cache"):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if not expires or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: float = None):
+        if self.max_size <= 0:
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl else 0
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+class SQLiteCache:
+    """
+    Caché persistente en un fichero SQLite que sobrevive a los reinicios. Los valores se guardan como JSON.
+
+    Con max_rows el fichero no crece sin límite: cada 1% de max_rows escrituras se borran las
+    entradas escritas hace más tiempo que sobran (así que puede pasarse en ese 1%). Las
+    caducadas se borran con purge_expired(), que run_cache_purge() llama periódicamente.
+
+    Args:
+        path (str): Ruta del fichero SQLite.
+        ttl (float): Segundos de vida de cada entrada (0 = sin caducidad).
+        name (str): Nombre de la caché, usado en métricas y logs.
+        max_rows (int): Entradas máximas en el fichero (0 = sin límite).
+    """
+
+    tier = "disk"
+
+    def __init__(self, path: str, ttl: float, name: str = "cache", max_rows: int = 0):
+        self.path = path
+        self.ttl = ttl
+        self.name = name
+        self.max_rows = max_rows
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._trim_every = max(1, max_rows // 100)
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)")
+        # El fichero puede venir de un arranque anterior con otro límite
+        with self._lock:
+            self._trim()
+        _disk_caches.add(self)
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            row = self._conn.execute("SELECT value, expires FROM cache WHERE key = ?", (key,)).fetchone()
+            if row and (not row[1] or row[1] > time.time()):
+                self.hits += 1
+                return json.loads(row[0])
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: float = None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.time() + ttl if ttl else 0
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires)
+            )
+            self._writes += 1
+            if self._writes % self._trim_every == 0:
+                self._trim()
+
+    def _trim(self):
+        # INSERT OR REPLACE da un rowid nuevo en cada escritura: los más bajos son las entradas más antiguas
+        if self.max_rows <= 0:
+            return
+        deleted = self._conn.execute(
+            "DELETE FROM cache WHERE rowid <= (SELECT rowid FROM cache ORDER BY rowid DESC LIMIT 1 OFFSET ?)",
+            (self.max_rows,)
+        ).rowcount
+        self.evictions += max(0, deleted)
+
+    def purge_expired(self) -> int:
+        """
+        Borra las entradas caducadas y devuelve cuántas.
+        """
+        with self._lock:
+            return self._conn.execute("DELETE FROM cache WHERE expires != 0 AND expires <= ?", (time.time(),)).rowcount
+
+    def stats(self):
+        total = self.hits + self.misses
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+        return {
+            "name": self.name,
+            "size": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+def disk_caches():
+    return list(_disk_caches)
+
+
+def purge_disk_caches():
+    for cache in disk_caches():
+        try:
+            purged = cache.purge_expired()
+        except sqlite3.Error as e:
+            logging.warning(f"Error purgando la caché persistente '{cache.name}': {e}")
+            continue
+        if purged:
+            logging.info("Purgadas %s entradas caducadas de la caché persistente '%s'", purged, cache.name)
+
+
+async def run_cache_purge(interval: float = CACHE_PURGE_INTERVAL):
+    """
+    Tarea periódica que purga las cachés en SQLite. Se lanza desde el arranque de la aplicación
+    si hay alguna abierta y CACHE_PURGE_INTERVAL es mayor que cero.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.to_thread(purge_disk_caches)
+
+
+class TieredCache:
+    """
+    Caché en dos niveles: LRU en memoria delante de una caché persistente (SQLite) o compartida
+    entre workers (utils.shared_state.SharedCache) opcional. Los aciertos del segundo nivel se
+    promocionan a memoria.
+    """
+
+    def __init__(self, memory: TTLCache, disk=None):
+        self.memory = memory
+        self.disk = disk
+        self.name = memory.name
+
+    def get(self, key, default=MISSING):
+        value = self.memory.get(key)
+        if value is not MISSING:
+            return value
+        if self.disk is not None:
+            try:
+                value = self.disk.get(key)
+            except Exception as e:
+                logging.warning(f"Error leyendo la caché persistente '{self.name}': {e}")
+                value = MISSING
+            if value is not MISSING:
+                self.memory.set(key, value)
+                return value
+        return default
+
+    def set(self, key, value, ttl: float = None):
+        self.memory.set(key, value, ttl)
+        if self.disk is not None:
+            try:
+                self.disk.set(key, value, ttl)
+            except Exception as e:
+                logging.warning(f"Error escribiendo la caché persistente '{self.name}': {e}")
+
+    def stats(self):
+        stats = {"memory": self.memory.stats()}
+        if self.disk is not None:
+            stats[self.disk.tier] = self.disk.stats()
+        return stats
+
+
+def build_cache(name: str, max_size: int, ttl: float, path: str = None, disk_size: int = 0) -> TieredCache:
+    """
+    Construye una caché en memoria con un segundo nivel compartido entre workers si STATE_BACKEND
+    lo permite o, si no, persistente en SQLite (con disk_size entradas como máximo) cuando se
+    indica una ruta.
+    """
+    from utils.shared_state import SharedCache, get_backend
+
+    disk = None
+    backend = get_backend()
+    if backend.shared:
+        disk = SharedCache(backend, ttl, name=name)
+    elif path:
+        try:
+            disk = SQLiteCache(path, ttl, name=name, max_rows=disk_size)
+        except sqlite3.Error as e:
+            logging.error(f"No se pudo abrir la caché persistente '{name}' en {path}: {e}")
+    return TieredCache(TTLCache(max_size, ttl, name=name), disk)
@@ -0,0 +1,96 @@
+"""
+Clientes de Google creados de forma perezosa, en la primera llamada que los necesita.
+
+Importar la aplicación no construye ningún cliente ni importa sus librerías, de modo que
+el arranque en frío de Cloud Run no paga el coste de servicios que la instancia quizá no
+use (p. ej. Speech en una instancia que solo atiende /rate). Con PREWARM_CLIENTS se
+pueden crear algunos en segundo plano al arrancar.
+"""
+import logging
+import os
+import threading
+import time
+
+from typing import Callable, Dict, Iterable
+
+# Clientes a crear al arrancar la aplicación: "all" o nombres separados por comas
+PREWARM_CLIENTS = os.getenv("PREWARM_CLIENTS", "")
+
+
+class LazyClient:
+    """
+    Singleton creado con factory la primera vez que se pide. Es seguro entre hilos.
+
+    Args:
+        name (str): Nombre del cliente ("translate", "dialogflow", "speech", "bigquery").
+        factory: Función sin argumentos que construye el cliente.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], object]):
+        self.name = name
+        self.factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    start = time.perf_counter()
+                    self._client = self.factory()
+                    logging.info(f"Cliente '{self.name}' creado en {time.perf_counter() - start:.3f}s")
+                client = self._client
+        return client
+
+    def set(self, client):
+        """
+        Sustituye el cliente (p. ej. por uno simulado en pruebas y benchmarks).
+        """
+        with self._lock:
+            self._client = client
+
+    @property
+    def created(self) -> bool:
+        return self._client is not None
+
+
+_clients: Dict[str, LazyClient] = {}
+_overrides: Dict[str, object] = {}
+
+
+def lazy_client(name: str, factory: Callable[[], object]) -> LazyClient:
+    client = LazyClient(name, factory)
+    if name in _overrides:
+        client.set(_overrides[name])
+    _clients[name] = client
+    return client
+
+
+def override(name: str, client):
+    """
+    Fija el cliente que se usará para name, aunque su módulo aún no se haya importado.
+    Lo usan los clientes simulados de tests/fakes.py.
+    """
+    _overrides[name] = client
+    if name in _clients:
+        _clients[name].set(client)
+
+
+def prewarm_names(spec: str = PREWARM_CLIENTS) -> Iterable[str]:
+    names = [name.strip() for name in spec.split(",") if name.strip()]
+    if "all" in names:
+        return list(_clients)
+    return [name for name in names if name in _clients]
+
+
+def prewarm(names: Iterable[str] = None):
+    """
+    Crea los clientes indicados (por defecto los de PREWARM_CLIENTS). Los errores se registran
+    y no impiden arrancar: el cliente se volverá a intentar crear en la primera petición.
+    """
+    for name in prewarm_names() if names is None else names:
+        try:
+            _clients[name].get()
+        except Exception as e:
+            logging.error(f"No se pudo precalentar el cliente '{name}': {e}")
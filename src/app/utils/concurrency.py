@@ -0,0 +1,90 @@
+import asyncio
+import contextvars
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Límite de llamadas bloqueantes simultáneas por backend. Cada backend tiene su
+# propio pool de hilos para que un servicio lento no agote los hilos del resto.
+BACKEND_LIMITS = {
+    "translate": int(os.getenv("MAX_CONCURRENCY_TRANSLATE", "16")),
+    "dialogflow": int(os.getenv("MAX_CONCURRENCY_DIALOGFLOW", "16")),
+    "speech": int(os.getenv("MAX_CONCURRENCY_SPEECH", "4")),
+    "bigquery": int(os.getenv("MAX_CONCURRENCY_BIGQUERY", "4")),
+    "http": int(os.getenv("MAX_CONCURRENCY_HTTP", "8")),
+    "state": int(os.getenv("MAX_CONCURRENCY_STATE", "8")),
+}
+
+_executors: dict = {}
+
+# Llamadas esperando un hilo libre por backend (id -> instante de envío, en orden de llegada).
+# Las usa el control de admisión para medir cuánto lleva esperando la más antigua.
+_waiting = {backend: {} for backend in BACKEND_LIMITS}
+
+
+def get_executor(backend: str) -> ThreadPoolExecutor:
+    executor = _executors.get(backend)
+    if executor is None:
+        if backend not in BACKEND_LIMITS:
+            raise ValueError(f"Backend desconocido: '{backend}'")
+        executor = ThreadPoolExecutor(
+            max_workers=max(1, BACKEND_LIMITS[backend]),
+            thread_name_prefix=f"{backend}-worker"
+        )
+        _executors[backend] = executor
+    return executor
+
+
+async def run_blocking(backend: str, func, *args, **kwargs):
+    """
+    Ejecuta una llamada bloqueante en el pool del backend indicado sin bloquear el event loop.
+
+    Args:
+        backend (str): Nombre del backend ("translate", "dialogflow", "speech", "bigquery", "http", "state").
+        func: Función síncrona a ejecutar.
+
+    Returns:
+        El valor devuelto por func.
+    """
+    loop = asyncio.get_running_loop()
+    executor = get_executor(backend)
+    # Se copia el contexto para que las contextvars (p. ej. ids de traza) lleguen al hilo
+    ctx = contextvars.copy_context()
+    waiting = _waiting[backend]
+    call_id = object()
+
+    def call():
+        waiting.pop(call_id, None)
+        return ctx.run(func, *args, **kwargs)
+
+    waiting[call_id] = time.perf_counter()
+    try:
+        return await loop.run_in_executor(executor, call)
+    finally:
+        waiting.pop(call_id, None)
+
+
+def backlog(backend: str) -> int:
+    """
+    Llamadas al backend esperando un hilo libre en su pool.
+    """
+    return len(_waiting[backend])
+
+
+def queue_wait(backend: str) -> float:
+    """
+    Segundos que lleva esperando un hilo libre la llamada más antigua al backend (0 si no hay cola).
+    """
+    try:
+        oldest = next(iter(_waiting[backend].values()))
+    except (StopIteration, RuntimeError):
+        # RuntimeError: el dict cambió mientras se leía desde otro hilo; se trata como sin cola
+        return 0.0
+    return time.perf_counter() - oldest
+
+
+def shutdown_executors(wait: bool = True):
+    for executor in _executors.values():
+        executor.shutdown(wait=wait)
+    _executors.clear()
@@ -0,0 +1,129 @@
+import math
+import re
+import unicodedata
+
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from utils.language_samples import SAMPLES
+
+SUPPORTED_LANGUAGES = ("es", "en", "fr", "de", "it", "zh", "ar", "ja")
+# Valor de los idiomas fuera de SUPPORTED_LANGUAGES en métricas y agregados
+OTHER_LANGUAGE = "other"
+
+NGRAM_SIZE = 3
+# Suaviza la confianza: sin él, el producto de probabilidades da posteriores de casi 1 incluso con frases cortas
+CONFIDENCE_TEMPERATURE = 4.0
+
+_WORD_RE = re.compile(r"[^\W\d_]+")
+
+
+def known_language(language: str) -> str:
+    """
+    Código de dos letras si es uno de SUPPORTED_LANGUAGES ("en-US" -> "en") u OTHER_LANGUAGE.
+
+    El idioma puede venir del cliente: así no crea series sin límite en métricas y agregados.
+    """
+    code = (language or "")[:2].lower()
+    return code if code in SUPPORTED_LANGUAGES else OTHER_LANGUAGE
+
+
+def _ngrams(text: str) -> List[str]:
+    grams = []
+    for word in _WORD_RE.findall(text.lower()):
+        padded = f" {word} "
+        grams.extend(padded[i:i + NGRAM_SIZE] for i in range(len(padded) - NGRAM_SIZE + 1))
+    return grams
+
+
+def _build_profiles(samples: Dict[str, str]) -> Tuple[Dict[str, Dict[str, float]], Dict[str, float]]:
+    counts = {language: Counter(_ngrams(text)) for language, text in samples.items()}
+    vocabulary = set()
+    for counter in counts.values():
+        vocabulary.update(counter)
+    profiles, unseen = {}, {}
+    for language, counter in counts.items():
+        # Suavizado de Laplace sobre el vocabulario común
+        total = sum(counter.values()) + len(vocabulary) + 1
+        profiles[language] = {gram: math.log((count + 1) / total) for gram, count in counter.items()}
+        unseen[language] = math.log(1 / total)
+    return profiles, unseen
+
+
+_PROFILES, _UNSEEN = _build_profiles(SAMPLES)
+
+
+def _script_counts(text: str) -> Counter:
+    scripts = Counter()
+    for char in text:
+        if not char.isalpha():
+            continue
+        code = ord(char)
+        if 0x0600 <= code <= 0x06FF or 0x0750 <= code <= 0x077F or 0xFB50 <= code <= 0xFEFF:
+            scripts["arabic"] += 1
+        elif 0x3040 <= code <= 0x30FF:
+            scripts["kana"] += 1
+        elif 0x4E00 <= code <= 0x9FFF or 0x3400 <= code <= 0x4DBF:
+            scripts["han"] += 1
+        elif unicodedata.name(char, "").startswith("LATIN"):
+            scripts["latin"] += 1
+        else:
+            scripts["other"] += 1
+    return scripts
+
+
+def rank_languages(text: str) -> List[Dict[str, float]]:
+    """
+    Devuelve los idiomas soportados ordenados por probabilidad estimada localmente.
+
+    Args:
+        text (str): Texto a analizar.
+
+    Returns:
+        list: Lista de {'language', 'confidence'} ordenada de mayor a menor confianza.
+    """
+    scripts = _script_counts(text)
+    total = sum(scripts.values())
+    if not total:
+        return []
+
+    # Alfabetos no latinos: el sistema de escritura basta para decidir
+    if scripts["arabic"] / total > 0.5:
+        return [{"language": "ar", "confidence": scripts["arabic"] / total}]
+    if scripts["kana"]:
+        return [{"language": "ja", "confidence": (scripts["kana"] + scripts["han"]) / total}]
+    if scripts["han"] / total > 0.5:
+        # Un texto solo con kanji puede ser japonés: se rebaja la confianza
+        return [{"language": "zh", "confidence": 0.9 * scripts["han"] / total},
+                {"language": "ja", "confidence": 0.1 * scripts["han"] / total}]
+
+    grams = _ngrams(text)
+    if not grams:
+        return []
+    scores = {}
+    for language, profile in _PROFILES.items():
+        unseen = _UNSEEN[language]
+        scores[language] = sum(profile.get(gram, unseen) for gram in grams) / CONFIDENCE_TEMPERATURE
+
+    best = max(scores.values())
+    weights = {language: math.exp(score - best) for language, score in scores.items()}
+    norm = sum(weights.values())
+    latin_share = scripts["latin"] / total
+    ranking = [
+        {"language": language, "confidence": latin_share * weight / norm}
+        for language, weight in weights.items()
+    ]
+    return sorted(ranking, key=lambda d: d["confidence"], reverse=True)
+
+
+def detect_language_local(text: str) -> Tuple[str, float]:
+    """
+    Detecta el idioma de un texto sin llamar a ninguna API.
+
+    Returns:
+        tuple: (código de idioma o 'und', confianza entre 0 y 1)
+    """
+    ranking = rank_languages(text)
+    if not ranking:
+        return "und", 0.0
+    return ranking[0]["language"], ranking[0]["confidence"]
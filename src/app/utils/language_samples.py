@@ -0,0 +1,99 @@
+"""
+Textos de entrenamiento del detector local de idiomas (utils/language_detection.py).
+
+Solo hacen falta para los idiomas con alfabeto latino; chino, japonés y árabe se
+distinguen por el sistema de escritura.
+"""
+
+SAMPLES = {
+    "es": """
+        Hola, quiero saber cuándo son los exámenes de certificación de inglés este año.
+        ¿Cómo puedo matricularme en la escuela oficial de idiomas si ya soy alumno?
+        Necesito cambiar de grupo porque el horario de la tarde no me viene bien.
+        ¿Dónde puedo consultar las notas de la prueba de nivel intermedio?
+        La secretaría abre por las mañanas de lunes a viernes y los martes por la tarde.
+        Me gustaría información sobre los cursos de francés y alemán para adultos.
+        ¿Qué documentos tengo que presentar para solicitar la beca de estudios?
+        El plazo de admisión termina la próxima semana y todavía no he pagado las tasas.
+        ¿Se puede hacer la matrícula por internet o hay que ir a la escuela?
+        Mi hijo tiene dieciséis años, ¿puede estudiar italiano en la escuela?
+        Quisiera saber si hay clases durante el verano y cuánto cuestan.
+        No encuentro el calendario escolar en la página web, ¿me lo podéis enviar?
+        Los alumnos que suspendan podrán presentarse a la convocatoria extraordinaria de septiembre.
+        ¿Cuántas faltas de asistencia se permiten antes de perder la plaza?
+        Gracias por la ayuda, ha sido muy útil toda la información que me habéis dado.
+        Para obtener el certificado hay que aprobar las cuatro destrezas del examen.
+    """,
+    "en": """
+        Hello, I would like to know when the English certification exams take place this year.
+        How can I enrol at the official language school if I am already a student?
+        I need to change my group because the afternoon timetable does not suit me.
+        Where can I check the results of the intermediate level test?
+        The office is open in the mornings from Monday to Friday and on Tuesday afternoons.
+        I would like some information about French and German courses for adults.
+        Which documents do I have to submit to apply for the study grant?
+        The admission period ends next week and I still have not paid the fees.
+        Can I register online or do I have to go to the school in person?
+        My son is sixteen years old, can he study Italian at the school?
+        I wanted to know whether there are classes during the summer and how much they cost.
+        I cannot find the school calendar on the website, could you send it to me?
+        Students who fail will be able to take the extraordinary exam in September.
+        How many absences are allowed before losing the place?
+        Thank you for your help, all the information you gave me was very useful.
+        To get the certificate you have to pass the four skills of the exam.
+    """,
+    "fr": """
+        Bonjour, je voudrais savoir quand ont lieu les examens de certification d'anglais cette année.
+        Comment puis-je m'inscrire à l'école officielle de langues si je suis déjà élève?
+        J'ai besoin de changer de groupe parce que l'horaire de l'après-midi ne me convient pas.
+        Où est-ce que je peux consulter les notes de l'épreuve de niveau intermédiaire?
+        Le secrétariat est ouvert le matin du lundi au vendredi et le mardi après-midi.
+        J'aimerais avoir des informations sur les cours de français et d'allemand pour adultes.
+        Quels documents dois-je présenter pour demander la bourse d'études?
+        La période d'admission se termine la semaine prochaine et je n'ai pas encore payé les frais.
+        Est-ce qu'on peut faire l'inscription en ligne ou faut-il aller à l'école?
+        Mon fils a seize ans, est-ce qu'il peut étudier l'italien à l'école?
+        Je voulais savoir s'il y a des cours pendant l'été et combien ils coûtent.
+        Je ne trouve pas le calendrier scolaire sur le site, pouvez-vous me l'envoyer?
+        Les élèves qui échouent pourront se présenter à la session extraordinaire de septembre.
+        Combien d'absences sont autorisées avant de perdre sa place?
+        Merci pour votre aide, toutes les informations que vous m'avez données étaient très utiles.
+        Pour obtenir le certificat il faut réussir les quatre compétences de l'examen.
+    """,
+    "de": """
+        Hallo, ich möchte wissen, wann die Zertifikatsprüfungen für Englisch dieses Jahr stattfinden.
+        Wie kann ich mich an der offiziellen Sprachschule anmelden, wenn ich schon Schüler bin?
+        Ich muss die Gruppe wechseln, weil mir der Stundenplan am Nachmittag nicht passt.
+        Wo kann ich die Noten der Prüfung für die Mittelstufe nachsehen?
+        Das Sekretariat ist morgens von Montag bis Freitag und am Dienstagnachmittag geöffnet.
+        Ich hätte gerne Informationen über die Französisch- und Deutschkurse für Erwachsene.
+        Welche Unterlagen muss ich einreichen, um das Stipendium zu beantragen?
+        Die Anmeldefrist endet nächste Woche und ich habe die Gebühren noch nicht bezahlt.
+        Kann man sich online einschreiben oder muss man persönlich zur Schule gehen?
+        Mein Sohn ist sechzehn Jahre alt, kann er an der Schule Italienisch lernen?
+        Ich wollte wissen, ob es im Sommer Unterricht gibt und wie viel er kostet.
+        Ich finde den Schulkalender nicht auf der Webseite, können Sie ihn mir schicken?
+        Schüler, die durchfallen, können im September an der außerordentlichen Prüfung teilnehmen.
+        Wie viele Fehlstunden sind erlaubt, bevor man den Platz verliert?
+        Vielen Dank für Ihre Hilfe, alle Informationen, die Sie mir gegeben haben, waren sehr nützlich.
+        Um das Zertifikat zu bekommen, muss man die vier Fertigkeiten der Prüfung bestehen.
+    """,
+    "it": """
+        Ciao, vorrei sapere quando si svolgono quest'anno gli esami di certificazione di inglese.
+        Come posso iscrivermi alla scuola ufficiale di lingue se sono già uno studente?
+        Ho bisogno di cambiare gruppo perché l'orario del pomeriggio non mi va bene.
+        Dove posso consultare i voti della prova di livello intermedio?
+        La segreteria è aperta la mattina dal lunedì al venerdì e il martedì pomeriggio.
+        Vorrei delle informazioni sui corsi di francese e tedesco per adulti.
+        Quali documenti devo presentare per richiedere la borsa di studio?
+        Il periodo di ammissione finisce la prossima settimana e non ho ancora pagato le tasse.
+        Si può fare l'iscrizione online o bisogna andare a scuola di persona?
+        Mio figlio ha sedici anni, può studiare italiano nella scuola?
+        Volevo sapere se ci sono lezioni durante l'estate e quanto costano.
+        Non trovo il calendario scolastico sul sito, me lo potete mandare?
+        Gli studenti che non superano l'esame potranno presentarsi alla sessione straordinaria di settembre.
+        Quante assenze sono permesse prima di perdere il posto?
+        Grazie per l'aiuto, tutte le informazioni che mi avete dato sono state molto utili.
+        Per ottenere il certificato bisogna superare le quattro abilità dell'esame.
+    """,
+}
@@ -0,0 +1,227 @@
+"""
+Logging de la aplicación sin bloquear las peticiones: los registros se encolan y un hilo
+aparte los formatea como JSON (el formato estructurado que entiende Cloud Logging) y los escribe.
+
+Los mensajes se formatean en ese hilo, así que en el camino de las peticiones hay que usar
+el estilo perezoso de logging ("texto %s", valor) en lugar de f-strings. Los textos largos
+(preguntas, respuestas de Dialogflow) van en extra={"payload": {...}}: se recortan a
+LOG_MAX_FIELD_CHARS y solo se incluyen en una fracción LOG_PAYLOAD_SAMPLE_RATE de los registros.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from utils.metrics import REGISTRY, Counter, trace_id
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json (registros estructurados) o text (una línea legible, para desarrollo)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+# Escribir desde un hilo aparte. Con false se escribe en el hilo que registra, como logging.basicConfig
+LOG_ASYNC = os.getenv("LOG_ASYNC", "true").lower() in ("1", "true", "yes")
+# Registros pendientes de escribir como máximo; a partir de ahí los nuevos se descartan (0 sin límite)
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Caracteres máximos de cada campo de payload
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "500"))
+# Fracción de registros que incluyen su payload (1 todos, 0 ninguno)
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "1"))
+# Registros por segundo admitidos por nivel ("INFO=200,DEBUG=50"). Por defecto no hay límite:
+# los niveles que no aparecen pasan todos
+LOG_RATE_LIMITS = os.getenv("LOG_RATE_LIMITS", "")
+
+DROPPED = REGISTRY.register(Counter(
+    "chatbot_log_dropped_total", "Registros de log descartados por nivel y motivo", ["level", "reason"]
+))
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue: Optional[queue.SimpleQueue] = None
+
+
+def parse_rate_limits(spec: str) -> Dict[int, float]:
+    limits = {}
+    for item in spec.split(","):
+        if "=" in item:
+            level, rate = item.split("=", 1)
+            limits[logging.getLevelName(level.strip().upper())] = float(rate)
+    return limits
+
+
+def truncate(value, max_chars: int = LOG_MAX_FIELD_CHARS):
+    if isinstance(value, str) and len(value) > max_chars:
+        return f"{value[:max_chars]}…(+{len(value) - max_chars})"
+    return value
+
+
+class RequestFilter(logging.Filter):
+    """
+    Filtro del camino de las peticiones: aplica el límite por nivel y anota el id de traza de
+    la petición (el contextvar no llega al hilo que escribe).
+
+    El límite es una ventana fija de un segundo por nivel. No usa locks: con varios hilos a la
+    vez puede dejar pasar algún registro de más, a cambio de no añadir contención. Al empezar
+    una ventana, si en la anterior se descartaron registros, se escribe un aviso con cuántos.
+    """
+
+    def __init__(self, limits: Dict[int, float]):
+        super().__init__()
+        self.limits = limits
+        self._windows: Dict[int, list] = {level: [0, 0] for level in limits}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        window = self._windows.get(record.levelno)
+        if window is not None and not getattr(record, "dropped_report", False):
+            second = int(time.monotonic())
+            if window[0] != second:
+                dropped = window[1] - self.limits[record.levelno]
+                window[0], window[1] = second, 0
+                if dropped > 0:
+                    _report_dropped(record.levelname, dropped)
+            window[1] += 1
+            if window[1] > self.limits[record.levelno]:
+                DROPPED.inc(level=record.levelname, reason="rate_limit")
+                return False
+        record.trace_id = trace_id.get()
+        return True
+
+
+def _report_dropped(level: str, dropped: float):
+    # El aviso no cuenta para el límite de WARNING: así nunca se pierde
+    logging.getLogger(__name__).warning("Descartados %d registros %s por LOG_RATE_LIMITS en el último segundo",
+                                        dropped, level, extra={"dropped_report": True})
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler que encola el registro sin formatearlo (el formateo se hace en el hilo del
+    listener), sin el lock del handler y descartando los registros si la cola tiene ya
+    max_size pendientes en lugar de esperar.
+
+    Usa queue.SimpleQueue, que está en C y no tiene límite ni locks en Python: el límite se
+    comprueba con qsize() y puede pasarse en algún registro si encolan varios hilos a la vez.
+    """
+
+    def __init__(self, queue_: queue.SimpleQueue, max_size: int = LOG_QUEUE_SIZE):
+        super().__init__(queue_)
+        self.max_size = max_size
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        if not self.filter(record):
+            return False
+        self.emit(record)
+        return True
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.max_size > 0 and self.queue.qsize() >= self.max_size:
+            DROPPED.inc(level=record.levelname, reason="queue_full")
+            return
+        self.queue.put_nowait(record)
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Un objeto JSON por línea con severity, message, time, logger, el id de traza y el payload
+    (recortado y muestreado).
+    """
+
+    def __init__(self, max_field_chars: int = LOG_MAX_FIELD_CHARS, payload_sample_rate: float = LOG_PAYLOAD_SAMPLE_RATE):
+        super().__init__()
+        self.max_field_chars = max_field_chars
+        self.payload_sample_rate = payload_sample_rate
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            # Los nombres de nivel de logging coinciden con las severidades de Cloud Logging
+            "severity": record.levelname,
+            "message": truncate(record.getMessage(), self.max_field_chars * 4),
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "logger": record.name,
+        }
+        if getattr(record, "trace_id", ""):
+            entry["trace_id"] = record.trace_id
+        payload = getattr(record, "payload", None)
+        if payload and (self.payload_sample_rate >= 1 or random.random() < self.payload_sample_rate):
+            entry.update({key: truncate(value, self.max_field_chars) for key, value in payload.items()})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """
+    Formato de logging.basicConfig con el payload recortado al final de la línea.
+    """
+
+    def __init__(self, max_field_chars: int = LOG_MAX_FIELD_CHARS):
+        super().__init__(logging.BASIC_FORMAT)
+        self.max_field_chars = max_field_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        payload = getattr(record, "payload", None)
+        if payload:
+            line += " | " + " ".join(f"{key}={truncate(value, self.max_field_chars)!r}" for key, value in payload.items())
+        return line
+
+
+def setup_logging(stream=None, level: str = LOG_LEVEL, log_format: str = LOG_FORMAT, use_queue: bool = LOG_ASYNC,
+                  rate_limits: str = LOG_RATE_LIMITS, queue_size: int = LOG_QUEUE_SIZE) -> logging.Handler:
+    """
+    Configura el logger raíz (sustituye a logging.basicConfig). Se puede llamar varias veces:
+    cada llamada reemplaza la configuración anterior.
+
+    Returns:
+        logging.Handler: El handler añadido al logger raíz.
+    """
+    global _listener, _queue
+    stop_logging()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if log_format == "json" else TextFormatter())
+
+    if use_queue:
+        _queue = queue.SimpleQueue()
+        handler = AsyncQueueHandler(_queue, queue_size)
+        _listener = logging.handlers.QueueListener(_queue, output, respect_handler_level=False)
+        _listener.start()
+    else:
+        handler = output
+    handler.addFilter(RequestFilter(parse_rate_limits(rate_limits)))
+
+    root = logging.getLogger()
+    for previous in root.handlers[:]:
+        root.removeHandler(previous)
+    root.addHandler(handler)
+    root.setLevel(level)
+    return handler
+
+
+@atexit.register
+def stop_logging():
+    """
+    Escribe los registros pendientes y para el hilo del listener. Se llama al salir del proceso.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _logging_metrics():
+    return [
+        ("chatbot_log_queue_size", "gauge", "Registros de log pendientes de escribir",
+         [("chatbot_log_queue_size", {}, _queue.qsize() if _queue is not None else 0)]),
+    ]
+
+
+REGISTRY.register_collector(_logging_metrics)
@@ -0,0 +1,203 @@
+"""
+Métricas en memoria con exposición en formato de texto de Prometheus (ruta /metrics).
+"""
+import bisect
+import contextvars
+import logging
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Identificador de la petición en curso (vacío si las trazas están desactivadas)
+trace_id = contextvars.ContextVar("trace_id", default="")
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[Sample]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, dict(zip(self.labelnames, key)), value) for key, value in items]
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Por combinación de etiquetas: [recuento por bucket..., +Inf], suma
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    def samples(self) -> List[Sample]:
+        samples = []
+        with self._lock:
+            items = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+        for key, counts, total in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append((f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative))
+            samples.append((f"{self.name}_count", labels, cumulative))
+            samples.append((f"{self.name}_sum", labels, total))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector: Callable[[], Iterable[Tuple[str, str, str, List[Sample]]]]):
+        """
+        Registra una función que devuelve métricas calculadas en el momento de la consulta,
+        como (nombre, tipo, ayuda, muestras). Se usa para exponer contadores que ya existen
+        en otros objetos (cachés, escritores de BigQuery...).
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        families = [(m.name, m.type, m.documentation, m.samples()) for m in self._metrics]
+        for collector in self._collectors:
+            try:
+                families.extend(collector())
+            except Exception as e:
+                logging.error(f"Error obteniendo métricas de {collector}: {e}")
+
+        # Varios collectors pueden aportar muestras a la misma familia (p. ej. distintas cachés)
+        merged = {}
+        for name, metric_type, documentation, samples in families:
+            merged.setdefault(name, (metric_type, documentation, []))[2].extend(samples)
+
+        lines = []
+        for name, (metric_type, documentation, samples) in merged.items():
+            lines.append(f"# HELP {name} {documentation}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for sample_name, labels, value in samples:
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "chatbot_stage_duration_seconds", "Duración de cada etapa del pipeline de preguntas", ["stage", "outcome"]
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "chatbot_request_duration_seconds", "Duración total de las peticiones a los endpoints de preguntas", ["endpoint"]
+))
+FIRST_BYTE_SECONDS = REGISTRY.register(Histogram(
+    "chatbot_request_first_byte_seconds", "Tiempo hasta el primer trozo de respuesta en los endpoints en streaming", ["endpoint"]
+))
+REQUESTS = REGISTRY.register(Counter(
+    "chatbot_requests_total", "Peticiones atendidas por endpoint, código de Dialogflow, idioma y escuela",
+    ["endpoint", "code", "language", "school"]
+))
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    Mide la duración de un bloque y la registra en chatbot_stage_duration_seconds.
+    """
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=stage, outcome=outcome)
+
+
+def cache_collector(*caches):
+    """
+    Devuelve un collector con los aciertos, fallos y tamaño de las cachés indicadas
+    (objetos con un método stats()).
+    """
+    def collect():
+        hits, misses, sizes = [], [], []
+        for cache in caches:
+            stats = cache.stats()
+            tiers = stats.items() if "memory" in stats else [("memory", stats)]
+            for tier, tier_stats in tiers:
+                labels = {"cache": tier_stats["name"], "tier": tier}
+                hits.append(("chatbot_cache_hits_total", labels, tier_stats["hits"]))
+                misses.append(("chatbot_cache_misses_total", labels, tier_stats["misses"]))
+                if tier_stats["size"] is not None:
+                    sizes.append(("chatbot_cache_entries", labels, tier_stats["size"]))
+        return [
+            ("chatbot_cache_hits_total", "counter", "Aciertos de caché", hits),
+            ("chatbot_cache_misses_total", "counter", "Fallos de caché", misses),
+            ("chatbot_cache_entries", "gauge", "Entradas en caché", sizes),
+        ]
+    return collect
+
+
+def render() -> str:
+    return REGISTRY.render()
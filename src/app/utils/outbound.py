@@ -0,0 +1,245 @@
+"""
+Capa común de las llamadas salientes: plazos por backend, cortocircuitos (circuit breakers),
+cliente HTTP asíncrono compartido y opciones de conexión de los clientes de Google.
+"""
+import functools
+import logging
+import os
+import threading
+import time
+
+from typing import Dict, Tuple, Type
+
+from utils.metrics import REGISTRY
+
+# Plazo máximo (segundos) de cada llamada a un backend, reintentos incluidos
+DEADLINES = {
+    "translate": float(os.getenv("DEADLINE_TRANSLATE", "5")),
+    "dialogflow": float(os.getenv("DEADLINE_DIALOGFLOW", "10")),
+    "speech": float(os.getenv("DEADLINE_SPEECH", "30")),
+    "bigquery": float(os.getenv("DEADLINE_BIGQUERY", "30")),
+    "http": float(os.getenv("DEADLINE_HTTP", "10")),
+}
+
+# Fallos seguidos que abren el circuito y segundos que permanece abierto antes de probar de nuevo
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+# Conexiones HTTP mantenidas abiertas hacia murciaeduca y hacia la API REST de Translate
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "16"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60"))
+
+# Keep-alive de los canales gRPC (Dialogflow y Speech) para no reabrir conexiones tras periodos sin tráfico
+GRPC_KEEPALIVE_TIME_MS = int(os.getenv("GRPC_KEEPALIVE_TIME_MS", "30000"))
+GRPC_CHANNEL_OPTIONS = [
+    ("grpc.keepalive_time_ms", GRPC_KEEPALIVE_TIME_MS),
+    ("grpc.keepalive_timeout_ms", 10000),
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.max_pings_without_data", 0),
+]
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class CircuitOpenError(Exception):
+    """
+    El backend ha fallado repetidamente y la llamada se rechaza sin intentarla.
+    """
+
+
+@functools.lru_cache(maxsize=None)
+def _transport_errors() -> Tuple[Type[BaseException], ...]:
+    errors = [ConnectionError, TimeoutError]
+    try:
+        import requests
+        errors += [requests.ConnectionError, requests.Timeout]
+    except ImportError:
+        pass
+    try:
+        import httpx
+        errors.append(httpx.TransportError)
+    except ImportError:
+        pass
+    try:
+        from google.api_core.exceptions import RetryError
+        from google.auth.exceptions import TransportError
+        errors += [RetryError, TransportError]
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+def is_backend_failure(exc: BaseException) -> bool:
+    """
+    Indica si un error es un fallo del backend (transporte, plazo agotado o respuesta 5xx) y no
+    de la petición (4xx como InvalidArgument o NotFound, o un error del propio código).
+    """
+    if isinstance(exc, CircuitOpenError):
+        return False
+    # Código HTTP de los errores de google-api-core (también los de gRPC) y de requests/httpx
+    status = getattr(exc, "code", None)
+    if not isinstance(status, int):
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status >= 500
+    return isinstance(exc, _transport_errors())
+
+
+class CircuitBreaker:
+    """
+    Cortocircuito por backend. Tras failure_threshold fallos seguidos se abre y rechaza las
+    llamadas con CircuitOpenError durante reset_timeout segundos; después deja pasar una
+    llamada de prueba (semiabierto) y se cierra si sale bien. Es seguro entre hilos.
+
+    Se usa como gestor de contexto: solo cuentan como fallo las excepciones del bloque que son
+    fallos del backend (is_backend_failure); un error de la petición no abre el circuito.
+
+    Args:
+        name (str): Nombre del backend, usado en métricas y logs.
+        failure_threshold (int): Fallos seguidos que abren el circuito.
+        reset_timeout (float): Segundos que el circuito permanece abierto.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == CLOSED or self.failure_threshold <= 0:
+                return True
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logging.info(f"Circuito '{self.name}' cerrado")
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failure_threshold <= 0:
+                return
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+                if self.state == CLOSED:
+                    logging.warning(f"Circuito '{self.name}' abierto tras {self.failures} fallos seguidos")
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+
+    def __enter__(self):
+        if not self.allow():
+            raise CircuitOpenError(f"Circuito '{self.name}' abierto: llamada rechazada")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.record_success()
+        elif issubclass(exc_type, CircuitOpenError):
+            pass
+        elif is_backend_failure(exc):
+            self.record_failure()
+        else:
+            # Error de la petición: el backend respondió
+            self.record_success()
+        return False
+
+
+breakers: Dict[str, CircuitBreaker] = {name: CircuitBreaker(name) for name in DEADLINES}
+
+
+def _breaker_metrics():
+    states = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+    return [
+        ("chatbot_circuit_state", "gauge", "Estado del cortocircuito (0 cerrado, 1 semiabierto, 2 abierto)",
+         [("chatbot_circuit_state", {"backend": name}, states[b.state]) for name, b in breakers.items()]),
+        ("chatbot_circuit_rejected_total", "counter", "Llamadas rechazadas con el circuito abierto",
+         [("chatbot_circuit_rejected_total", {"backend": name}, b.rejected) for name, b in breakers.items()]),
+    ]
+
+
+REGISTRY.register_collector(_breaker_metrics)
+
+
+def google_retry(backend: str):
+    """
+    Política de reintentos de las llamadas gRPC: solo errores transitorios y dentro del plazo del backend.
+    """
+    from google.api_core import retry
+
+    return retry.Retry(predicate=retry.if_transient_error, initial=0.1, maximum=1.0, multiplier=2.0,
+                       timeout=DEADLINES[backend])
+
+
+def keepalive_channel(transport_cls):
+    """
+    Inicializador de canal para un transporte gRPC de Google que añade las opciones de keep-alive.
+    """
+    def create_channel(host, options=(), **kwargs):
+        return transport_cls.create_channel(host, options=list(options) + GRPC_CHANNEL_OPTIONS, **kwargs)
+    return create_channel
+
+
+def authorized_session(scopes, backend: str):
+    """
+    Sesión HTTP autenticada para los clientes REST de Google con un pool de conexiones persistentes
+    y el plazo del backend como tiempo máximo de cada petición.
+    """
+    import google.auth
+    import requests
+    from google.auth.transport.requests import AuthorizedSession
+
+    class DeadlineSession(AuthorizedSession):
+        def request(self, method, url, data=None, headers=None, max_allowed_time=None, timeout=None, **kwargs):
+            deadline = DEADLINES[backend]
+            timeout = deadline if timeout is None else min(timeout, deadline)
+            return super().request(method, url, data=data, headers=headers, max_allowed_time=max_allowed_time,
+                                   timeout=timeout, **kwargs)
+
+    credentials, _ = google.auth.default(scopes=scopes)
+    session = DeadlineSession(credentials)
+    session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE))
+    return session
+
+
+_http_client = None
+
+
+def get_http_client():
+    """
+    Cliente HTTP asíncrono compartido (httpx) con conexiones persistentes y el plazo de "http".
+    """
+    global _http_client
+    if _http_client is None:
+        import httpx
+        _http_client = httpx.AsyncClient(
+            timeout=DEADLINES["http"],
+            limits=httpx.Limits(max_connections=HTTP_POOL_SIZE, max_keepalive_connections=HTTP_POOL_SIZE,
+                                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY),
+        )
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
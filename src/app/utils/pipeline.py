@@ -0,0 +1,154 @@
+"""
+Grafo de etapas asíncronas con dependencias declaradas. Cada etapa empieza en cuanto terminan
+las etapas de las que depende, de modo que las independientes se ejecutan a la vez, y al
+terminar se calcula el camino crítico: la cadena de etapas que ha marcado la latencia.
+"""
+import asyncio
+import logging
+import time
+
+from typing import Awaitable, Callable, Dict, Iterable, List, NamedTuple, Tuple
+
+from utils.metrics import REGISTRY, Histogram
+
+CRITICAL_PATH_SECONDS = REGISTRY.register(Histogram(
+    "chatbot_critical_path_seconds", "Tiempo de cada etapa dentro del camino crítico de la petición", ["endpoint", "stage"]
+))
+
+# Etapas en segundo plano en curso (se guardan para que no las recoja el recolector de basura)
+_background = set()
+
+
+class Stage(NamedTuple):
+    name: str
+    func: Callable[["GraphRun"], Awaitable[object]]
+    after: Tuple[str, ...]
+    background: bool
+
+
+class StageGraph:
+    """
+    Conjunto de etapas. Se registran con el decorador stage() en orden: las dependencias de
+    una etapa tienen que estar ya registradas, así que el grafo no puede tener ciclos.
+
+    Args:
+        name (str): Nombre del grafo, usado en métricas y logs.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stages: Dict[str, Stage] = {}
+
+    def stage(self, name: str = None, after: Iterable[str] = (), background: bool = False):
+        """
+        Registra una función async que recibe el GraphRun y devuelve el resultado de la etapa.
+        Las etapas en segundo plano no retrasan el final de run() (p. ej. registrar en BigQuery).
+        """
+        def register(func):
+            stage_name = name or func.__name__
+            for dependency in after:
+                if dependency not in self.stages:
+                    raise ValueError(f"La etapa '{stage_name}' depende de '{dependency}', que no está registrada")
+            self.stages[stage_name] = Stage(stage_name, func, tuple(after), background)
+            return func
+        return register
+
+    def _needed(self, targets: Iterable[str]) -> List[str]:
+        needed = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in needed:
+                needed.add(name)
+                pending.extend(self.stages[name].after)
+        return [name for name in self.stages if name in needed]
+
+    async def run(self, targets: Iterable[str] = None, **inputs) -> "GraphRun":
+        """
+        Ejecuta las etapas (solo las necesarias para `targets`, si se indica) con los valores de entrada dados.
+
+        Returns:
+            GraphRun: Resultados, tiempos y camino crítico. Si una etapa falla se cancelan las
+            demás y se relanza su excepción.
+        """
+        graph_run = GraphRun(self, inputs)
+        await graph_run.execute(self._needed(targets) if targets is not None else list(self.stages))
+        return graph_run
+
+
+class GraphRun:
+    """
+    Una ejecución del grafo. Las etapas leen con run["nombre"] el resultado de otra etapa
+    o un valor de entrada.
+    """
+
+    def __init__(self, graph: StageGraph, inputs: Dict[str, object]):
+        self.graph = graph
+        self.inputs = inputs
+        self.results: Dict[str, object] = {}
+        self.timings: Dict[str, Tuple[float, float]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def __getitem__(self, name: str):
+        if name in self.results:
+            return self.results[name]
+        return self.inputs[name]
+
+    async def _run_stage(self, stage: Stage):
+        if stage.after:
+            await asyncio.gather(*(self._tasks[dependency] for dependency in stage.after))
+        start = time.perf_counter()
+        try:
+            self.results[stage.name] = await stage.func(self)
+        finally:
+            self.timings[stage.name] = (start, time.perf_counter())
+        return self.results[stage.name]
+
+    async def execute(self, names: List[str]):
+        for name in names:
+            self._tasks[name] = asyncio.ensure_future(self._run_stage(self.graph.stages[name]))
+        foreground = [self._tasks[name] for name in names if not self.graph.stages[name].background]
+        try:
+            await asyncio.gather(*foreground)
+        except BaseException:
+            for task in self._tasks.values():
+                task.cancel()
+            raise
+
+        for name in names:
+            if self.graph.stages[name].background:
+                task = self._tasks[name]
+                _background.add(task)
+                task.add_done_callback(self._background_done)
+
+        endpoint = self.inputs.get("endpoint", self.graph.name)
+        for name, duration in self.critical_path():
+            CRITICAL_PATH_SECONDS.observe(duration, endpoint=endpoint, stage=name)
+
+    def _background_done(self, task: asyncio.Task):
+        _background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Error en una etapa en segundo plano de '{self.graph.name}': {task.exception()}")
+
+    def critical_path(self) -> List[Tuple[str, float]]:
+        """
+        Etapas del camino crítico, de la primera a la última, con su duración en segundos:
+        desde la última etapa en terminar se va hacia atrás por la dependencia que terminó más tarde.
+        """
+        finished = [name for name in self.timings if not self.graph.stages[name].background]
+        if not finished:
+            return []
+        name = max(finished, key=lambda stage_name: self.timings[stage_name][1])
+        path = []
+        while name is not None:
+            start, end = self.timings[name]
+            path.append((name, end - start))
+            dependencies = [dependency for dependency in self.graph.stages[name].after if dependency in self.timings]
+            name = max(dependencies, key=lambda dependency: self.timings[dependency][1]) if dependencies else None
+        return path[::-1]
+
+    def server_timing(self) -> str:
+        """
+        Camino crítico en el formato de la cabecera Server-Timing (milisegundos).
+        """
+        return ", ".join(f"{name};dur={duration * 1000:.1f}" for name, duration in self.critical_path())
@@ -0,0 +1,168 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from collections import Counter
+from typing import Dict, List, Tuple
+
+SCHOOLS_CONFIG = os.getenv("SCHOOLS_CONFIG", os.path.join(os.path.dirname(__file__), "schools.json"))
+SCHOOLS_RELOAD_INTERVAL = float(os.getenv("SCHOOLS_RELOAD_INTERVAL", "30"))
+
+# Valor de las escuelas que no están en la configuración en métricas y agregados
+OTHER_SCHOOL = "other"
+
+_TOKEN_RE = re.compile(r"\w+")
+_COMBINING_RE = re.compile("[\u0300-\u036f]")
+_TERMINAL = ""
+
+
+def normalize(text: str) -> str:
+    """
+    Pasa a minúsculas y elimina tildes y diéresis ("Águilas" -> "aguilas").
+    """
+    return _COMBINING_RE.sub("", unicodedata.normalize("NFD", text.lower()))
+
+
+class SchoolMatcher:
+    """
+    Detector de nombres de escuelas basado en un trie de palabras, insensible a tildes.
+
+    Admite nombres de varias palabras ("molina de segura"): en cada posición se toma la
+    coincidencia más larga, de forma que "puerto lumbreras" cuenta una vez y no también
+    como "lumbreras".
+
+    Args:
+        topics (dict): Escuela -> lista de palabras clave (peso 1) o dict palabra clave -> peso.
+    """
+
+    def __init__(self, topics: Dict[str, object]):
+        self.topics = topics
+        # Nombre normalizado -> nombre de la configuración, para known_school()
+        self.schools = {normalize(topic): topic for topic in topics}
+        self._trie = {}
+        for topic, keywords in topics.items():
+            if isinstance(keywords, list):
+                keywords = {keyword: 1 for keyword in keywords}
+            elif not isinstance(keywords, dict):
+                raise ValueError(f"Formato no soportado en el tópico '{topic}'")
+            for keyword, weight in keywords.items():
+                tokens = _TOKEN_RE.findall(normalize(keyword))
+                if not tokens:
+                    continue
+                node = self._trie
+                for token in tokens:
+                    node = node.setdefault(token, {})
+                entry = node.setdefault(_TERMINAL, (" ".join(tokens), {}))
+                entry[1][topic] = weight
+
+    def match(self, text: str) -> Tuple[Dict[str, int], Dict[str, int], List[str]]:
+        """
+        Devuelve (ocurrencias por palabra clave, puntuación por escuela, escuelas con la puntuación máxima).
+        """
+        tokens = _TOKEN_RE.findall(normalize(text))
+        conteo_palabras = Counter()
+        conteo_topicos = Counter()
+
+        root = self._trie
+        i, n = 0, len(tokens)
+        while i < n:
+            node = root.get(tokens[i])
+            if node is None:
+                i += 1
+                continue
+            found, end = node.get(_TERMINAL), i + 1
+            j = i + 1
+            while j < n:
+                node = node.get(tokens[j])
+                if node is None:
+                    break
+                j += 1
+                if _TERMINAL in node:
+                    found, end = node[_TERMINAL], j
+            if found is None:
+                i += 1
+                continue
+            keyword, weights = found
+            conteo_palabras[keyword] += 1
+            for topic, weight in weights.items():
+                conteo_topicos[topic] += weight
+            i = end
+
+        if not conteo_topicos:
+            return {}, {}, []
+
+        max_score = max(conteo_topicos.values())
+        top = [topic for topic, score in conteo_topicos.items() if score == max_score]
+        return dict(conteo_palabras), dict(conteo_topicos), top
+
+
+def load_matcher(path: str = SCHOOLS_CONFIG) -> SchoolMatcher:
+    with open(path, encoding="utf-8") as config_file:
+        return SchoolMatcher(json.load(config_file))
+
+
+class _ReloadingMatcher:
+    """
+    Mantiene el SchoolMatcher del fichero de configuración y lo reconstruye cuando el fichero cambia.
+    """
+
+    def __init__(self, path: str, interval: float):
+        self.path = path
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._mtime = os.path.getmtime(path)
+        self._checked = time.monotonic()
+        self._matcher = load_matcher(path)
+
+    def get(self) -> SchoolMatcher:
+        now = time.monotonic()
+        if self.interval > 0 and now - self._checked >= self.interval:
+            with self._lock:
+                if now - self._checked >= self.interval:
+                    self._checked = now
+                    self._reload_if_changed()
+        return self._matcher
+
+    def reload(self):
+        with self._lock:
+            self._mtime = os.path.getmtime(self.path)
+            self._matcher = load_matcher(self.path)
+
+    def _reload_if_changed(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime != self._mtime:
+                self._matcher = load_matcher(self.path)
+                self._mtime = mtime
+                logging.info(f"Configuración de escuelas recargada desde {self.path}")
+        except (OSError, ValueError) as e:
+            # Se mantiene el matcher anterior si el fichero nuevo no es válido
+            logging.error(f"No se pudo recargar la configuración de escuelas {self.path}: {e}")
+
+
+_matcher = _ReloadingMatcher(SCHOOLS_CONFIG, SCHOOLS_RELOAD_INTERVAL)
+
+
+def get_matcher() -> SchoolMatcher:
+    return _matcher.get()
+
+
+def reload_schools():
+    """
+    Fuerza la recarga del fichero de escuelas.
+    """
+    _matcher.reload()
+
+
+def known_school(school: str) -> str:
+    """
+    Nombre de la escuela en la configuración, sin importar mayúsculas ni tildes, u OTHER_SCHOOL.
+
+    La escuela llega del cliente: como etiqueta de métricas o clave de agregados hay que
+    acotarla a las conocidas para que no creen series sin límite.
+    """
+    return get_matcher().schools.get(normalize(school or ""), OTHER_SCHOOL)
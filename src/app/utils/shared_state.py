@@ -0,0 +1,235 @@
+"""
+Estado compartido entre los workers de la aplicación (cachés, contadores y buffer de BigQuery).
+
+Con STATE_BACKEND=memory (por defecto) cada proceso guarda su propio estado. Con
+STATE_BACKEND=redis se usa un servidor compatible con Redis (REDIS_URL) y todos los
+workers, y todas las instancias, comparten cachés, contadores y filas pendientes.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from collections import deque
+from typing import Dict, List, Optional
+
+from utils.cache import MISSING
+
+try:
+    import redis
+except ImportError:  # redis es opcional; solo hace falta con STATE_BACKEND=redis
+    redis = None
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Prefijo de las claves, para compartir un mismo servidor entre entornos
+STATE_PREFIX = os.getenv("STATE_PREFIX", "chatbot-eoi")
+
+
+class MemoryBackend:
+    """
+    Estado en memoria del proceso. Es seguro entre hilos.
+    """
+
+    shared = False
+
+    def __init__(self):
+        self._values: Dict[str, tuple] = {}
+        self._lists: Dict[str, deque] = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key: str):
+        entry = self._values.get(key)
+        if entry is not None and entry[1] and entry[1] <= time.monotonic():
+            del self._values[key]
+            return None
+        return entry
+
+    def get(self, key: str, default=MISSING):
+        with self._lock:
+            entry = self._live(key)
+            return default if entry is None else entry[0]
+
+    def set(self, key: str, value, ttl: float = None):
+        with self._lock:
+            self._values[key] = (value, time.monotonic() + ttl if ttl else 0)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._values.pop(key, None)
+            self._lists.pop(key, None)
+
+    def incr(self, key: str, amount: int = 1, ttl: float = None) -> int:
+        """
+        Suma amount al contador y devuelve el nuevo valor. ttl se aplica al crear el contador.
+        """
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                entry = (0, time.monotonic() + ttl if ttl else 0)
+            value = entry[0] + amount
+            self._values[key] = (value, entry[1])
+            return value
+
+    def push(self, key: str, items: List[str]) -> int:
+        with self._lock:
+            queue = self._lists.setdefault(key, deque())
+            queue.extend(items)
+            return len(queue)
+
+    def move_batch(self, source: str, destination: str, count: int) -> List[str]:
+        """
+        Pasa hasta count elementos del principio de la lista source al final de destination y los devuelve.
+        """
+        with self._lock:
+            queue = self._lists.get(source)
+            if not queue:
+                return []
+            items = [queue.popleft() for _ in range(min(count, len(queue)))]
+            self._lists.setdefault(destination, deque()).extend(items)
+            return items
+
+    def members(self, key: str) -> List[str]:
+        with self._lock:
+            return list(self._lists.get(key, ()))
+
+    def remove(self, key: str, item: str) -> int:
+        with self._lock:
+            queue = self._lists.get(key)
+            if not queue or item not in queue:
+                return 0
+            queue.remove(item)
+            return 1
+
+    def length(self, key: str) -> int:
+        with self._lock:
+            return len(self._lists.get(key, ()))
+
+
+class RedisBackend:
+    """
+    Estado en un servidor compatible con Redis. Los valores se guardan como JSON.
+
+    Args:
+        client: Cliente con la interfaz de redis.Redis (o FakeRedis de tests/fakes.py).
+        prefix (str): Prefijo de todas las claves.
+    """
+
+    shared = True
+
+    def __init__(self, client, prefix: str = STATE_PREFIX):
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}:{key}"
+
+    def get(self, key: str, default=MISSING):
+        value = self.client.get(self._key(key))
+        return default if value is None else json.loads(value)
+
+    def set(self, key: str, value, ttl: float = None):
+        self.client.set(self._key(key), json.dumps(value, ensure_ascii=False), px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, key: str):
+        self.client.delete(self._key(key))
+
+    def incr(self, key: str, amount: int = 1, ttl: float = None) -> int:
+        key = self._key(key)
+        pipe = self.client.pipeline()
+        pipe.incrby(key, amount)
+        if ttl:
+            # NX: el plazo se fija al crear el contador y no se alarga en cada incremento
+            pipe.pexpire(key, int(ttl * 1000), nx=True)
+        return int(pipe.execute()[0])
+
+    def push(self, key: str, items: List[str]) -> int:
+        return self.client.rpush(self._key(key), *items)
+
+    def move_batch(self, source: str, destination: str, count: int) -> List[str]:
+        # LMOVE (Redis >= 6.2) dentro de una transacción: cada elemento está siempre en una de las dos listas
+        pipe = self.client.pipeline()
+        for _ in range(count):
+            pipe.lmove(self._key(source), self._key(destination), "LEFT", "RIGHT")
+        return [item.decode() if isinstance(item, bytes) else item for item in pipe.execute() if item is not None]
+
+    def members(self, key: str) -> List[str]:
+        return [item.decode() if isinstance(item, bytes) else item for item in self.client.lrange(self._key(key), 0, -1)]
+
+    def remove(self, key: str, item: str) -> int:
+        return self.client.lrem(self._key(key), 1, item)
+
+    def length(self, key: str) -> int:
+        return self.client.llen(self._key(key))
+
+
+class SharedCache:
+    """
+    Nivel de caché sobre el estado compartido, con la misma interfaz que SQLiteCache.
+    """
+
+    tier = "shared"
+
+    def __init__(self, backend, ttl: float, name: str = "cache"):
+        self.backend = backend
+        self.ttl = ttl
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=MISSING):
+        value = self.backend.get(f"cache:{self.name}:{key}")
+        if value is MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl: float = None):
+        self.backend.set(f"cache:{self.name}:{key}", value, self.ttl if ttl is None else ttl)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "name": self.name,
+            "size": None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(kind: str = STATE_BACKEND, url: str = REDIS_URL):
+    if kind == "redis":
+        if redis is None:
+            raise RuntimeError("STATE_BACKEND=redis necesita el paquete 'redis' (pip install redis)")
+        return RedisBackend(redis.Redis.from_url(url))
+    if kind != "memory":
+        raise ValueError(f"STATE_BACKEND desconocido: '{kind}'")
+    return MemoryBackend()
+
+
+def get_backend():
+    """
+    Backend de estado del proceso, creado según STATE_BACKEND la primera vez que se pide.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+                logging.info(f"Estado compartido: {type(_backend).__name__}")
+    return _backend
+
+
+def set_backend(backend: Optional[object]):
+    """
+    Sustituye el backend (p. ej. por RedisBackend(FakeRedis()) en pruebas y benchmarks).
+    """
+    global _backend
+    _backend = backend
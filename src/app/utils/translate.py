@@ -1,22 +1,252 @@
-import re
+import os
 import html
-from google.cloud import translate_v2 as translate
-from collections import Counter, defaultdict
+from utils.batching import MicroBatcher, SingleFlight, singleflight_collector
+from utils.cache import build_cache, TTLCache, MISSING
+from utils.clients import lazy_client
+from utils.language_detection import detect_language_local, rank_languages
+from utils.metrics import REGISTRY, cache_collector
+from utils.outbound import authorized_session, breakers
+from utils.school_matcher import get_matcher
+
+
+def _create_translate_client():
+    from google.cloud import translate_v2 as translate
+    return translate.Client(_http=authorized_session(translate.Client.SCOPE, "translate"))
+
+
+translate_client = lazy_client("translate", _create_translate_client)
+
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "5000"))
+TRANSLATION_CACHE_TTL = float(os.getenv("TRANSLATION_CACHE_TTL", "86400"))
+TRANSLATION_CACHE_PATH = os.getenv("TRANSLATION_CACHE_PATH")
+# Entradas máximas del nivel en SQLite: en Cloud Run el sistema de ficheros ocupa memoria
+TRANSLATION_CACHE_DISK_SIZE = int(os.getenv("TRANSLATION_CACHE_DISK_SIZE", "100000"))
+
+translation_cache = build_cache("translation", TRANSLATION_CACHE_SIZE, TRANSLATION_CACHE_TTL, TRANSLATION_CACHE_PATH,
+                                TRANSLATION_CACHE_DISK_SIZE)
+
+LOCAL_DETECTION_THRESHOLD = float(os.getenv("LOCAL_DETECTION_THRESHOLD", "0.9"))
+DETECTION_CACHE_SIZE = int(os.getenv("DETECTION_CACHE_SIZE", "10000"))
+
+detection_cache = TTLCache(DETECTION_CACHE_SIZE, TRANSLATION_CACHE_TTL, name="detection")
+
+REGISTRY.register_collector(cache_collector(translation_cache, detection_cache))
+
+# Agrupación de traducciones concurrentes (de distintos usuarios) en una sola llamada a la API.
+# TRANSLATE_BATCH_WINDOW son los segundos que espera un lote a llenarse (0 = sin agrupar)
+TRANSLATE_BATCH_WINDOW = float(os.getenv("TRANSLATE_BATCH_WINDOW", "0"))
+TRANSLATE_BATCH_SIZE = int(os.getenv("TRANSLATE_BATCH_SIZE", "128"))
+
+
+def _translate_batch(group, texts):
+    target_language, source_language = group
+    with breakers["translate"]:
+        if source_language:
+            return translate_client.get().translate(texts, target_language=target_language, source_language=source_language)
+        return translate_client.get().translate(texts, target_language=target_language)
+
+
+translate_batcher = MicroBatcher(_translate_batch, TRANSLATE_BATCH_WINDOW, TRANSLATE_BATCH_SIZE, name="translate")
+
+
+def _batcher_metrics():
+    return [
+        ("chatbot_translate_batched_texts_total", "counter", "Textos enviados a Translate en lotes",
+         [("chatbot_translate_batched_texts_total", {}, translate_batcher.stats["items"])]),
+        ("chatbot_translate_batches_total", "counter", "Llamadas por lotes a Translate",
+         [("chatbot_translate_batches_total", {}, translate_batcher.stats["batches"])]),
+    ]
+
+
+REGISTRY.register_collector(_batcher_metrics)
+
+# Traducciones idénticas simultáneas comparten una sola llamada a la API
+SINGLE_FLIGHT_ENABLED = os.getenv("SINGLE_FLIGHT_ENABLED", "true").lower() in ("1", "true", "yes")
+
+translate_flight = SingleFlight("translate", enabled=SINGLE_FLIGHT_ENABLED)
+REGISTRY.register_collector(singleflight_collector(translate_flight))
+
+
+def normalize_text(text):
+    """
+    Normaliza los espacios de un texto para usarlo como clave de caché.
+    """
+    return " ".join(text.split())
+
+
+def _translation_key(text, target_language, source_language=None):
+    return f"{source_language or ''}:{target_language}:{normalize_text(text)}"
+
+
+def _translate_api(text, target_language, source_language=None):
+    """
+    Llamada a la API de Translate para un texto. Las llamadas simultáneas con el mismo texto e
+    idiomas se comparten y, si TRANSLATE_BATCH_WINDOW > 0, se agrupan con otras concurrentes.
+    """
+    key = _translation_key(text, target_language, source_language)
+    result, _ = translate_flight.do(key, _translate_uncoalesced, text, target_language, source_language)
+    return result
+
+
+def _translate_uncoalesced(text, target_language, source_language=None):
+    if TRANSLATE_BATCH_WINDOW > 0:
+        return translate_batcher.submit((target_language, source_language), text)
+    with breakers["translate"]:
+        if source_language:
+            return translate_client.get().translate(text, target_language=target_language, source_language=source_language)
+        return translate_client.get().translate(text, target_language=target_language)
+
+
+def _detect_language_cached(text):
+    """
+    Idioma del texto según la caché de detecciones o el detector local con confianza suficiente.
+    Devuelve MISSING si hace falta preguntar a la API.
+    """
+    key = normalize_text(text).lower()
+    cached = detection_cache.get(key)
+    if cached is not MISSING:
+        return cached
+
+    language, confidence = detect_language_local(text)
+    if confidence < LOCAL_DETECTION_THRESHOLD:
+        return MISSING
+    detection_cache.set(key, language)
+    return language
 
-translate_client = translate.Client()
 
 def detect_language(text):
-    result = translate_client.detect_language(text)
-    return result['language']
+    """
+    Detecta el idioma de un texto. Se usa primero el detector local y solo se llama a la API
+    de Translate si su confianza no llega a LOCAL_DETECTION_THRESHOLD. Las decisiones se cachean.
+    """
+    language = _detect_language_cached(text)
+    if language is MISSING:
+        with breakers["translate"]:
+            result = translate_client.get().detect_language(text)
+        language = result['language']
+        detection_cache.set(normalize_text(text).lower(), language)
+    return language
+
+
+def detect_and_translate(text, target_language='es'):
+    """
+    Detecta el idioma de un texto y lo traduce al idioma destino con, como mucho, una llamada a la API.
+
+    Si la caché o el detector local conocen el idioma, solo se traduce (y nada si ya está en el
+    idioma destino). Si no, se traduce sin indicar el origen y se usa el idioma que la API detecta.
+
+    Args:
+        text (str): Texto a traducir.
+        target_language (str): Idioma destino.
 
-def translate_text(text, target_language):
+    Returns:
+        tuple: (texto traducido, idioma origen detectado).
+    """
+    language = _detect_language_cached(text)
+    if language is not MISSING and language != 'und':
+        return translate_text(text, target_language, language), language
+
+    result = _translate_api(text, target_language)
+    language = result.get('detectedSourceLanguage') or 'und'
+    detection_cache.set(normalize_text(text).lower(), language)
+    translation_cache.set(_translation_key(text, target_language, language), result['translatedText'])
+    return result['translatedText'], language
+
+
+def translate_text(text, target_language, source_language=None):
+    """
+    Traduce un texto al idioma indicado usando la caché de traducciones.
+
+    Args:
+        text (str): Texto a traducir.
+        target_language (str): Idioma destino.
+        source_language (str, optional): Idioma origen si se conoce. Si coincide con el destino no se llama a la API.
+
+    Returns:
+        str: Texto traducido.
+    """
     if not text:
         return text
     if not target_language or target_language == 'und':
         target_language = 'es'
-    result = translate_client.translate(text, target_language=target_language)
+    if source_language == target_language:
+        return text
+
+    key = _translation_key(text, target_language, source_language)
+    cached = translation_cache.get(key)
+    if cached is not MISSING:
+        return cached
+
+    result = _translate_api(text, target_language, source_language)
+    translation_cache.set(key, result['translatedText'])
     return result['translatedText']
 
+def _translate_chunks(texts, target_language, source_language=None):
+    # Una llamada a la API por cada TRANSLATE_BATCH_SIZE textos
+    results = []
+    for start in range(0, len(texts), TRANSLATE_BATCH_SIZE):
+        results.extend(_translate_batch((target_language, source_language), texts[start:start + TRANSLATE_BATCH_SIZE]))
+    return results
+
+
+def translate_many(texts, target_language, source_language=None):
+    """
+    Traduce varios textos del mismo idioma origen usando la caché de traducciones. Los que no
+    están en la caché se traducen juntos, sin repetidos, en llamadas de hasta TRANSLATE_BATCH_SIZE textos.
+
+    Returns:
+        list: Textos traducidos, en el mismo orden.
+    """
+    if not target_language or target_language == 'und':
+        target_language = 'es'
+    if source_language == target_language:
+        return list(texts)
+
+    translated = {}
+    for text in texts:
+        if text and text not in translated:
+            translated[text] = translation_cache.get(_translation_key(text, target_language, source_language))
+    missing = [text for text, cached in translated.items() if cached is MISSING]
+    if missing:
+        for text, result in zip(missing, _translate_chunks(missing, target_language, source_language)):
+            translated[text] = result['translatedText']
+            translation_cache.set(_translation_key(text, target_language, source_language), result['translatedText'])
+    return [translated[text] if text else text for text in texts]
+
+
+def detect_and_translate_many(texts, target_language='es'):
+    """
+    detect_and_translate para varios textos: los de idioma conocido (caché o detector local) se
+    traducen agrupados por idioma con translate_many y el resto en lotes sin indicar el origen,
+    usando el idioma que detecta la API.
+
+    Returns:
+        list: (texto traducido, idioma origen detectado) de cada texto, en el mismo orden.
+    """
+    results = [None] * len(texts)
+    by_language = {}
+    unknown = []
+    for i, text in enumerate(texts):
+        language = _detect_language_cached(text)
+        if language is MISSING or language == 'und':
+            unknown.append(i)
+        else:
+            by_language.setdefault(language, []).append(i)
+
+    for language, indices in by_language.items():
+        translated = translate_many([texts[i] for i in indices], target_language, language)
+        for i, text_translated in zip(indices, translated):
+            results[i] = (text_translated, language)
+
+    if unknown:
+        for i, result in zip(unknown, _translate_chunks([texts[i] for i in unknown], target_language)):
+            language = result.get('detectedSourceLanguage') or 'und'
+            detection_cache.set(normalize_text(texts[i]).lower(), language)
+            translation_cache.set(_translation_key(texts[i], target_language, language), result['translatedText'])
+            results[i] = (result['translatedText'], language)
+    return results
+
+
 def unescape_html(text):
     """
     Decodes HTML entities in a string (e.g., &#39; to ').
@@ -32,7 +262,12 @@ def detect_language_ranking(text):
     Devuelve un ranking de posibles idiomas detectados para el texto, con su confianza.
     Prioriza español ('es'), luego italiano ('it'), luego el resto según confianza.
     """
-    result = translate_client.detect_language([text])
+    ranking = rank_languages(text)
+    if ranking and ranking[0]['confidence'] >= LOCAL_DETECTION_THRESHOLD:
+        result = [ranking]
+    else:
+        with breakers["translate"]:
+            result = translate_client.get().detect_language([text])
     if result and isinstance(result, list) and len(result) > 0:
         detections = result[0]
         es = [d for d in detections if d.get('language') == 'es']
@@ -51,73 +286,7 @@ def detectar_aparicion_escuela( texto: str ):
     """
     Devuelve un ranking de ocurrencias de nombres de eois y extensiones
     """
-    texto = texto.lower()
-    mapa_topico_palabras = {
-        "caravaca de la cruz": ["caravaca"],
-        "cartagena": ["cartagena"],
-        "fuente álamo": ["álamo", "alamo"],
-        "mazarrón": ["mazarrón", "mazarron"],
-        "águilas": ["águilas", "aguilas"],
-        "totana": ["totana"],
-        "alhama": ["alhama"],
-        "puerto lumbreras": ["lumbreras"],
-        "archena": ["archena"],
-        "cieza": ["cieza"],
-        "yecla": ["yecla"],
-        "jumilla": ["jumilla"],
-        "murcia": ["murcia"],
-        "alcantarilla": ["alcantarilla"],
-        "infante": ["infante"],
-        "santomera": ["santomera"],
-        "san javier": ["javier"],
-        "lorca": ["lorca"],
-        "molina de segura": ["segura", "molina"],
-        "torre pacheco": ["pacheco"],
-    }
-
-    palabra_a_topicos = defaultdict(dict)
-
-    for topico, palabras in mapa_topico_palabras.items():
-
-        # Caso: lista de palabras (peso = 1)
-        if isinstance(palabras, list):
-            for palabra in palabras:
-                palabra_a_topicos[palabra.lower()][topico] = 1
-
-        # Caso: dict palabra -> peso
-        elif isinstance(palabras, dict):
-            for palabra, peso in palabras.items():
-                palabra_a_topicos[palabra.lower()][topico] = peso
-
-        else:
-            raise ValueError(
-                f"Formato no soportado en el tópico '{topico}'"
-            )
-
-    tokens = re.findall(r'\b\w+\b', texto)
-
-    conteo_palabras = Counter()
-    conteo_topicos = Counter()
-
-    for token in tokens:
-        if token not in palabra_a_topicos:
-            continue
-
-        conteo_palabras[token] += 1
-
-        for topico, peso in palabra_a_topicos[token].items():
-            conteo_topicos[topico] += peso
-
-    if not conteo_topicos:
-        return {}, {}, []
-
-    max_score = max(conteo_topicos.values())
-    topicos_top = [
-        topico for topico, score in conteo_topicos.items()
-        if score == max_score
-    ]
-
-    return dict(conteo_palabras), dict(conteo_topicos), topicos_top
+    return get_matcher().match(texto)
 
 
 def detectar_escuela( texto: str ):
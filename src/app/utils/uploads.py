@@ -0,0 +1,72 @@
+"""
+Límite de tamaño de las subidas de audio, aplicado mientras llega el cuerpo de la petición.
+"""
+import os
+
+from starlette.exceptions import HTTPException
+from starlette.formparsers import MultiPartParser
+from starlette.responses import JSONResponse
+
+from utils.admission import REJECTED
+
+# Tamaño máximo del cuerpo de las peticiones de voz (0 sin límite). recognize síncrono admite 10 MB
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+# Bytes de cada fichero subido que se guardan en memoria; a partir de ahí pasa a un fichero temporal
+UPLOAD_SPOOL_SIZE = int(os.getenv("UPLOAD_SPOOL_SIZE", str(1024 * 1024)))
+
+MultiPartParser.spool_max_size = UPLOAD_SPOOL_SIZE
+
+
+class UploadTooLargeError(HTTPException):
+    """
+    El cuerpo de la petición supera MAX_UPLOAD_BYTES. Es una HTTPException para que FastAPI
+    responda 413 aunque salte mientras lee el formulario.
+    """
+
+    def __init__(self, max_bytes: int):
+        super().__init__(status_code=413, detail=f"El audio supera el tamaño máximo de {max_bytes} bytes")
+
+
+class UploadLimitMiddleware:
+    """
+    Middleware ASGI que rechaza con 413 las peticiones a `paths` cuyo cuerpo supera max_bytes:
+    de inmediato si Content-Length ya lo indica y, si no, en cuanto se recibe el byte que lo supera,
+    sin esperar al resto de la subida.
+
+    Args:
+        paths: Rutas a las que se aplica el límite.
+        max_bytes (int): Tamaño máximo del cuerpo. 0 desactiva el límite.
+    """
+
+    def __init__(self, app, paths, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.max_bytes <= 0 or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > self.max_bytes:
+            REJECTED.inc(endpoint=scope["path"], reason="upload_size")
+            error = UploadTooLargeError(self.max_bytes)
+            response = JSONResponse({"detail": error.detail}, status_code=413, headers={"Connection": "close"})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    REJECTED.inc(endpoint=scope["path"], reason="upload_size")
+                    raise UploadTooLargeError(self.max_bytes)
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -0,0 +1,42 @@
+"""
+Configuración común de las pruebas: la aplicación se importa desde src/app con los clientes
+simulados de fakes.py, sin credenciales de Google.
+
+Uso (desde la raíz del repositorio):
+    python -m pytest -q
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src", "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Los módulos de la aplicación leen su configuración del entorno al importarse
+os.environ.setdefault("BQ_SPILL_DIR", tempfile.mkdtemp(prefix="chatbot-eoi-tests-"))
+os.environ.setdefault("LOG_ASYNC", "false")
+os.environ.setdefault("LOG_FORMAT", "text")
+
+import pytest  # noqa: E402
+
+from fakes import install_fakes  # noqa: E402
+
+FAKES = install_fakes()
+
+
+@pytest.fixture
+def fakes():
+    """
+    Los clientes simulados instalados en la aplicación, para inspeccionar sus llamadas.
+    """
+    return FAKES
+
+
+@pytest.fixture
+def client():
+    from fastapi.testclient import TestClient
+    from main import app
+
+    with TestClient(app) as test_client:
+        yield test_client
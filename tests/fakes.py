@@ -0,0 +1,408 @@
+"""
+Implementaciones locales de los clientes de Google para pruebas y benchmarks sin credenciales.
+
+Cada cliente acepta un Latency opcional para simular la latencia y los errores del servicio real.
+install_fakes() los registra en utils.clients para que la aplicación los use en lugar de los
+clientes de Google y se pueda ejecutar sin credenciales.
+"""
+import random
+import threading
+import time
+import uuid
+
+from types import SimpleNamespace
+from typing import Dict
+
+
+class FakeBackendError(ConnectionError):
+    """
+    Error simulado de un servicio de Google.
+    """
+
+
+class Latency:
+    """
+    Distribución de latencia y errores de un servicio simulado.
+
+    La latencia sigue una log-normal con la mediana indicada (sigma=0 la hace constante),
+    que reproduce bien la cola larga de las APIs remotas.
+
+    Args:
+        median (float): Latencia mediana en segundos.
+        sigma (float): Dispersión de la log-normal.
+        error_rate (float): Probabilidad de que una llamada lance FakeBackendError.
+        seed (int, optional): Semilla para reproducir una ejecución.
+    """
+
+    def __init__(self, median: float = 0.0, sigma: float = 0.0, error_rate: float = 0.0, seed: int = None):
+        self.median = median
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, spec: str) -> "Latency":
+        """
+        Construye la distribución a partir de "mediana[:sigma[:error_rate]]", p. ej. "0.08:0.5:0.01".
+        """
+        values = [float(value) for value in spec.split(":")] if spec else []
+        return cls(*values[:3])
+
+    def sample(self) -> float:
+        with self._lock:
+            if self.median <= 0:
+                return 0.0
+            return self.median * self._random.lognormvariate(0, self.sigma) if self.sigma else self.median
+
+    def apply(self, name: str = "servicio"):
+        """
+        Espera la latencia simulada y lanza FakeBackendError con probabilidad error_rate.
+        """
+        delay = self.sample()
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            failed = self.error_rate and self._random.random() < self.error_rate
+        if failed:
+            raise FakeBackendError(f"Fallo simulado de {name}")
+
+
+NO_LATENCY = Latency()
+
+
+class FakeBigQueryClient:
+    """
+    Sustituto de bigquery.Client que guarda en memoria las filas recibidas por insert_rows_json.
+
+    Args:
+        fail_times (int): Número de llamadas iniciales que lanzarán una excepción (para probar reintentos).
+        reject_indexes (set): Índices de fila que se devolverán como errores en cada llamada.
+    """
+
+    def __init__(self, fail_times: int = 0, reject_indexes=None, latency: Latency = NO_LATENCY):
+        self.fail_times = fail_times
+        self.latency = latency
+        self.reject_indexes = set(reject_indexes or ())
+        self.tables = {}
+        self.queries = []
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def insert_rows_json(self, table, json_rows, row_ids=None, **kwargs):
+        self.latency.apply("BigQuery")
+        with self._lock:
+            self.calls += 1
+            if self.fail_times > 0:
+                self.fail_times -= 1
+                raise FakeBackendError("Fallo simulado de BigQuery")
+            errors = []
+            rows = self.tables.setdefault(str(table), [])
+            for index, row in enumerate(json_rows):
+                if index in self.reject_indexes:
+                    errors.append({"index": index, "errors": [{"reason": "invalid", "message": "Fila rechazada"}]})
+                else:
+                    rows.append(dict(row))
+            return errors
+
+    def rows(self, table):
+        with self._lock:
+            return list(self.tables.get(str(table), []))
+
+    def query(self, query, job_config=None, **kwargs):
+        self.latency.apply("BigQuery")
+        with self._lock:
+            self.queries.append(query)
+        return SimpleNamespace(result=lambda *args, **kwargs: [])
+
+    def create_table(self, table, exists_ok=False, **kwargs):
+        return table
+
+
+class FakeSpeechClient:
+    """
+    Sustituto de speech.SpeechClient. Devuelve siempre la misma transcripción y registra
+    el tamaño de los trozos de audio recibidos en streaming.
+
+    Args:
+        transcript (str): Texto devuelto como transcripción.
+        language_code (str): Idioma detectado devuelto en los resultados.
+        latency (Latency, optional): Latencia y errores simulados por llamada.
+    """
+
+    def __init__(self, transcript: str = "¿Cuándo son los exámenes?", language_code: str = "es-es",
+                 latency: Latency = NO_LATENCY):
+        self.transcript = transcript
+        self.latency = latency
+        self.language_code = language_code
+        self.chunk_sizes = []
+        self.audio_bytes = 0
+
+    def _response(self):
+        alternative = SimpleNamespace(transcript=self.transcript, confidence=0.9)
+        result = SimpleNamespace(alternatives=[alternative], language_code=self.language_code, is_final=True)
+        return SimpleNamespace(results=[result])
+
+    def recognize(self, config=None, audio=None, **kwargs):
+        self.latency.apply("Speech")
+        self.audio_bytes += len(audio.content) if audio is not None else 0
+        return self._response()
+
+    def streaming_recognize(self, config=None, requests=None, **kwargs):
+        for request in requests:
+            self.chunk_sizes.append(len(request.audio_content))
+            self.audio_bytes += len(request.audio_content)
+        self.latency.apply("Speech")
+        yield self._response()
+
+
+class FakeSessionsClient:
+    """
+    Sustituto de dialogflowcx.SessionsClient. Responde con la primera respuesta de answers cuya
+    palabra clave aparece en la pregunta y con "NOT FOUND" si no hay ninguna.
+
+    Args:
+        answers (dict, optional): Palabra clave (en minúsculas) -> respuesta.
+        not_found_rate (float): Probabilidad de responder "NOT FOUND" aunque haya coincidencia.
+        latency (Latency, optional): Latencia y errores simulados por llamada.
+    """
+
+    DEFAULT_ANSWERS = {
+        "examen": "Los exámenes de certificación son en junio y septiembre.",
+        "matr": "La matrícula se hace en la secretaría virtual de la escuela.",
+        "grupo": "Puedes pedir el cambio de grupo desde la secretaría virtual.",
+        "horario": "La secretaría abre de lunes a viernes de 9:00 a 14:00.",
+    }
+
+    def __init__(self, answers: Dict[str, str] = None, not_found_rate: float = 0.0,
+                 latency: Latency = NO_LATENCY, seed: int = None):
+        self.answers = dict(self.DEFAULT_ANSWERS if answers is None else answers)
+        self.not_found_rate = not_found_rate
+        self.latency = latency
+        self.requests = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def session_path(project, location, agent, session):
+        return f"projects/{project}/locations/{location}/agents/{agent}/sessions/{session}"
+
+    def detect_intent(self, request=None, **kwargs):
+        self.latency.apply("Dialogflow")
+        text = request.query_input.text.text
+        with self._lock:
+            self.requests.append(request)
+            not_found = self.not_found_rate and self._random.random() < self.not_found_rate
+        message, intent = "NOT FOUND", "Default Fallback Intent"
+        if not not_found:
+            for keyword, answer in self.answers.items():
+                if keyword in text.lower():
+                    message, intent = answer, keyword
+                    break
+        query_result = SimpleNamespace(
+            response_messages=[SimpleNamespace(text=SimpleNamespace(text=[message]))],
+            match=SimpleNamespace(intent=SimpleNamespace(display_name=intent)),
+        )
+        return SimpleNamespace(response_id=str(uuid.uuid4()), query_result=query_result)
+
+
+class FakeTranslateClient:
+    """
+    Sustituto de translate_v2.Client. La "traducción" antepone el idioma destino al texto
+    ("[en] ...") y la detección usa el detector local de utils.language_detection.
+
+    Args:
+        latency (Latency, optional): Latencia y errores simulados por llamada.
+    """
+
+    def __init__(self, latency: Latency = NO_LATENCY):
+        self.latency = latency
+        self.calls = {"translate": 0, "detect_language": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, method: str):
+        with self._lock:
+            self.calls[method] += 1
+
+    @staticmethod
+    def _detect(text: str) -> Dict[str, object]:
+        from utils.language_detection import detect_language_local
+        language, confidence = detect_language_local(text)
+        return {"language": language, "confidence": confidence, "input": text}
+
+    def detect_language(self, values):
+        self.latency.apply("Translate")
+        self._count("detect_language")
+        if isinstance(values, str):
+            return self._detect(values)
+        return [[self._detect(value)] for value in values]
+
+    def translate(self, values, target_language=None, source_language=None, **kwargs):
+        self.latency.apply("Translate")
+        self._count("translate")
+
+        def translate_one(text):
+            source = source_language or self._detect(text)["language"]
+            result = {"input": text, "translatedText": text if source == target_language else f"[{target_language}] {text}"}
+            if not source_language:
+                result["detectedSourceLanguage"] = source
+            return result
+
+        if isinstance(values, str):
+            return translate_one(values)
+        return [translate_one(value) for value in values]
+
+
+class FakeRedis:
+    """
+    Servidor Redis en memoria con los comandos que usa utils.shared_state.RedisBackend.
+    Solo comparte estado dentro del proceso: sirve para probar el backend sin un servidor real.
+    """
+
+    def __init__(self, latency: Latency = NO_LATENCY):
+        self.latency = latency
+        self.calls = 0
+        self._values = {}
+        self._expires = {}
+        self._lock = threading.RLock()
+
+    def _expire(self, key):
+        expires = self._expires.get(key)
+        if expires is not None and expires <= time.monotonic():
+            self._values.pop(key, None)
+            del self._expires[key]
+
+    def _call(self):
+        self.latency.apply("redis")
+        with self._lock:
+            self.calls += 1
+
+    def get(self, key):
+        self._call()
+        with self._lock:
+            self._expire(key)
+            value = self._values.get(key)
+            return value.encode() if isinstance(value, str) else value
+
+    def set(self, key, value, px=None):
+        self._call()
+        with self._lock:
+            self._values[key] = value
+            self._expires.pop(key, None)
+            if px:
+                self._expires[key] = time.monotonic() + px / 1000
+        return True
+
+    def delete(self, *keys):
+        self._call()
+        with self._lock:
+            return sum(self._values.pop(key, None) is not None for key in keys)
+
+    def incrby(self, key, amount=1):
+        self._call()
+        with self._lock:
+            self._expire(key)
+            value = int(self._values.get(key, 0)) + amount
+            self._values[key] = str(value)
+            return value
+
+    def pexpire(self, key, milliseconds, nx=False):
+        self._call()
+        with self._lock:
+            if key not in self._values or (nx and key in self._expires):
+                return False
+            self._expires[key] = time.monotonic() + milliseconds / 1000
+            return True
+
+    def rpush(self, key, *items):
+        self._call()
+        with self._lock:
+            values = self._values.setdefault(key, [])
+            values.extend(items)
+            return len(values)
+
+    def lpop(self, key, count=None):
+        self._call()
+        with self._lock:
+            values = self._values.get(key)
+            if not values:
+                return None
+            popped, self._values[key] = values[:count or 1], values[count or 1:]
+            popped = [item.encode() for item in popped]
+            return popped if count else popped[0]
+
+    def llen(self, key):
+        self._call()
+        with self._lock:
+            return len(self._values.get(key, []))
+
+    def lmove(self, source, destination, where_from="LEFT", where_to="RIGHT"):
+        self._call()
+        with self._lock:
+            values = self._values.get(source)
+            if not values:
+                return None
+            item = values.pop(0 if where_from == "LEFT" else -1)
+            target = self._values.setdefault(destination, [])
+            target.insert(0 if where_to == "LEFT" else len(target), item)
+            return item.encode()
+
+    def lrange(self, key, start, end):
+        self._call()
+        with self._lock:
+            values = self._values.get(key, [])
+            return [item.encode() for item in values[start:None if end == -1 else end + 1]]
+
+    def lrem(self, key, count, item):
+        self._call()
+        with self._lock:
+            values = self._values.get(key, [])
+            if item in values:
+                values.remove(item)
+                return 1
+            return 0
+
+    def pipeline(self):
+        return _FakePipeline(self)
+
+
+class _FakePipeline:
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((getattr(self.redis, name), args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self.redis._lock:
+            return [command(*args, **kwargs) for command, args, kwargs in self.commands]
+
+
+def install_fakes(latency: Dict[str, Latency] = None, **clients):
+    """
+    Hace que la aplicación use los clientes simulados en lugar de los de Google. Puede llamarse
+    antes o después de importar los módulos de la aplicación.
+
+    Args:
+        latency (dict, optional): Latencia por servicio ("dialogflow", "translate", "speech", "bigquery").
+        **clients: Instancias ya creadas que se quieran usar (mismas claves que latency).
+
+    Returns:
+        SimpleNamespace: Los clientes simulados instalados, para inspeccionar sus llamadas.
+    """
+    from utils.clients import override
+
+    latency = latency or {}
+    fakes = SimpleNamespace(
+        dialogflow=clients.get("dialogflow") or FakeSessionsClient(latency=latency.get("dialogflow", NO_LATENCY)),
+        translate=clients.get("translate") or FakeTranslateClient(latency=latency.get("translate", NO_LATENCY)),
+        speech=clients.get("speech") or FakeSpeechClient(latency=latency.get("speech", NO_LATENCY)),
+        bigquery=clients.get("bigquery") or FakeBigQueryClient(latency=latency.get("bigquery", NO_LATENCY)),
+    )
+    for name, client in vars(fakes).items():
+        override(name, client)
+    return fakes
@@ -0,0 +1,44 @@
+import asyncio
+
+from fakes import FakeBackendError
+from utils import admission
+from utils.admission import RateLimiter
+from utils.shared_state import MemoryBackend
+
+
+class _FailingBackend(MemoryBackend):
+    shared = True
+
+    def incr(self, key, amount=1, ttl=None):
+        raise FakeBackendError("Redis caído")
+
+
+def test_full_limiter_forgets_the_least_recently_used_key():
+    limiter = RateLimiter("pruebas", rate=1, burst=1, max_keys=3)
+    for key in ("a", "b", "c"):
+        assert limiter.allow(key)
+    assert not limiter.allow("a")
+
+    assert limiter.allow("d")
+    assert len(limiter) == 3
+    # "b" era la menos reciente: se olvidó y vuelve con el cubo lleno; "a" sigue limitada
+    assert limiter.allow("b")
+    assert not limiter.allow("a")
+
+
+def test_shared_limiter_fails_open_and_counts_the_error():
+    limiter = RateLimiter("pruebas", rate=1, burst=1, backend=_FailingBackend())
+    before = admission.STATE_ERRORS.value(limiter="pruebas")
+
+    assert asyncio.run(limiter.allow_async("1.2.3.4"))
+    assert admission.STATE_ERRORS.value(limiter="pruebas") == before + 1
+
+
+def test_requests_without_session_id_are_limited_by_ip(monkeypatch, client):
+    monkeypatch.setattr(admission, "anonymous_limiter", RateLimiter("anonymous", rate=0.001, burst=1))
+
+    assert client.post("/ask/text", data={"message": "Hola"}).status_code == 200
+    response = client.post("/ask/text", data={"message": "Hola"})
+    assert response.status_code == 429
+    assert "Retry-After" in response.headers
+    assert client.post("/ask/text", data={"message": "Hola", "session_id": "sesion-1"}).status_code == 200
@@ -0,0 +1,19 @@
+import json
+
+import pytest
+
+from services import big_query
+
+
+def test_batch_queues_the_rows_for_the_background_writer(monkeypatch, client):
+    writer = big_query.get_interaction_writer()
+    monkeypatch.setattr(writer, "write_now", lambda rows: pytest.fail("/ask/batch no debe escribir en la petición"))
+    submitted = writer.stats["submitted"]
+
+    response = client.post("/ask/batch", json={"questions": [{"message": "¿Cuándo es el examen?"},
+                                                             {"message": "¿Dónde está la secretaría?"},
+                                                             {"message": "¿Cuándo es el examen?"}]})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+
+    assert lines[-1]["done"] and lines[-1]["recorded"] == 2
+    assert writer.stats["submitted"] == submitted + 2
@@ -0,0 +1,140 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+
+from fakes import FakeBigQueryClient, FakeRedis
+from services.bq_writer import BatchWriter, SharedBatchWriter
+from utils.shared_state import RedisBackend
+
+
+def _writer(tmp_path, client, **kwargs):
+    kwargs.setdefault("backoff_base", 0)
+    return BatchWriter(client, "tabla", "pruebas", spill_path=str(tmp_path / "chatbot-eoi-pruebas.jsonl"), **kwargs)
+
+
+def _spill_line(row_id, row):
+    return json.dumps({"row_id": row_id, "row": row}) + "\n"
+
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", ""])
+    process.wait()
+    return process.pid
+
+
+def test_retries_and_writes(tmp_path):
+    client = FakeBigQueryClient(fail_times=2)
+    writer = _writer(tmp_path, client)
+    writer.submit({"n": 1})
+    assert writer.flush(5)
+    writer.close()
+
+    assert client.rows("tabla") == [{"n": 1}]
+    assert writer.stats["written"] == 1
+    assert writer.stats["retried"] == 2
+
+
+def test_exhausted_retries_spill_to_own_file_and_replay(tmp_path):
+    client = FakeBigQueryClient(fail_times=100)
+    writer = _writer(tmp_path, client, max_retries=1)
+    writer.submit({"n": 1})
+    writer.flush(5)
+    writer.close()
+
+    assert writer.spill_path.endswith(f"-{os.getpid()}.jsonl")
+    assert writer.stats["spilled"] == 1
+    assert os.path.exists(writer.spill_path)
+
+    client.fail_times = 0
+    replayer = _writer(tmp_path, client)
+    replayer.start()
+    replayer.flush(5)
+    replayer.close()
+
+    assert client.rows("tabla") == [{"n": 1}]
+    assert os.listdir(tmp_path) == []
+
+
+def test_replays_orphans_and_sets_aside_bad_lines(tmp_path):
+    dead = _dead_pid()
+    (tmp_path / f"chatbot-eoi-pruebas-{dead}.jsonl").write_text(_spill_line("a", {"n": 1}) + "{roto\n")
+    (tmp_path / f"chatbot-eoi-pruebas-{dead}.jsonl.0badc0de.replay").write_text(_spill_line("b", {"n": 2}))
+    # El fichero de un proceso vivo es suyo: no se toca
+    live = tmp_path / "chatbot-eoi-pruebas-1.jsonl"
+    live.write_text(_spill_line("c", {"n": 3}))
+
+    client = FakeBigQueryClient()
+    writer = _writer(tmp_path, client)
+    writer.start()
+    writer.flush(5)
+    writer.close()
+
+    assert sorted(row["n"] for row in client.rows("tabla")) == [1, 2]
+    remaining = sorted(os.listdir(tmp_path))
+    assert live.name in remaining
+    assert len([name for name in remaining if name.endswith(".bad")]) == 1
+    assert len(remaining) == 2
+
+
+def test_unreadable_spill_does_not_stop_the_writer(tmp_path):
+    # Un directorio con el nombre de un fichero de volcado hace fallar la lectura
+    (tmp_path / f"chatbot-eoi-pruebas-{_dead_pid()}.jsonl").mkdir()
+
+    client = FakeBigQueryClient()
+    writer = _writer(tmp_path, client)
+    writer.submit({"n": 1})
+    assert writer.flush(5)
+    writer.close()
+
+    assert client.rows("tabla") == [{"n": 1}]
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".bad")]
+
+
+def test_invalid_rows_are_dropped_not_spilled(tmp_path):
+    client = FakeBigQueryClient(reject_indexes={1})
+    writer = _writer(tmp_path, client)
+    for n in range(3):
+        writer.submit({"n": n})
+    writer.flush(5)
+    writer.close()
+
+    assert [row["n"] for row in client.rows("tabla")] == [0, 2]
+    assert writer.stats["dropped"] == 1
+    assert writer.stats["spilled"] == 0
+    assert client.calls == 1
+
+
+class _PushThreadsRedis(FakeRedis):
+    """
+    Apunta qué hilos han llamado a RPUSH.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.push_threads = set()
+
+    def rpush(self, key, *items):
+        self.push_threads.add(threading.current_thread())
+        return super().rpush(key, *items)
+
+
+def test_shared_writer_submit_does_not_call_redis_and_skips_empty_polls(tmp_path):
+    client = FakeBigQueryClient()
+    redis = _PushThreadsRedis()
+    writer = SharedBatchWriter(client, "tabla", "pruebas", backend=RedisBackend(redis), flush_interval=60,
+                               spill_path=str(tmp_path / "chatbot-eoi-pruebas.jsonl"))
+    for n in range(3):
+        assert writer.submit({"n": n})
+    # El hilo del escritor puede haberlas pasado ya a Redis, pero no el que llama a submit
+    assert threading.current_thread() not in redis.push_threads
+
+    assert writer.flush()
+    assert sorted(row["n"] for row in client.rows("tabla")) == [0, 1, 2]
+
+    calls = redis.calls
+    writer.flush()
+    # Concesión, lista de workers y LLEN: sin los LMOVE de un lote vacío
+    assert redis.calls - calls < writer.batch_size
+    writer.close()
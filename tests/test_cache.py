@@ -0,0 +1,37 @@
+import time
+
+from utils.cache import MISSING, SQLiteCache, disk_caches, purge_disk_caches
+
+
+def test_sqlite_cache_keeps_at_most_max_rows(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), ttl=0, max_rows=100)
+    for n in range(250):
+        cache.set(f"k{n}", n)
+
+    assert cache.stats()["size"] <= 101
+    assert cache.get("k249") == 249
+    assert cache.get("k0") is MISSING
+    assert cache.evictions >= 149
+
+
+def test_sqlite_cache_trims_an_existing_file_on_open(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    unbounded = SQLiteCache(path, ttl=0)
+    for n in range(50):
+        unbounded.set(f"k{n}", n)
+
+    bounded = SQLiteCache(path, ttl=0, max_rows=10)
+    assert bounded.stats()["size"] == 10
+    assert bounded.get("k49") == 49
+
+
+def test_purge_removes_expired_entries(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), ttl=0)
+    cache.set("caduca", 1, ttl=0.01)
+    cache.set("queda", 2)
+    time.sleep(0.02)
+
+    assert cache in disk_caches()
+    purge_disk_caches()
+    assert cache.stats()["size"] == 1
+    assert cache.get("queda") == 2
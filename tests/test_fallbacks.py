@@ -0,0 +1,13 @@
+import json
+
+from services.fallbacks import FallbackCatalog
+
+
+def test_missing_languages_reads_the_catalog_file(tmp_path):
+    path = tmp_path / "fallbacks.json"
+    catalog = FallbackCatalog(["No lo sé"], str(path), refresh_interval=0)
+    assert catalog.missing_languages(["en", "fr"]) == ["en", "fr"]
+
+    path.write_text(json.dumps({"source": ["No lo sé"], "translations": {"en": ["I don't know"]}}), encoding="utf-8")
+    assert catalog.missing_languages(["en", "fr"]) == ["fr"]
+    assert catalog.get(0, "en-US") == "I don't know"
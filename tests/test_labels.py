@@ -0,0 +1,17 @@
+from utils.language_detection import known_language
+from utils.school_matcher import get_matcher, known_school
+
+
+def test_known_school_maps_to_the_configured_name_or_other():
+    school = next(iter(get_matcher().topics))
+
+    assert known_school(school.upper()) == school
+    assert known_school("escuela inventada 123") == "other"
+    assert known_school(None) == "other"
+
+
+def test_known_language_keeps_supported_codes_only():
+    assert known_language("en-US") == "en"
+    assert known_language("ES") == "es"
+    assert known_language("xx") == "other"
+    assert known_language("") == "other"
@@ -0,0 +1,40 @@
+from services.bq_writer import InteractionRecord, RatingEvent
+from services.rollups import InteractionRollup, summarize
+from utils.school_matcher import get_matcher
+
+
+def _interaction(interaction_id, school, language="es", code="OK"):
+    return InteractionRecord(session_id="s", interaction_id=interaction_id, source="Página web texto", user_input="hola",
+                             language=language, dialog_response="respuesta", dialogflow_code=code,
+                             context_school=school).to_row()
+
+
+def _rating(interaction_id, rating):
+    return RatingEvent(session_id="s", interaction_id=interaction_id, rating=rating).to_row()
+
+
+def test_ratings_count_in_the_group_of_their_interaction():
+    school = next(iter(get_matcher().topics))
+    rollup = InteractionRollup()
+    rollup.add_interaction(_interaction("a", school))
+    rollup.add_interaction(_interaction("b", school, code="NOT_FOUND"))
+
+    rollup.add_rating(_rating("a", "like"))
+    rollup.add_rating(_rating("b", "like"))
+    # Cambio de opinión: se descuenta el like anterior
+    rollup.add_rating(_rating("b", "dislike"))
+    rollup.add_rating(_rating("desconocida", "like"))
+
+    total = summarize(rollup.rows(1), [])[0]
+    assert (total["interactions"], total["likes"], total["dislikes"]) == (2, 1, 1)
+    assert total["not_found_rate"] == 0.5
+    assert rollup.unmatched_ratings == 1
+
+
+def test_unknown_schools_and_languages_share_the_other_group():
+    rollup = InteractionRollup()
+    for n in range(3):
+        rollup.add_interaction(_interaction(f"i{n}", school=f"escuela inventada {n}", language=f"x{n}"))
+
+    groups = summarize(rollup.rows(1), ["school", "language"])
+    assert [(group["school"], group["language"], group["interactions"]) for group in groups] == [("other", "other", 3)]
@@ -0,0 +1,80 @@
+import io
+import threading
+import time
+import wave
+
+import pytest
+
+from fakes import FakeBackendError
+from services import speech_to_text
+from utils.clients import override
+
+
+class _Upload:
+    def __init__(self, data: bytes):
+        self.file = io.BytesIO(data)
+
+
+def _wav(seconds: float, rate: int = 16000) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(b"\0\0" * int(rate * seconds))
+    return buffer.getvalue()
+
+
+class _GrpcLikeClient:
+    """
+    Consume las peticiones desde un hilo propio, como gRPC, y falla mientras ese hilo sigue
+    dentro del generador de audio.
+    """
+
+    def __init__(self, inside: threading.Event):
+        self.inside = inside
+        self.consumer = None
+
+    def streaming_recognize(self, config=None, requests=None, **kwargs):
+        self.consumer = threading.Thread(target=lambda: [None for _ in requests], daemon=True)
+        self.consumer.start()
+        self.inside.wait(1)
+        raise FakeBackendError("Fallo simulado de Speech")
+
+
+@pytest.fixture
+def restore_speech(fakes):
+    yield
+    override("speech", fakes.speech)
+
+
+def test_streaming_sends_the_audio_in_chunks(fakes):
+    transcript = speech_to_text.transcribe_and_translate(_Upload(_wav(1.0)), streaming=True)
+
+    assert transcript == fakes.speech.transcript
+    assert fakes.speech.chunk_sizes
+
+
+def test_streaming_closes_the_audio_when_speech_fails_midway(monkeypatch, restore_speech):
+    inside = threading.Event()
+    closed = threading.Event()
+
+    def chunks():
+        try:
+            for _ in range(200):
+                inside.set()
+                time.sleep(0.005)
+                yield b"\0" * 320
+        finally:
+            closed.set()
+
+    monkeypatch.setattr(speech_to_text, "_audio_chunks", lambda file, max_seconds: (16000, chunks()))
+    client = _GrpcLikeClient(inside)
+    override("speech", client)
+
+    with pytest.raises(FakeBackendError):
+        speech_to_text.transcribe_and_translate(None, streaming=True)
+
+    assert closed.is_set()
+    client.consumer.join(1)
+    assert not client.consumer.is_alive()
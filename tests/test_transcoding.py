@@ -0,0 +1,32 @@
+import tempfile
+
+import pytest
+
+from services import transcoding
+from services.transcoding import TranscoderUnavailableError
+
+# Cabecera de un WebM (EBML): no es WAV, así que se comprueba con PyAV o ffprobe
+WEBM = b"\x1a\x45\xdf\xa3" + b"\0" * 2048
+
+
+@pytest.fixture
+def no_transcoder(monkeypatch, tmp_path):
+    monkeypatch.setattr(transcoding, "av", None)
+    monkeypatch.setenv("PATH", str(tmp_path))
+
+
+def test_probe_without_ffprobe_raises_unavailable_and_keeps_upload_in_memory(no_transcoder):
+    upload = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    upload.write(WEBM)
+    upload.seek(0)
+
+    with pytest.raises(TranscoderUnavailableError):
+        transcoding.probe_audio(upload, max_seconds=60)
+
+    assert not upload._rolled
+    assert upload.tell() == 0
+
+
+def test_voice_upload_without_transcoder_answers_503(no_transcoder, client):
+    response = client.post("/ask/voice", files={"file": ("pregunta.webm", WEBM, "audio/webm")})
+    assert response.status_code == 503
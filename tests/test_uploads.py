@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from starlette.responses import PlainTextResponse
+
+from utils.uploads import UploadLimitMiddleware, UploadTooLargeError
+
+
+async def _echo_length(scope, receive, send):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            break
+    await PlainTextResponse(str(len(body)))(scope, receive, send)
+
+
+def _call(app, chunks, headers=()):
+    """
+    Envía el cuerpo en `chunks` a la aplicación ASGI y devuelve (estado, trozos leídos). Los
+    trozos se consumen de la lista: los que quedan en ella no se llegaron a leer.
+    """
+    scope = {"type": "http", "method": "POST", "path": "/ask/voice", "headers": list(headers)}
+    pending = chunks
+    sent = []
+
+    async def receive():
+        chunk = pending.pop(0)
+        return {"type": "http.request", "body": chunk, "more_body": bool(pending)}
+
+    async def send(message):
+        sent.append(message)
+
+    total = len(chunks)
+    asyncio.run(app(scope, receive, send))
+    status = next(message["status"] for message in sent if message["type"] == "http.response.start")
+    return status, total - len(pending)
+
+
+def test_rejects_declared_content_length_without_reading():
+    app = UploadLimitMiddleware(_echo_length, paths={"/ask/voice"}, max_bytes=100)
+    status, read = _call(app, [b"x" * 200], headers=[(b"content-length", b"200")])
+    assert status == 413
+    assert read == 0
+
+
+def test_rejects_streamed_body_as_soon_as_it_exceeds_the_limit():
+    # Sin Content-Length el error salta al leer el trozo que supera el límite; FastAPI lo convierte en 413
+    app = UploadLimitMiddleware(_echo_length, paths={"/ask/voice"}, max_bytes=100)
+    chunks = [b"x" * 60, b"x" * 60, b"x" * 60, b"x" * 60]
+    with pytest.raises(UploadTooLargeError) as error:
+        _call(app, chunks)
+    assert error.value.status_code == 413
+    assert len(chunks) == 2
+
+
+def test_accepts_bodies_within_the_limit():
+    app = UploadLimitMiddleware(_echo_length, paths={"/ask/voice"}, max_bytes=100)
+    status, _ = _call(app, [b"x" * 50, b"x" * 50])
+    assert status == 200
+
+
+def test_app_answers_413_for_oversized_voice_upload(client):
+    from utils import uploads
+
+    response = client.post("/ask/voice", content=b"x" * (uploads.MAX_UPLOAD_BYTES + 1),
+                           headers={"Content-Type": "multipart/form-data; boundary=x"})
+    assert response.status_code == 413
+
+
+def test_app_answers_413_for_oversized_chunked_voice_upload(client):
+    from utils import uploads
+
+    def body():
+        for _ in range(uploads.MAX_UPLOAD_BYTES // 65536 + 2):
+            yield b"x" * 65536
+
+    response = client.post("/ask/voice", content=body(), headers={"Content-Type": "multipart/form-data; boundary=x"})
+    assert response.status_code == 413